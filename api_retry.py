@@ -0,0 +1,32 @@
+import random
+import time
+
+# Gemini と Google Calendar API の呼び出しで共通に使う再試行
+
+
+def error_status(error):
+    """例外から HTTP ステータスコードを取り出す（分からなければ None）"""
+    # google.api_core.exceptions.GoogleAPICallError は code、googleapiclient の HttpError は resp.status
+    code = getattr(error, "code", None)
+    if isinstance(code, int):
+        return code
+    resp = getattr(error, "resp", None)
+    status = getattr(resp, "status", None)
+    return int(status) if status is not None else None
+
+
+def is_retryable(error):
+    status = error_status(error)
+    return status is not None and (status == 429 or status >= 500)
+
+
+def call_with_retry(func, retries=5, base_delay=1.0, max_delay=32.0, sleep=time.sleep):
+    """429/5xx のときは指数バックオフ（ジッターつき）で再試行する"""
+    for attempt in range(retries + 1):
+        try:
+            return func()
+        except Exception as error:
+            if attempt == retries or not is_retryable(error):
+                raise
+            delay = min(max_delay, base_delay * 2 ** attempt)
+            sleep(delay * random.uniform(0.5, 1.0))
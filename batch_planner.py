@@ -0,0 +1,115 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from api_retry import call_with_retry
+from schedule_parser import parse_schedule
+
+DEFAULT_MAX_WORKERS = 4
+DEFAULT_REQUESTS_PER_MINUTE = 15
+DEFAULT_TOKENS_PER_MINUTE = 1000000
+# 1回のリクエストで使うトークン数の見積もり（プロンプト＋出力）。呼び出し側が指定しない場合に使う
+DEFAULT_TOKENS_PER_REQUEST = 2000
+
+
+class TokenBucket:
+    """容量 capacity、毎秒 rate ずつ補充されるトークンバケット（スレッドセーフ）"""
+
+    def __init__(self, capacity, rate, clock=time.monotonic, sleep=time.sleep):
+        self.capacity = capacity
+        self.rate = rate
+        self._tokens = capacity
+        self._clock = clock
+        self._sleep = sleep
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self, amount=1):
+        """amount 個のトークンが取れるまで待つ"""
+        amount = min(amount, self.capacity)
+        while True:
+            with self._lock:
+                now = self._clock()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= amount:
+                    self._tokens -= amount
+                    return
+                wait = (amount - self._tokens) / self.rate
+            self._sleep(wait)
+
+
+class RateLimiter:
+    """1分あたりのリクエスト数とトークン数を制限する"""
+
+    def __init__(self, requests_per_minute=DEFAULT_REQUESTS_PER_MINUTE,
+                 tokens_per_minute=DEFAULT_TOKENS_PER_MINUTE, **kwargs):
+        self.requests = TokenBucket(requests_per_minute, requests_per_minute / 60, **kwargs)
+        self.tokens = TokenBucket(tokens_per_minute, tokens_per_minute / 60, **kwargs)
+
+    def acquire(self, tokens=DEFAULT_TOKENS_PER_REQUEST):
+        self.requests.acquire(1)
+        self.tokens.acquire(tokens)
+
+
+class NullRateLimiter:
+    """レート制限を行わない（APIを呼ばずにローカルで作成する場合など）"""
+
+    def acquire(self, tokens=0):
+        pass
+
+
+class BatchPlanner:
+    """複数日のスケジュールを並行して生成する
+
+    generate(date, events_list, rate_limiter) はGeminiでテキストを生成する関数。1日分で複数回APIを呼ぶことや、
+    キャッシュから返してAPIを呼ばないことがあるので、APIを呼ぶたびに rate_limiter.acquire(トークン数) を
+    呼ぶ（gemini_integration.generate_schedule の rate_limiter 引数に渡す）。429/5xx は1日分ごと再試行される。
+    """
+
+    def __init__(self, generate, max_workers=DEFAULT_MAX_WORKERS, rate_limiter=None,
+                 retries=5, sleep=time.sleep):
+        self.generate = generate
+        self.max_workers = max_workers
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.retries = retries
+        self.sleep = sleep
+
+    def plan_day(self, target_date, events_list):
+        """1日分を生成・解析して (schedule_text, schedule) を返す。予定が無ければ (None, [])"""
+        if not events_list:
+            return None, []
+
+        schedule_text = call_with_retry(lambda: self.generate(target_date, events_list, self.rate_limiter),
+                                        retries=self.retries, sleep=self.sleep)
+        return schedule_text, parse_schedule(schedule_text)
+
+    def plan(self, events_by_day, on_day_done=None, is_cancelled=None):
+        """{date: events_list} の各日を並行して生成し、{date: (schedule_text, schedule) または例外} を返す
+
+        on_day_done(date, result, error) は1日終わるたびにワーカースレッドから呼ばれる。
+        is_cancelled() が True を返したら、まだ始まっていない日はスキップする。
+        """
+        results = {}
+
+        def run(target_date, events_list):
+            if is_cancelled is not None and is_cancelled():
+                return None
+            return self.plan_day(target_date, events_list)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers,
+                                thread_name_prefix="batch-planner") as executor:
+            futures = {executor.submit(run, target_date, events_list): target_date
+                       for target_date, events_list in events_by_day.items()}
+            for future in as_completed(futures):
+                target_date = futures[future]
+                try:
+                    result, error = future.result(), None
+                except Exception as exc:
+                    result, error = None, exc
+                if result is None and error is None:
+                    continue  # キャンセルされた日
+                results[target_date] = error if error is not None else result
+                if on_day_done is not None:
+                    on_day_done(target_date, result, error)
+        return dict(sorted(results.items()))
@@ -0,0 +1,594 @@
+"""解析→視覚化→埋め込みのホットパスを計測するベンチマーク
+
+Gemini と Google Calendar API はスタブに置き換えるため、オフラインで実行できる。
+結果は JSON で出力されるので、コミットごとの比較に使える。
+
+    python benchmark.py --output benchmark_results.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import types
+from datetime import date, datetime, timedelta
+
+import matplotlib
+matplotlib.use("Agg")
+
+SIZES = (20, 200, 1000)
+ACTIVITIES = ["睡眠", "朝食", "移動", "バイト", "昼食", "休憩", "自由時間", "夕食", "入浴", "勉強"]
+
+
+def synthetic_schedule_text(n_entries, seed=0):
+    """Geminiの出力を模したスケジュールテキストを作る
+
+    太字/非太字の行、日付をまたぐ行、空行や説明文などの解析対象外の行が混ざる。
+    """
+    rng = random.Random(seed)
+    lines = ["以下はスケジュールです。", ""]
+    minute = 7 * 60
+    for i in range(n_entries):
+        duration = rng.choice([15, 30, 45, 60, 90, 120])
+        start = minute % (24 * 60)
+        end = (minute + duration) % (24 * 60)
+        if i == n_entries - 1:
+            end = (start + 8 * 60) % (24 * 60)  # 最後は日付をまたぐ睡眠
+        activity = ACTIVITIES[i % len(ACTIVITIES)]
+        entry = f"{start // 60:02d}:{start % 60:02d}-{end // 60:02d}:{end % 60:02d} {activity}"
+        style = rng.random()
+        if style < 0.6:
+            lines.append(f"**{entry}**")
+        elif style < 0.85:
+            lines.append(entry)
+        else:
+            lines.append(f"  * **{entry}**")
+        if rng.random() < 0.1:
+            lines.append("")
+        minute += duration
+    lines.append("")
+    lines.append("※無理のない範囲で調整してください。")
+    return "\n".join(lines)
+
+
+def synthetic_schedule_json(n_entries, seed=0):
+    """構造化出力（JSON）を模した応答を作る。synthetic_schedule_text と同じ予定で、一部の項目は形式が崩れている"""
+    from schedule_parser import parse_schedule
+
+    rng = random.Random(seed)
+    items = []
+    for start, end, activity in parse_schedule(synthetic_schedule_text(n_entries, seed)):
+        if rng.random() < 0.05:
+            start = f"{int(start[:2])}時"  # 時刻の形式が違う項目
+        items.append({"start": start, "end": end, "activity": activity})
+    return json.dumps(items, ensure_ascii=False, indent=2)
+
+
+def synthetic_events(target_date, n_events=5):
+    """Calendar API の events().list の items を模した予定を作る"""
+    events = []
+    for i in range(n_events):
+        start = datetime.combine(target_date, datetime.min.time()) + timedelta(hours=9 + i * 2)
+        end = start + timedelta(hours=1)
+        events.append({
+            "id": f"event{i}",
+            "summary": "バイト" if i % 2 == 0 else f"予定{i}",
+            "start": {"dateTime": start.astimezone().isoformat()},
+            "end": {"dateTime": end.astimezone().isoformat()},
+        })
+    return events
+
+
+class FakeCalendarService:
+    """events().list / list_next だけを持つ Calendar API のスタブ"""
+
+    def __init__(self, items):
+        self.items = items
+
+    def events(self):
+        return self
+
+    def list(self, **params):
+        items = self.items
+        return types.SimpleNamespace(
+            execute=lambda **kwargs: {"items": items, "nextSyncToken": "token"})
+
+    def list_next(self, request, response):
+        return None
+
+
+def install_api_stubs():
+    """Gemini の呼び出しをネットワークに出ないスタブに置き換える"""
+    stub = types.ModuleType("gemini_integration")
+
+    def synthetic_response(output_format):
+        if output_format == "json":
+            return synthetic_schedule_json(20)
+        return synthetic_schedule_text(20)
+
+    def generate_schedule(target_date, events, refresh=False, output_format="json", rate_limiter=None):
+        return synthetic_response(output_format)
+
+    class TruncatedResponse(Exception):
+        pass
+
+    def generate_schedule_stream(target_date, events, refresh=False, output_format="json",
+                                 max_output_tokens=None):
+        text = synthetic_response(output_format)
+        for i in range(0, len(text), 40):
+            yield text[i:i + 40]
+
+    stub.generate_schedule = generate_schedule
+    stub.generate_schedule_stream = generate_schedule_stream
+    stub.TruncatedResponse = TruncatedResponse
+    sys.modules["gemini_integration"] = stub
+
+
+def measure(func, repeat):
+    """func を repeat 回実行し、各回の所要時間（秒）を返す"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def summarize(name, params, timings):
+    return {
+        "name": name,
+        "params": params,
+        "repeat": len(timings),
+        "mean": statistics.fmean(timings),
+        "median": statistics.median(timings),
+        "min": min(timings),
+        "max": max(timings),
+        "stdev": statistics.stdev(timings) if len(timings) > 1 else 0.0,
+    }
+
+
+def bench_parse(repeat):
+    """さまざまな大きさ・書式のテキストの解析"""
+    from schedule_parser import parse_entries, parse_schedule, parse_schedules
+
+    results = []
+    for size in SIZES:
+        text = synthetic_schedule_text(size)
+        results.append(summarize("parse_schedule", {"entries": size},
+                                 measure(lambda: parse_schedule(text), repeat)))
+        results.append(summarize("parse_entries", {"entries": size},
+                                 measure(lambda: parse_entries(text), repeat)))
+
+    # 1年分のテキストをまとめて解析する場合
+    texts = {i: synthetic_schedule_text(20, seed=i) for i in range(365)}
+    results.append(summarize("parse_schedules", {"days": len(texts), "entries": 20},
+                             measure(lambda: parse_schedules(texts), repeat)))
+    return results
+
+
+def bench_visualize(repeat):
+    """スケジュールの図の構築と Agg による描画（ヘッドレス）"""
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from schedule_parser import parse_schedule
+    from schedule_visualizer import visualize_schedule
+
+    results = []
+    target_date = date(2024, 1, 1)
+    for size in SIZES:
+        schedule = parse_schedule(synthetic_schedule_text(size))
+
+        def build():
+            with contextlib.redirect_stdout(io.StringIO()):
+                visualize_schedule(schedule, target_date)
+
+        def build_and_draw():
+            with contextlib.redirect_stdout(io.StringIO()):
+                fig = visualize_schedule(schedule, target_date)
+            FigureCanvasAgg(fig).draw()
+
+        params = {"entries": len(schedule)}
+        results.append(summarize("visualize_schedule.build", params, measure(build, repeat)))
+        results.append(summarize("visualize_schedule.agg_draw", params,
+                                 measure(build_and_draw, repeat)))
+
+    # 描画済みのPNGのキャッシュ（描画・メモリのヒット・ディスクのヒット）
+    from render_cache import RenderCache, make_render_key
+    from schedule_visualizer import DPI, render_png
+
+    schedule = parse_schedule(synthetic_schedule_text(20))
+    size = (800, 1200)
+    params = {"entries": len(schedule), "size": list(size)}
+    results.append(summarize("render_png", params, measure(
+        lambda: render_png(schedule, target_date, (), size), repeat)))
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "render.db")
+        cache = RenderCache(path)
+        key = make_render_key(schedule, target_date, (), size, DPI)
+        cache.put(key, *render_png(schedule, target_date, (), size))
+        results.append(summarize("render_cache.memory_hit", params, measure(
+            lambda: cache.get(key), repeat)))
+
+        def disk_hit():
+            disk_cache = RenderCache(path)
+            disk_cache.get(key)
+            disk_cache.close()
+
+        results.append(summarize("render_cache.disk_hit", params, measure(disk_hit, repeat)))
+        cache.close()
+    return results
+
+
+def bench_embed(repeat):
+    """FigureCanvasTkAgg への埋め込み（ディスプレイが無い環境ではスキップ）"""
+    import tkinter as tk
+    from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+    from schedule_parser import parse_schedule
+    from schedule_visualizer import visualize_schedule
+
+    try:
+        root = tk.Tk()
+    except tk.TclError as error:
+        return [{"name": "tk_embed", "skipped": str(error)}]
+
+    results = []
+    try:
+        schedule = parse_schedule(synthetic_schedule_text(20))
+        with contextlib.redirect_stdout(io.StringIO()):
+            fig = visualize_schedule(schedule, date(2024, 1, 1))
+
+        def embed():
+            canvas = FigureCanvasTkAgg(fig, master=root)
+            canvas.draw()
+            canvas.get_tk_widget().pack()
+            root.update_idletasks()
+            canvas.get_tk_widget().destroy()
+
+        results.append(summarize("tk_embed", {"entries": len(schedule)}, measure(embed, repeat)))
+
+        # CachedScheduleView で日付を切り替える場合（2回目以降はキャッシュのPNGを表示するだけ）
+        from render_cache import RenderCache
+        from schedule_visualizer import CachedScheduleView
+
+        schedules = [parse_schedule(synthetic_schedule_text(20, seed=i)) for i in range(2)]
+        state = {"i": 0}
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = RenderCache(os.path.join(tmp, "render.db"))
+            cached_view = CachedScheduleView(root, cache)
+            cached_view.get_tk_widget().pack()
+
+            def cached_switch():
+                state["i"] += 1
+                cached_view.update(schedules[state["i"] % 2], date(2024, 1, 1 + state["i"] % 2))
+                root.update_idletasks()
+
+            results.append(summarize("cached_schedule_view.switch", {"entries": len(schedule)},
+                                     measure(cached_switch, repeat)))
+            cache.close()
+    finally:
+        root.destroy()
+    return results
+
+
+def bench_store(repeat):
+    """スケジュールの保存・読み込みの往復"""
+    from schedule_parser import parse_schedule
+    from schedule_store import ScheduleStore
+
+    schedule = parse_schedule(synthetic_schedule_text(20))
+    text = synthetic_schedule_text(20)
+    results = []
+    for days in (30, 365, 3 * 365):
+        dates = [(date(2020, 1, 1) + timedelta(days=i)).isoformat() for i in range(days)]
+        with tempfile.TemporaryDirectory() as tmp:
+            store = ScheduleStore(os.path.join(tmp, "bench.db"), legacy_json=None)
+            store.save_many([(d, text, schedule) for d in dates])
+            params = {"days": days}
+            results.append(summarize("store.save_one", params, measure(
+                lambda: store.save(dates[-1], text, schedule), repeat)))
+            results.append(summarize("store.latest", params, measure(store.latest, repeat)))
+            store.close()
+            results.append(summarize("store.open_and_latest", params, measure(
+                lambda: ScheduleStore(os.path.join(tmp, "bench.db"), legacy_json=None).latest(),
+                repeat)))
+
+            # 以前の calendar_data.json 方式との比較
+            data = {d: {"schedule_text": text, "schedule": schedule} for d in dates}
+            path = os.path.join(tmp, "bench.json")
+
+            def json_round_trip():
+                with open(path, "w", encoding="utf-8") as f:
+                    json.dump(data, f, ensure_ascii=False, indent=2)
+                with open(path, "r", encoding="utf-8") as f:
+                    json.load(f)
+
+            results.append(summarize("json.round_trip", params, measure(json_round_trip, repeat)))
+    return results
+
+
+def bench_validate(repeat):
+    """スケジュールの重なり・予定との衝突の検証（1日分と保存した1年分）"""
+    from schedule_parser import parse_schedule
+    from schedule_store import ScheduleStore
+    from schedule_validator import validate, validate_many, validate_store
+
+    events_list = ["10:00～18:00: バイト", "19:00～20:00: 会議"]
+    results = []
+    for size in SIZES:
+        schedule = parse_schedule(synthetic_schedule_text(size))
+        results.append(summarize("validate", {"entries": size}, measure(
+            lambda: validate(schedule, events_list), repeat)))
+
+    schedules = {i: parse_schedule(synthetic_schedule_text(20, seed=i)) for i in range(365)}
+    results.append(summarize("validate_many", {"days": len(schedules), "entries": 20},
+                             measure(lambda: validate_many(schedules), repeat)))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = ScheduleStore(os.path.join(tmp, "bench.db"), legacy_json=None)
+        store.save_many([((date(2024, 1, 1) + timedelta(days=i)).isoformat(), "", schedule)
+                         for i, schedule in schedules.items()])
+        results.append(summarize("validate_store", {"days": len(schedules), "entries": 20},
+                                 measure(lambda: validate_store(store), repeat)))
+        store.close()
+    return results
+
+
+def bench_columns(repeat):
+    """列形式（NumPy）のスケジュール履歴に対する集計と、.npy の保存・メモリマップでの読み込み"""
+    from schedule_columns import ScheduleColumns
+    from schedule_parser import parse_schedule, to_minutes
+
+    results = []
+    for days in (365, 3 * 365):
+        schedules = {date(2020, 1, 1) + timedelta(days=i): parse_schedule(synthetic_schedule_text(20, seed=i))
+                     for i in range(days)}
+        params = {"days": days, "entries": 20}
+        results.append(summarize("columns.build", params, measure(
+            lambda: ScheduleColumns.from_schedules(schedules), repeat)))
+        columns = ScheduleColumns.from_schedules(schedules)
+
+        # 比較用: タプルのリストを毎回 "HH:MM" から解析して集計する場合
+        def python_time_per_activity():
+            totals = {}
+            for schedule in schedules.values():
+                for start, end, activity in schedule:
+                    minutes = (to_minutes(end) - to_minutes(start)) % (24 * 60)
+                    totals[activity] = totals.get(activity, 0) + minutes
+            return totals
+
+        results.append(summarize("python.time_per_activity", params,
+                                 measure(python_time_per_activity, repeat)))
+        results.append(summarize("columns.time_per_activity", params,
+                                 measure(columns.time_per_activity, repeat)))
+        results.append(summarize("columns.busiest_hours", params,
+                                 measure(columns.busiest_hours, repeat)))
+        results.append(summarize("columns.free_slots", params, measure(columns.free_slots, repeat)))
+
+        with tempfile.TemporaryDirectory() as tmp:
+            columns.save(tmp)
+            results.append(summarize("columns.load_mmap", params, measure(
+                lambda: ScheduleColumns.load(tmp), repeat)))
+            results.append(summarize("columns.load_mmap_and_query_month", params, measure(
+                lambda: ScheduleColumns.load(tmp).time_per_activity("2020-06-01", "2020-06-30"),
+                repeat)))
+    return results
+
+
+def bench_analytics(repeat):
+    """保存した1年分のスケジュールの集計（ストアからの全体の集計と、1日分の更新）"""
+    from schedule_analytics import ScheduleAnalytics
+    from schedule_parser import parse_schedule
+    from schedule_store import ScheduleStore
+
+    results = []
+    days = 365
+    params = {"days": days, "entries": 20}
+    with tempfile.TemporaryDirectory() as tmp:
+        store = ScheduleStore(os.path.join(tmp, "bench.db"), legacy_json=None)
+        store.save_many([((date(2024, 1, 1) + timedelta(days=i)).isoformat(), "",
+                          parse_schedule(synthetic_schedule_text(20, seed=i))) for i in range(days)])
+        results.append(summarize("analytics.from_store", params, measure(
+            lambda: ScheduleAnalytics.from_store(store), repeat)))
+
+        analytics = ScheduleAnalytics.from_store(store)
+        schedules = [parse_schedule(synthetic_schedule_text(20, seed=days + i)) for i in range(2)]
+        state = {"i": 0}
+
+        def update_day():
+            state["i"] += 1
+            analytics.update_day("2024-06-15", schedules[state["i"] % 2])
+
+        results.append(summarize("analytics.update_day", params, measure(update_day, repeat)))
+
+        def aggregates():
+            analytics.weekly_heatmap()
+            analytics.monthly_heatmap()
+            analytics.category_hours()
+            analytics.sleep_trend()
+
+        results.append(summarize("analytics.aggregates", params, measure(aggregates, repeat)))
+        store.close()
+    return results
+
+
+def bench_sync(repeat):
+    """予定の同期とローカルストアからの読み出し（Calendar API はスタブ）"""
+    from calendar_sync import EventStore, sync_calendar
+
+    results = []
+    target_date = date(2024, 1, 1)
+    for days in (7, 365):
+        items = []
+        for i in range(days):
+            day = target_date + timedelta(days=i)
+            for event in synthetic_events(day):
+                items.append(dict(event, id=f"{day.isoformat()}-{event['id']}"))
+        service = FakeCalendarService(items)
+        with tempfile.TemporaryDirectory() as tmp:
+            store = EventStore(os.path.join(tmp, "events.db"))
+            params = {"days": days, "events": len(items)}
+            results.append(summarize("sync_calendar.full", params, measure(
+                lambda: sync_calendar(service, store), repeat)))
+            results.append(summarize("event_store.events_for_date", params, measure(
+                lambda: store.events_for_date(target_date), repeat)))
+            store.close()
+    return results
+
+
+def bench_stream(repeat):
+    """チャンクごとに届く応答の逐次解析（Gemini のストリーミングを模したもの）
+
+    テキスト形式と JSON 形式のそれぞれについて、解析できなかった行（項目）の割合も記録する。
+    """
+    from schedule_parser import IncrementalJsonScheduleParser, IncrementalScheduleParser
+
+    results = []
+    for size in SIZES:
+        for output_format, parser_class, make_response in (
+                ("text", IncrementalScheduleParser, synthetic_schedule_text),
+                ("json", IncrementalJsonScheduleParser, synthetic_schedule_json)):
+            text = make_response(size)
+            chunks = [text[i:i + 40] for i in range(0, len(text), 40)]
+
+            def stream():
+                parser = parser_class()
+                for chunk in chunks:
+                    parser.feed(chunk)
+                parser.close()
+                return parser
+
+            stats = stream().stats()
+            result = summarize("incremental_parser", {"format": output_format, "entries": size,
+                                                      "chunks": len(chunks)},
+                               measure(stream, repeat))
+            result["unparsed_rate"] = stats.unparsed_rate
+            results.append(result)
+    return results
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+FIRST_FRAME_SCRIPT = """
+import sys, time
+start = time.perf_counter()
+sys.path.insert(0, {here!r})
+import tkinter as tk
+try:
+    root = tk.Tk()
+except tk.TclError as error:
+    print("skipped", error)
+    sys.exit(0)
+from calendar_app import CalendarApp
+app = CalendarApp(root, warm_up=False)
+root.update()
+print(time.perf_counter() - start)
+app.on_closing()
+"""
+
+
+def parse_importtime(stderr):
+    """-X importtime の出力を {モジュール: (自身の時間, 累積時間)}（秒）に変換する"""
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        modules[name.strip()] = (int(self_us) / 1e6, int(cumulative_us) / 1e6)
+    return modules
+
+
+def bench_startup(repeat):
+    """-X importtime による calendar_app のインポート時間とウィンドウの初回描画までの時間"""
+    results = []
+    import_timings = []
+    modules = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for _ in range(repeat):
+            proc = subprocess.run(
+                [sys.executable, "-X", "importtime", "-c",
+                 f"import sys; sys.path.insert(0, {HERE!r}); import calendar_app"],
+                capture_output=True, text=True, cwd=tmp, check=True)
+            modules = parse_importtime(proc.stderr)
+            import_timings.append(modules["calendar_app"][1])
+        result = summarize("import calendar_app", {}, import_timings)
+        heaviest = sorted(modules.items(), key=lambda item: item[1][0], reverse=True)[:10]
+        result["heaviest_modules"] = [{"module": name, "self": self_time, "cumulative": cumulative}
+                                      for name, (self_time, cumulative) in heaviest]
+        results.append(result)
+
+        frame_timings = []
+        for _ in range(repeat):
+            proc = subprocess.run([sys.executable, "-c", FIRST_FRAME_SCRIPT.format(here=HERE)],
+                                  capture_output=True, text=True, cwd=tmp, check=True)
+            output = proc.stdout.strip().splitlines()[-1]
+            if output.startswith("skipped"):
+                results.append({"name": "time_to_first_frame", "skipped": output[len("skipped "):]})
+                break
+            frame_timings.append(float(output))
+        if frame_timings:
+            results.append(summarize("time_to_first_frame", {}, frame_timings))
+    return results
+
+
+SUITES = {
+    "parse": bench_parse,
+    "visualize": bench_visualize,
+    "embed": bench_embed,
+    "store": bench_store,
+    "validate": bench_validate,
+    "columns": bench_columns,
+    "analytics": bench_analytics,
+    "sync": bench_sync,
+    "stream": bench_stream,
+    "startup": bench_startup,
+}
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--output", default="benchmark_results.json", help="結果のJSONファイル")
+    parser.add_argument("--repeat", type=int, default=10, help="各計測の繰り返し回数")
+    parser.add_argument("--suite", action="append", choices=sorted(SUITES),
+                        help="実行するスイート（複数指定可、省略時はすべて）")
+    args = parser.parse_args(argv)
+
+    install_api_stubs()
+    results = []
+    for name in args.suite or SUITES:
+        suite_results = SUITES[name](args.repeat)
+        for result in suite_results:
+            if "skipped" in result:
+                print(f"{result['name']:<32} skipped: {result['skipped']}")
+            else:
+                print(f"{result['name']:<32} {json.dumps(result['params']):<20} "
+                      f"median {result['median'] * 1000:9.3f} ms")
+        results.extend(suite_results)
+
+    report = {
+        "revision": git_revision(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"結果を {args.output} に保存しました。")
+
+
+if __name__ == "__main__":
+    main()
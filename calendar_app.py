@@ -1,24 +1,32 @@
 import tkinter as tk
 from tkinter import ttk, messagebox
-from datetime import date, datetime, timedelta
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-from google_calendar_api import get_events_for_date, get_credentials
-from schedule_parser import parse_schedule
-from schedule_visualizer import visualize_schedule
-from gemini_integration import generate_schedule
-import json
+from datetime import date, datetime, time, timedelta
+from calendar_sync import EventStore, sync_calendar
+from google_calendar_api import format_event
+from google_client import build_calendar_service, credentials as google_credentials
+from schedule_parser import (format_schedule, parse_json_schedule, IncrementalScheduleParser,
+                             IncrementalJsonScheduleParser, to_minutes)
+from schedule_validator import validate, validate_store
+from schedule_pipeline import SchedulePipeline
+from schedule_store import ScheduleStore
+from render_cache import RenderCache
+from notification_scheduler import NotificationScheduler
+from lazy_init import LazyValue, lazy_module
+from batch_planner import BatchPlanner, NullRateLimiter
+from instrumentation import tracer, traced
 import os
-from googleapiclient.discovery import build
+from concurrent.futures import ThreadPoolExecutor
 from googleapiclient.errors import HttpError
-import re
-import threading
-import time
+
+# ストリーミング中にグラフを描き直す間隔（ミリ秒）
+STREAM_CHART_INTERVAL_MS = 300
 
 class ScheduleEditDialog(tk.Toplevel):
-    def __init__(self, parent, schedule):
+    def __init__(self, parent, schedule, events_list=None):
         super().__init__(parent)
         self.title("スケジュール編集")
         self.schedule = schedule
+        self.events_list = events_list
         self.result = None
 
         self.create_widgets()
@@ -28,12 +36,19 @@ class ScheduleEditDialog(tk.Toplevel):
         self.tree.heading("開始時間", text="開始時間")
         self.tree.heading("終了時間", text="終了時間")
         self.tree.heading("活動", text="活動")
+        # 重なりや予定との衝突がある行は背景を赤くする
+        self.tree.tag_configure("conflict", background="#ffd6d6")
 
         for item in self.schedule:
             self.tree.insert("", "end", values=item)
 
         self.tree.pack(padx=10, pady=10)
 
+        self.problems_var = tk.StringVar()
+        ttk.Label(self, textvariable=self.problems_var, foreground="red",
+                  wraplength=500, justify=tk.LEFT).pack(padx=10)
+        self.highlight_conflicts()
+
         btn_frame = ttk.Frame(self)
         btn_frame.pack(pady=10)
 
@@ -42,6 +57,19 @@ class ScheduleEditDialog(tk.Toplevel):
         ttk.Button(btn_frame, text="削除", command=self.delete_item).pack(side=tk.LEFT, padx=5)
         ttk.Button(btn_frame, text="保存", command=self.save).pack(side=tk.LEFT, padx=5)
 
+    def current_schedule(self):
+        return [tuple(str(value) for value in self.tree.item(item)["values"])
+                for item in self.tree.get_children()]
+
+    def highlight_conflicts(self):
+        """現在の内容を検証し、問題のある行を強調して説明を表示する"""
+        schedule = self.current_schedule()
+        result = validate(schedule, self.events_list)
+        conflicts = result.conflict_indices
+        for index, item in enumerate(self.tree.get_children()):
+            self.tree.item(item, tags=("conflict",) if index in conflicts else ())
+        self.problems_var.set("\n".join(result.messages(schedule)))
+
     def add_item(self):
         # 新しいアイテムを追加するダイアログを表示
         pass
@@ -55,6 +83,7 @@ class ScheduleEditDialog(tk.Toplevel):
         selected_item = self.tree.selection()
         if selected_item:
             self.tree.delete(selected_item)
+            self.highlight_conflicts()
 
     def save(self):
         # 編集されたスケジュールを保存
@@ -94,7 +123,7 @@ class NotificationDialog(tk.Toplevel):
         self.destroy()
 
 class CalendarApp:
-    def __init__(self, master):
+    def __init__(self, master, warm_up=True):
         self.master = master
         master.title("Googleカレンダー予定取得")
         master.geometry("1000x800")  # ウィンドウサイズを拡大
@@ -124,6 +153,39 @@ class CalendarApp:
         self.get_events_button = ttk.Button(input_frame, text="予定を取得", command=self.get_events)
         self.get_events_button.grid(row=3, column=0, columnspan=2, padx=5, pady=10)
 
+        # チェックするとキャッシュを使わずにGeminiで再生成する
+        self.refresh_var = tk.BooleanVar(value=False)
+        self.refresh_check = ttk.Checkbutton(input_frame, text="キャッシュを使わずに再生成",
+                                             variable=self.refresh_var)
+        self.refresh_check.grid(row=4, column=0, columnspan=2, padx=5, pady=(0, 10))
+
+        # チェックするとGeminiを使わず、ローカルの規則で作成する
+        self.local_var = tk.BooleanVar(value=False)
+        self.local_check = ttk.Checkbutton(input_frame, text="ローカルで作成（Geminiを使わない）",
+                                           variable=self.local_var)
+        self.local_check.grid(row=7, column=0, columnspan=2, padx=5, pady=(0, 10))
+
+        # 入力した日付から指定日数分をまとめて作成する
+        self.days_label = ttk.Label(input_frame, text="日数:")
+        self.days_label.grid(row=5, column=0, padx=(0, 5), pady=5, sticky="e")
+        self.days_var = tk.StringVar(value="7")
+        self.days_spinbox = ttk.Spinbox(input_frame, from_=1, to=31, width=8,
+                                        textvariable=self.days_var)
+        self.days_spinbox.grid(row=5, column=1, padx=5, pady=5)
+        self.plan_range_button = ttk.Button(input_frame, text="期間でまとめて作成",
+                                            command=self.plan_range)
+        self.plan_range_button.grid(row=6, column=0, columnspan=2, padx=5, pady=10)
+
+        # 保存したすべてのスケジュールの重なりなどをまとめて調べる
+        self.check_saved_button = ttk.Button(input_frame, text="保存したスケジュールをチェック",
+                                             command=self.check_saved_schedules)
+        self.check_saved_button.grid(row=8, column=0, columnspan=2, padx=5, pady=10)
+
+        # 保存したスケジュールの時間帯・分類ごとの時間・睡眠時間の推移を表示する
+        self.analytics_button = ttk.Button(input_frame, text="保存したスケジュールの分析",
+                                           command=self.show_analytics)
+        self.analytics_button.grid(row=9, column=0, columnspan=2, padx=5, pady=10)
+
         # スケジュール表示用のテキストウィジェット
         self.output_text = tk.Text(master, height=15, width=80, state='disabled')
         self.output_text.grid(row=1, column=0, padx=10, pady=10, sticky="nsew")
@@ -136,20 +198,40 @@ class CalendarApp:
         master.grid_columnconfigure(1, weight=1)
         master.grid_rowconfigure(1, weight=1)
 
-        # canvasを初期化
-        self.canvas = None
+        # グラフは1つの CachedScheduleView を使い回す（初回表示時に作成）。
+        # 描画したPNGはメモリと render_cache.db に保存し、同じ内容なら描き直さない
+        self.schedule_view = None
+        self.render_cache = RenderCache()
+
+        # 分析の集計（初回表示時に作成し、以後は保存した日だけを集計し直す）と、その表示先
+        self.analytics = None
+        self.analytics_window = None
+        self.analytics_canvas = None
+        self._stream_chart_id = None  # ストリーミング中のグラフ更新（まとめて行う）
+        # グラフの描画（キャッシュしない途中の図・完成した図）はすべてこの1つのスレッドで行い、UIスレッドに送る。
+        # matplotlib はフォントなどをスレッド間で共有するため、同時に描画しない
+        self.render_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="chart-render")
+        self._preview_generation = 0  # ストリーミングを始める・終えるたびに増やし、古い図を捨てる
+        self._preview_running = False
+        self._preview_pending = False
+
+        # 読み込みの重いモジュールやAPIクライアントは初回使用時に作成する。
+        # ウィンドウが表示された後、バックグラウンドで先に準備しておく
+        self.calendar_service = LazyValue(self.create_calendar_service, name="calendar service")
+        self.visualizer = lazy_module("schedule_visualizer")
+        self.gemini = lazy_module("gemini_integration")
+        self.solver = lazy_module("schedule_solver")
+        self.warm_up = warm_up
+
+        # 予定はローカルのストアに同期し、そこから読み出す
+        self.event_store = EventStore()
 
-        self.service = None
-        try:
-            creds = get_credentials()
-            self.service = build("calendar", "v3", credentials=creds)
-        except HttpError as error:
-            messagebox.showerror("エラー", f"エラーが発生しました: {error}")
+        self.schedule = []  # スケジュールを保存するリストを初期化
+        self.events_list = None  # スケジュールの元になったカレンダーの予定（検証に使う）
+        self.streamed_schedule = []  # ストリーミング中に解析できた予定
 
-        self.data_file = "calendar_data.json"
-        self.data = {}  # データを格納するディクショナリを初期化
-        self.load_data()  # アプリケーション起動時にデータを読み込む
-        self.display_saved_data()  # 保存されたデータを表示
+        # スケジュールは日付ごとにSQLiteへ保存する（calendar_data.json があれば初回に取り込む）
+        self.schedule_store = ScheduleStore()
 
         # ウィンドウが閉じられる際にデータを保存するイベントを設定
         self.master.protocol("WM_DELETE_WINDOW", self.on_closing)
@@ -162,164 +244,571 @@ class CalendarApp:
         self.notify_button = ttk.Button(self.master, text="通知設定", command=self.set_notification)
         self.notify_button.grid(row=3, column=1, pady=5)
 
-        self.schedule = []  # スケジュールを保存するリストを初期化
-        self.notifications = []
-
-        # 通知チェックスレッドを開始
-        self.notification_thread = threading.Thread(target=self.check_notifications, daemon=True)
-        self.notification_thread.start()
+        # 処理状況を表示するステータスバー
+        status_frame = ttk.Frame(self.master)
+        status_frame.grid(row=4, column=0, columnspan=2, padx=10, pady=(0, 10), sticky="ew")
+        self.status_var = tk.StringVar(value="待機中")
+        self.status_label = ttk.Label(status_frame, textvariable=self.status_var)
+        self.status_label.pack(side=tk.LEFT)
+        self.progress = ttk.Progressbar(status_frame, mode="indeterminate", length=200)
+        self.progress.pack(side=tk.RIGHT)
+
+        # チェックすると、直前の処理の段階ごとの所要時間をステータスバーに表示する
+        self.show_timing_var = tk.BooleanVar(value=False)
+        self.show_timing_check = ttk.Checkbutton(status_frame, text="計測", variable=self.show_timing_var,
+                                                 command=self.show_timings)
+        self.show_timing_check.pack(side=tk.RIGHT, padx=5)
+        self.timing_var = tk.StringVar()
+        self.timing_label = ttk.Label(status_frame, textvariable=self.timing_var, foreground="gray")
+        self.timing_label.pack(side=tk.LEFT, padx=10)
+        self.run_started = None
+
+        # 予定取得〜スケジュール生成はバックグラウンドで実行する
+        self.pipeline = SchedulePipeline(self.master)
+
+        # 通知は発火時刻のヒープで管理し、期限が来たらUIスレッドで表示する
+        self.notification_scheduler = NotificationScheduler(self.deliver_notification)
+        for notification_id, notification_time, _, event in self.schedule_store.pending_notifications():
+            self.notification_scheduler.add(notification_time, event, notification_id)
+
+        # 保存されたデータの表示と初期化はウィンドウの描画後に行う
+        self.selected_date = None
+        self.master.after_idle(self.on_first_frame)
+
+    def on_first_frame(self):
+        self.display_saved_data()  # 保存されたデータを表示
+        if self.warm_up:
+            self.visualizer.warm()
+            self.calendar_service.warm()
+            self.gemini.warm(on_ready=lambda module: module.get_model())
+
+    def create_calendar_service(self):
+        """認証を行い Calendar API のクライアントを作成する（初回使用時・ワーカースレッド）"""
+        service = build_calendar_service()
+        # 以後はアクセストークンの期限が切れる前にバックグラウンドで更新する
+        google_credentials.start_auto_refresh()
+        return service
 
     def save_schedule(self, target_date, schedule_text, schedule):
-        """スケジュールデータを保存する"""
+        """スケジュールデータを保存する（その日付の1件だけを書き込む）"""
         date_str = target_date.strftime("%Y-%m-%d")
-        self.data = {  # 既存のデータを上書きする
-            date_str: {
-                "schedule_text": schedule_text,
-                "schedule": schedule
-            }
-        }
-        self.save_data()
-        print(f"データを保存しました: {self.data}")  # デバッグ用
-
-    def save_data(self):
-        """データをJSONファイルに保存する"""
-        with open(self.data_file, "w", encoding="utf-8") as f:
-            json.dump(self.data, f, ensure_ascii=False, indent=2)
-
-    def load_data(self):
-        """保存されたデータを読み込む"""
-        try:
-            with open(self.data_file, "r", encoding="utf-8") as f:
-                self.data = json.load(f)
-            print(f"データを読み込みました: {self.data}")  # デバッグ用
-        except FileNotFoundError:
-            print("データファイルが見つかりません。新しいファイルを作成します。")
-            self.data = {}
-        except json.JSONDecodeError:
-            print("JSONファイルの解析に失敗しました。新しいデータファイルを作成します。")
-            self.data = {}
+        self.schedule_store.save(date_str, schedule_text, schedule)
+        if self.analytics is not None:
+            self.analytics.update_day(date_str, schedule)
+        print(f"データを保存しました: {date_str}")  # デバッグ用
 
+    @traced("ui.saved_data")
     def display_saved_data(self):
         """保存されたデータを表示する"""
-        if self.data:
-            print("保存されたデータ:", self.data)  # デバッグ用
-            # 最新の日付のデータを探す
-            latest_date = None
-            for key in self.data.keys():
-                if key.startswith('20') and len(key) == 10:  # 日付形式のキーを探す
-                    if latest_date is None or key > latest_date:
-                        latest_date = key
-
-            if latest_date:
-                date = datetime.strptime(latest_date, "%Y-%m-%d").date()
-                saved_data = self.data[latest_date]
-
-                self.year_entry.delete(0, tk.END)
-                self.year_entry.insert(0, str(date.year))
-                self.month_entry.delete(0, tk.END)
-                self.month_entry.insert(0, str(date.month))
-                self.day_entry.delete(0, tk.END)
-                self.day_entry.insert(0, str(date.day))
-
-                self.output_text.config(state='normal')
-                self.output_text.delete(1.0, tk.END)
-                self.output_text.insert(tk.END, saved_data["schedule_text"])
-                self.output_text.config(state='disabled')
-
-                schedule = saved_data["schedule"]
-                fig = visualize_schedule(schedule, date)
-                if fig:
-                    if self.canvas:
-                        self.canvas.get_tk_widget().destroy()
-                    self.canvas = FigureCanvasTkAgg(fig, master=self.canvas_frame)
-                    self.canvas.draw()
-                    self.canvas.get_tk_widget().grid(row=0, column=0, sticky="nsew")
-                    self.canvas_frame.grid_columnconfigure(0, weight=1)
-                    self.canvas_frame.grid_rowconfigure(0, weight=1)
-                else:
-                    self.output_text.insert(tk.END, "\nスケジュールを視覚化できませんでした。")
+        latest_date, saved_data = self.schedule_store.latest()
+        if latest_date:
+            date = datetime.strptime(latest_date, "%Y-%m-%d").date()
+
+            self.year_entry.delete(0, tk.END)
+            self.year_entry.insert(0, str(date.year))
+            self.month_entry.delete(0, tk.END)
+            self.month_entry.insert(0, str(date.month))
+            self.day_entry.delete(0, tk.END)
+            self.day_entry.insert(0, str(date.day))
+
+            self.output_text.config(state='normal')
+            self.output_text.delete(1.0, tk.END)
+            self.output_text.insert(tk.END, saved_data["schedule_text"])
+
+            schedule = saved_data["schedule"]
+            self.selected_date = date
+            self.schedule = schedule
+            self.events_list = None
+            if schedule:
+                # matplotlib の読み込みを待たずにウィンドウを表示し、準備ができたらグラフを描く
+                self.visualizer.warm(on_ready=lambda module: self.pipeline.post(
+                    self.show_saved_chart, schedule, date))
             else:
-                print("有効な日付のデータが見つかりません。")
+                self.output_text.insert(tk.END, "\nスケジュールを視覚化できませんでした。")
+            self.output_text.config(state='disabled')
         else:
             print("保存されたデータがありません。")
 
+    STAGE_LABELS = {
+        "fetch": "予定を取得中...",
+        "generate": "Geminiでスケジュールを生成中...",
+        "parse": "スケジュールを解析中...",
+        "validate": "保存したスケジュールをチェック中...",
+        "analytics": "保存したスケジュールを集計中...",
+    }
+
+    def show_saved_chart(self, schedule, target_date):
+        # 読み込み中に別の日付が表示された場合は何もしない
+        if self.selected_date == target_date and not self.streamed_schedule:
+            self.show_schedule_chart(schedule, target_date, validate(schedule).conflict_indices)
+
+    def read_date(self):
+        """入力欄の年・月・日から date を作る（不正な場合は ValueError）"""
+        year = int(self.year_entry.get())
+        month = int(self.month_entry.get())
+        day = int(self.day_entry.get())
+        return date(year, month, day)
+
+    def read_options(self):
+        """生成方法の設定を読み取る（ワーカースレッドからTkの変数を読まないようにUIスレッドで呼ぶ）"""
+        return {"refresh": self.refresh_var.get(), "local": self.local_var.get()}
+
     def get_events(self):
         try:
-            year = int(self.year_entry.get())
-            month = int(self.month_entry.get())
-            day = int(self.day_entry.get())
-            target_date = date(year, month, day)
-            events = get_events_for_date(self.service, target_date)
+            target_date = self.read_date()
+        except ValueError:
+            messagebox.showerror("エラー", "無効な日付です。正しい日付を入力してください。")
+            return
+
+        self.selected_date = target_date
+        options = self.read_options()
+        self.progress.config(mode="indeterminate")
+        self.progress.start(15)
+        self.run_started = tracer.now()
+        # 別の日付が要求された場合、実行中のジョブはキャンセルされる
+        self.pipeline.submit(
+            [
+                ("fetch", lambda job, _: self.fetch_stage(target_date)),
+                ("generate", lambda job, state: self.generate_stage(job, state, options)),
+                ("parse", lambda job, state: self.parse_stage(state)),
+            ],
+            on_stage=self.on_pipeline_stage,
+            on_done=self.on_pipeline_done,
+            on_error=self.on_pipeline_error,
+        )
+
+    def sync_events(self):
+        """前回からの差分だけを取得してローカルのストアに反映する（ワーカースレッド）"""
+        try:
+            sync_calendar(self.calendar_service.get(), self.event_store)
+        except HttpError as error:
+            # 一度も同期できていなければ保存済みの予定も無いので、予定が無い日として扱わずにエラーにする
+            if self.event_store.get_sync_token('primary') is None:
+                raise
+            print(f'同期に失敗しました。保存済みの予定を使用します: {error}')
+
+    def fetch_stage(self, target_date):
+        """予定を同期し、Geminiに渡す文字列のリストに変換する（ワーカースレッド）"""
+        self.sync_events()
+        events = self.event_store.events_for_date(target_date)
+        events_list = [format_event(event) for event in events]
+        return {"date": target_date, "events_list": events_list,
+                "schedule_text": None, "schedule": []}
+
+    def generate_stage(self, job, state, options):
+        """Geminiを使用してスケジュールを立てる。行が届くたびにUIへ送る（ワーカースレッド）
+
+        Geminiには予定の配列をJSONで出力させ、解析できなかった場合は従来のテキスト形式で生成し直す。
+        ローカルで作成する設定のときは、規則に従って予定の周りに睡眠・食事などを配置する。
+        """
+        if not state["events_list"]:
+            return state
+        target_date, events_list = state["date"], state["events_list"]
+        if options["local"]:
+            solver = self.solver.get()
+            chunks = [format_schedule(solver.solve_schedule(events_list))]
+            parser = self.stream_schedule(job, state, chunks, IncrementalScheduleParser(), local=True)
+        else:
+            gemini = self.gemini.get()
+            parser = self.stream_gemini(job, state, gemini, options["refresh"], "json",
+                                        IncrementalJsonScheduleParser)
+            if not parser.schedule:
+                print("JSON形式の応答を解析できなかったため、テキスト形式で生成し直します。")
+                parser = self.stream_gemini(job, state, gemini, options["refresh"], "text",
+                                            IncrementalScheduleParser)
+        state["schedule_text"] = "\n".join(parser.lines)
+        state["schedule"] = parser.schedule
+        state["parse_stats"] = parser.stats()
+        state["local"] = options["local"]
+        return state
+
+    def stream_gemini(self, job, state, gemini, refresh, output_format, parser_class):
+        """Geminiの応答をストリーミングで解析する（ワーカースレッド）
+
+        応答が出力トークンの上限で打ち切られたときは、途中までの表示を捨てて上限を上げて生成し直す。
+        """
+        max_output_tokens = None
+        while True:
+            chunks = gemini.generate_schedule_stream(state["date"], state["events_list"], refresh=refresh,
+                                                     output_format=output_format,
+                                                     max_output_tokens=max_output_tokens)
+            try:
+                return self.stream_schedule(job, state, chunks, parser_class())
+            except gemini.TruncatedResponse as error:
+                print(f"応答が途中で打ち切られたため、出力の上限を {error.max_output_tokens} トークンにして"
+                      "生成し直します。")
+                max_output_tokens = error.max_output_tokens
+
+    def stream_schedule(self, job, state, chunks, parser, local=False):
+        """届いたチャンクを parser で解析し、完成した行をUIへ送る（ワーカースレッド）"""
+        job.post(self.begin_stream, state["events_list"], local)
+        for chunk in chunks:
+            job.check()
+            for line, entry in parser.feed(chunk):
+                job.post(self.on_stream_line, state["date"], line, entry)
+        for line, entry in parser.close():
+            job.post(self.on_stream_line, state["date"], line, entry)
+        return parser
+
+    def parse_stage(self, state):
+        """解析できなかった行の割合を記録し、スケジュールが規則を満たしているか確認する（ワーカースレッド）"""
+        if state["schedule_text"]:
+            stats = state["parse_stats"]
+            print(f"解析できなかった行: {stats.total - stats.parsed}/{stats.total}"
+                  f"（{stats.unparsed_rate:.0%}）")
+            state["validation"] = validate(state["schedule"], state["events_list"])
+            state["problems"] = (state["validation"].messages(state["schedule"])
+                                 + self.solver.get().validate_schedule(state["schedule"],
+                                                                       state["events_list"]))
+        return state
+
+    def plan_range(self):
+        """入力した日付から指定日数分のスケジュールをまとめて作成する"""
+        try:
+            start_date = self.read_date()
+            days = int(self.days_var.get())
+            if days < 1:
+                raise ValueError(days)
+        except ValueError:
+            messagebox.showerror("エラー", "無効な日付または日数です。正しい値を入力してください。")
+            return
 
+        dates = [start_date + timedelta(days=i) for i in range(days)]
+        options = self.read_options()
+        self.progress.stop()
+        self.progress.config(mode="determinate", maximum=days, value=0)
+        self.run_started = tracer.now()
+        self.pipeline.submit(
+            [
+                ("fetch", lambda job, _: self.fetch_range_stage(dates)),
+                ("generate", lambda job, events_by_day: self.plan_range_stage(job, events_by_day,
+                                                                             options)),
+            ],
+            on_stage=self.on_pipeline_stage,
+            on_done=self.on_range_done,
+            on_error=self.on_pipeline_error,
+        )
+
+    def fetch_range_stage(self, dates):
+        """同期は1回だけ行い、各日の予定をストアから読み出す（ワーカースレッド）"""
+        self.sync_events()
+        return {day: [format_event(event) for event in self.event_store.events_for_date(day)]
+                for day in dates}
+
+    def plan_range_stage(self, job, events_by_day, options):
+        """各日のスケジュールを並行して生成し、できた日から保存する（ワーカースレッド）"""
+        if options["local"]:
+            solver = self.solver.get()
+            planner = BatchPlanner(
+                lambda day, events, rate_limiter: format_schedule(solver.solve_schedule(events)),
+                rate_limiter=NullRateLimiter())
+        else:
+            gemini = self.gemini.get()
+            planner = BatchPlanner(
+                lambda day, events, rate_limiter: self.generate_day(gemini, day, events, options["refresh"],
+                                                                    rate_limiter))
+        done = [0]
+
+        def on_day_done(day, result, error):
+            done[0] += 1
+            if result is not None and result[0] is not None:
+                self.save_schedule(day, *result)
+            job.post(self.on_range_progress, day, done[0], len(events_by_day), error)
+
+        return planner.plan(events_by_day, on_day_done, is_cancelled=job.is_cancelled)
+
+    def generate_day(self, gemini, target_date, events_list, refresh=False, rate_limiter=None):
+        """1日分をJSON形式で生成してテキストにする。解析できなければテキスト形式で生成し直す
+
+        rate_limiter はAPIを呼ぶたびに generate_schedule の中で取得される（キャッシュのヒットでは取得しない）。
+        """
+        schedule = parse_json_schedule(gemini.generate_schedule(target_date, events_list, refresh=refresh,
+                                                                output_format="json",
+                                                                rate_limiter=rate_limiter))
+        if schedule:
+            return format_schedule(schedule)
+        return gemini.generate_schedule(target_date, events_list, refresh=refresh, output_format="text",
+                                        rate_limiter=rate_limiter)
+
+    def on_range_progress(self, day, done, total, error):
+        self.progress.config(value=done)
+        if error is not None:
+            print(f"{day} の生成に失敗しました: {error}")
+            self.status_var.set(f"{done}/{total}日 完了（{day.strftime('%m/%d')} は失敗）")
+        else:
+            self.status_var.set(f"{done}/{total}日 完了（{day.strftime('%m/%d')}）")
+
+    @traced("ui.range_done")
+    def on_range_done(self, results):
+        """期間のスケジュールを列に並べたグラフを別ウィンドウに表示する（UIスレッド）"""
+        schedules = {day: result[1] for day, result in results.items()
+                     if not isinstance(result, Exception) and result[1]}
+        failed = sum(isinstance(result, Exception) for result in results.values())
+        self.progress.config(value=0)
+        self.status_var.set(f"{len(schedules)}日分のスケジュールを作成しました"
+                            + (f"（{failed}日失敗）" if failed else ""))
+        conflicts = {day: validate(schedule).conflict_indices for day, schedule in schedules.items()}
+        fig = self.visualizer.get().visualize_week(schedules, conflicts)
+        if fig is None:
+            messagebox.showinfo("期間のスケジュール", "作成できたスケジュールがありません。")
+            return
+
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+
+        window = tk.Toplevel(self.master)
+        window.title("期間のスケジュール")
+        canvas = FigureCanvasTkAgg(fig, master=window)
+        with tracer.span("visualize.draw"):
+            canvas.draw()
+        canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True)
+        self.master.after_idle(self.show_timings)
+
+    def start_side_progress(self):
+        """読み取りだけのジョブの進捗表示。スケジュールの作成中はその進捗をそのまま残す"""
+        if not self.pipeline.is_running():
+            self.progress.config(mode="indeterminate")
+            self.progress.start(15)
+
+    def stop_side_progress(self):
+        if not self.pipeline.is_running():
+            self.progress.stop()
+
+    def check_saved_schedules(self):
+        """保存したスケジュールをすべて検証し、問題のある日を一覧で表示する
+
+        作成中のスケジュールのジョブはキャンセルしない（別の種類のジョブとして実行する）。
+        """
+        self.start_side_progress()
+        self.pipeline.submit(
+            [("validate", lambda job, _: validate_store(self.schedule_store))],
+            on_stage=self.on_pipeline_stage,
+            on_done=self.on_check_done,
+            on_error=self.on_side_error,
+            kind="check",
+        )
+
+    def on_check_done(self, results):
+        self.stop_side_progress()
+        self.status_var.set(f"{len(results)}日分のスケジュールに問題があります" if results
+                            else "保存したスケジュールに問題はありません")
+        self.output_text.config(state='normal')
+        self.output_text.delete('1.0', tk.END)
+        for date_str, (schedule, result) in results.items():
+            self.output_text.insert(tk.END, f"--- {date_str} ---\n")
+            self.output_text.insert(tk.END, "\n".join(result.messages(schedule)) + "\n")
+        self.output_text.config(state='disabled')
+
+    def show_analytics(self):
+        """保存したスケジュールの分析を表示する。集計は初回だけバックグラウンドで行う
+
+        作成中のスケジュールのジョブはキャンセルしない（別の種類のジョブとして実行する）。
+        """
+        if self.analytics is not None:
+            self.on_analytics_ready(self.analytics)
+            return
+        self.start_side_progress()
+        self.pipeline.submit(
+            [("analytics", lambda job, _: self.load_analytics_stage())],
+            on_stage=self.on_pipeline_stage,
+            on_done=self.on_analytics_ready,
+            on_error=self.on_side_error,
+            kind="analytics",
+        )
+
+    def load_analytics_stage(self):
+        """保存したすべての日を集計する（ワーカースレッド）"""
+        from schedule_analytics import ScheduleAnalytics
+
+        return ScheduleAnalytics.from_store(self.schedule_store)
+
+    @traced("ui.analytics")
+    def on_analytics_ready(self, analytics):
+        """分析のグラフを別ウィンドウに表示する。開いていれば描き直す（UIスレッド）"""
+        self.analytics = analytics
+        self.stop_side_progress()
+        self.status_var.set(f"{len(analytics)}日分のスケジュールを集計しました")
+        fig = self.visualizer.get().visualize_analytics(analytics)
+        if fig is None:
+            messagebox.showinfo("分析", "保存したスケジュールがありません。")
+            return
+
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+
+        if self.analytics_window is None or not self.analytics_window.winfo_exists():
+            self.analytics_window = tk.Toplevel(self.master)
+            self.analytics_window.title("保存したスケジュールの分析")
+        elif self.analytics_canvas is not None:
+            self.analytics_canvas.get_tk_widget().destroy()
+        self.analytics_canvas = FigureCanvasTkAgg(fig, master=self.analytics_window)
+        with tracer.span("visualize.draw"):
+            self.analytics_canvas.draw()
+        self.analytics_canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True)
+        self.analytics_window.lift()
+
+    # ステータスバーに表示するスパンと、その表示名
+    TIMING_SPANS = (
+        ("stage.fetch", "取得"),
+        ("calendar.credentials", "認証"),
+        ("calendar.sync", "同期"),
+        ("stage.generate", "生成"),
+        ("gemini.generate", "Gemini"),
+        ("stage.parse", "解析・検証"),
+        ("visualize.cached_update", "図の更新"),
+        ("visualize.week", "図の作成"),
+        ("visualize.draw", "描画"),
+    )
+
+    def show_timings(self):
+        """直前の処理の段階ごとの所要時間をステータスバーに表示する（計測がオンのとき）"""
+        if not self.show_timing_var.get() or self.run_started is None:
+            self.timing_var.set("")
+            return
+        spans = tracer.spans(since=self.run_started)
+        if not spans:
+            return
+        summary = tracer.summary(since=self.run_started)
+        parts = [f"{label} {summary[name]:.0f}ms" for name, label in self.TIMING_SPANS if name in summary]
+        # 開始から最後のスパンが終わるまで（ユーザーが待った時間）
+        total = (max(span.start + span.duration for span in spans) - self.run_started) / 1e6
+        self.timing_var.set(" | ".join(parts + [f"合計 {total:.0f}ms"]))
+        tracer.flush()
+
+    def on_pipeline_stage(self, stage):
+        self.status_var.set(self.STAGE_LABELS.get(stage, stage))
+
+    def on_pipeline_error(self, error):
+        self.progress.stop()
+        self.progress.config(value=0)
+        self.status_var.set("エラー")
+        messagebox.showerror("エラー", f"エラーが発生しました: {error}")
+
+    def on_side_error(self, error):
+        self.stop_side_progress()
+        messagebox.showerror("エラー", f"エラーが発生しました: {error}")
+
+    def show_events(self, events_list, local=False):
+        """取得した予定と提案の見出しをテキストウィジェットに表示する"""
+        self.output_text.config(state='normal')
+        self.output_text.delete('1.0', tk.END)
+        for event_str in events_list:
+            self.output_text.insert(tk.END, event_str + "\n")
+        if local:
+            self.output_text.insert(tk.END, "\n--- ローカルで作成したスケジュール ---\n")
+        else:
+            self.output_text.insert(tk.END, "\n--- Geminiによるスケジュール提案 ---\n")
+        self.output_text.config(state='disabled')
+
+    def begin_stream(self, events_list, local=False):
+        self.show_events(events_list, local)
+        self.cancel_streamed_chart()
+        self.streamed_schedule = []
+
+    def on_stream_line(self, target_date, line, entry):
+        """ストリーミング中に完成した1行を表示し、予定の行ならグラフにも追加する（UIスレッド）"""
+        self.output_text.config(state='normal')
+        self.output_text.insert(tk.END, line + "\n")
+        self.output_text.see(tk.END)
+        self.output_text.config(state='disabled')
+        if entry:
+            self.streamed_schedule.append(entry)
+            # 途中の図は描くのに時間がかかるので、一定の間隔でまとめてワーカーで描く
+            if self._stream_chart_id is None:
+                self._stream_chart_id = self.master.after(
+                    STREAM_CHART_INTERVAL_MS, self.show_streamed_chart, target_date)
+            self.status_var.set(f"Geminiでスケジュールを生成中...（{len(self.streamed_schedule)}件）")
+
+    def show_streamed_chart(self, target_date):
+        """途中のスケジュールの図をワーカーで描く。描画中なら終わってから最新の内容で描き直す"""
+        self._stream_chart_id = None
+        if not self.streamed_schedule:
+            return
+        if self._preview_running:
+            self._preview_pending = True
+            return
+        self._preview_running = True
+        view = self.get_schedule_view()
+        self.render_executor.submit(self.render_preview, self.visualizer.get(), self._preview_generation,
+                                     list(self.streamed_schedule), target_date, view.render_size())
+
+    def render_preview(self, visualizer, generation, schedule, target_date, size):
+        """途中のスケジュールを PNG にしてUIスレッドへ送る（描画用のスレッド）"""
+        try:
+            png, geometry = visualizer.render_png(schedule, target_date, (), size)
+        except Exception as error:
+            print(f"途中のスケジュールを描画できませんでした: {error}")
+            png = geometry = None
+        self.pipeline.post(self.on_preview_rendered, generation, target_date, png, geometry)
+
+    def on_preview_rendered(self, generation, target_date, png, geometry):
+        self._preview_running = False
+        if generation != self._preview_generation:
+            return  # ストリーミングが終わった後に届いた図は表示しない
+        if png is not None:
+            self.schedule_view.show_png(png, geometry)
+        if self._preview_pending:
+            self._preview_pending = False
+            self.show_streamed_chart(target_date)
+
+    def cancel_streamed_chart(self):
+        if self._stream_chart_id is not None:
+            self.master.after_cancel(self._stream_chart_id)
+            self._stream_chart_id = None
+        self._preview_generation += 1
+        self._preview_pending = False
+
+    @traced("ui.pipeline_done")
+    def on_pipeline_done(self, state):
+        """パイプラインの結果を表示して保存する（UIスレッド）"""
+        self.cancel_streamed_chart()
+        self.status_var.set("描画中...")
+        target_date = state["date"]
+        events_list = state["events_list"]
+
+        if not events_list:
             self.output_text.config(state='normal')
             self.output_text.delete('1.0', tk.END)
-
-            if not events:
-                self.output_text.insert(tk.END, "この日の予定はありません。")
+            self.output_text.insert(tk.END, "この日の予定はありません。")
+        else:
+            schedule_text = state["schedule_text"]
+            self.show_events(events_list, state.get("local", False))
+            self.output_text.config(state='normal')
+            self.output_text.insert(tk.END, schedule_text)
+            if state.get("problems"):
+                self.output_text.insert(tk.END, "\n\n--- 規則のチェック ---\n"
+                                        + "\n".join(state["problems"]))
+            print("Geminiが生成したスケジュール:")
+            print(schedule_text)
+
+            schedule = state["schedule"]
+            print("解析されたスケジュール:")
+            print(schedule)
+
+            if schedule:
+                conflicts = state["validation"].conflict_indices
+                if not self.show_schedule_chart(schedule, target_date, conflicts):
+                    self.output_text.insert(tk.END, "\nスケジュールを視覚化できませんでした。")
             else:
-                events_list = []
-                for event in events:
-                    start = event["start"].get("dateTime", event["start"].get("date"))
-                    end = event["end"].get("dateTime", event["end"].get("date"))
-                    if 'T' in start:
-                        start_dt = datetime.fromisoformat(start.replace('Z', '+00:00'))
-                        end_dt = datetime.fromisoformat(end.replace('Z', '+00:00'))
-                        start_str = start_dt.strftime("%H:%M")
-                        end_str = end_dt.strftime("%H:%M")
-                        event_str = f"{start_str}～{end_str}: {event['summary']}"
-                    else:
-                        event_str = f"終日: {event['summary']}"
-                    
-                    self.output_text.insert(tk.END, event_str + "\n")
-                    events_list.append(event_str)
-
-                # Geminiを使用してスケジュールを立てる
-                schedule_text = generate_schedule(target_date, events_list)
-                self.output_text.insert(tk.END, "\n--- Geminiによるスケジュール提案 ---\n" + schedule_text)
-                print("Geminiが生成したスケジュール:")
-                print(schedule_text)
-
-                # スケジュールを解析して視覚化
-                schedule = parse_schedule(schedule_text)
-                print("解析されたスケジュール:")
-                print(schedule)
-
-                if schedule:
-                    fig = visualize_schedule(schedule, target_date)
-                    if fig:
-                        # 既存のキャンバスを削除
-                        if self.canvas:
-                            self.canvas.get_tk_widget().destroy()
-
-                        # 新しいキャンバスを作成
-                        self.canvas = FigureCanvasTkAgg(fig, master=self.canvas_frame)
-                        self.canvas.draw()
-                        self.canvas.get_tk_widget().grid(row=0, column=0, sticky="nsew")
-                        self.canvas_frame.grid_columnconfigure(0, weight=1)
-                        self.canvas_frame.grid_rowconfigure(0, weight=1)
-                    else:
-                        self.output_text.insert(tk.END, "\nスケジュールを視覚化できませんでした。")
-                else:
-                    self.output_text.insert(tk.END, "\nスケジュールを解析できませんでした。")
-
-                # スケジュールデータを保存
-                self.save_schedule(target_date, schedule_text, schedule)
-
-                # スケジュールを生成し、self.scheduleに保存
-                self.schedule = schedule
+                self.output_text.insert(tk.END, "\nスケジュールを解析できませんでした。")
 
-            self.output_text.config(state='disabled')
-        except ValueError:
-            messagebox.showerror("エラー", "無効な日付です。正しい日付を入力してください。")
-        except HttpError as error:
-            messagebox.showerror("エラー", f"エラーが発生しました: {error}")
+            # スケジュールデータを保存
+            self.save_schedule(target_date, schedule_text, schedule)
+
+            # スケジュールを生成し、self.scheduleに保存
+            self.schedule = schedule
+            self.events_list = events_list
+
+        self.output_text.config(state='disabled')
+        self.progress.stop()
+        self.status_var.set("完了")
+        # グラフの再描画（draw_idle）が終わってから所要時間を表示する
+        self.master.after_idle(self.show_timings)
 
     def edit_schedule(self):
         if not self.schedule:
             messagebox.showwarning("警告", "編集するスケジュールがありません。まずスケジュールを生成してください。")
             return
 
-        dialog = ScheduleEditDialog(self.master, self.schedule)
+        dialog = ScheduleEditDialog(self.master, self.schedule, self.events_list)
         self.master.wait_window(dialog)
 
         if dialog.result:
@@ -334,18 +823,36 @@ class CalendarApp:
             self.output_text.insert(tk.END, f"{start}-{end} {activity}\n")
 
     def visualize_schedule(self):
-        # スケジュールを視覚化
-        fig = visualize_schedule(self.schedule, self.selected_date)
-        if fig:
-            if self.canvas:
-                self.canvas.get_tk_widget().destroy()
-            self.canvas = FigureCanvasTkAgg(fig, master=self.canvas_frame)
-            self.canvas.draw()
-            self.canvas.get_tk_widget().grid(row=0, column=0, sticky="nsew")
+        # スケジュールを視覚化（重なりなどの問題がある予定は強調する）
+        conflicts = validate(self.schedule, self.events_list).conflict_indices
+        if not self.show_schedule_chart(self.schedule, self.selected_date, conflicts):
+            self.output_text.insert(tk.END, "\nスケジュールを視覚化できませんでした。")
+
+    @traced("ui.show_chart")
+    def show_schedule_chart(self, schedule, target_date, conflicts=()):
+        """スケジュールをグラフに表示する。空の場合は False を返す。conflicts の位置の予定は強調する"""
+        if not schedule:
+            return False
+        self.get_schedule_view().update(schedule, target_date, conflicts)
+        return True
+
+    def get_schedule_view(self):
+        """グラフのビューを返す（初回に作成する）"""
+        if self.schedule_view is None:
+            # キャッシュに無い図は render_executor で描画する（UIスレッドで matplotlib を使わない）
+            self.schedule_view = self.visualizer.get().CachedScheduleView(
+                self.canvas_frame, self.render_cache, executor=self.render_executor,
+                post=self.pipeline.post)
+            self.schedule_view.get_tk_widget().grid(row=0, column=0, sticky="nsew")
             self.canvas_frame.grid_columnconfigure(0, weight=1)
             self.canvas_frame.grid_rowconfigure(0, weight=1)
-        else:
-            self.output_text.insert(tk.END, "\nスケジュールを視覚化できませんでした。")
+            # 「現在」の線を1分ごとに動かす
+            self.master.after(60 * 1000, self.tick_now_line)
+        return self.schedule_view
+
+    def tick_now_line(self):
+        self.schedule_view.update_now()
+        self.master.after(60 * 1000, self.tick_now_line)
 
     def set_notification(self):
         if not self.schedule:
@@ -358,45 +865,32 @@ class CalendarApp:
         if dialog.result:
             event, time_before = dialog.result
             notification_time = self.calculate_notification_time(event, time_before)
-            self.notifications.append((event, notification_time))
+            notification_id = self.notification_scheduler.add(notification_time, event)
+            self.schedule_store.add_notification(notification_id, notification_time,
+                                                 self.selected_date.strftime("%Y-%m-%d"), event)
             messagebox.showinfo("通知設定", f"イベント '{event[2]}' の通知を設定しました。")
 
     def calculate_notification_time(self, event, time_before):
-        event_time = datetime.strptime(f"{self.selected_date.strftime('%Y-%m-%d')} {event[0]}", "%Y-%m-%d %H:%M")
-        return event_time - timedelta(minutes=time_before)
+        # 開始時刻は0時からの分にして足す（日付と時刻の文字列を strptime で解析し直さない）
+        return datetime.combine(self.selected_date, time()) + timedelta(
+            minutes=to_minutes(event[0]) - time_before)
 
-    def check_notifications(self):
-        while True:
-            current_time = datetime.now()
-            for event, notification_time in self.notifications:
-                if current_time >= notification_time:
-                    self.show_notification(event)
-                    self.notifications.remove((event, notification_time))
-            time.sleep(60)  # 1分ごとにチェック
+    def deliver_notification(self, notification_id, event):
+        """スケジューラのスレッドから呼ばれる。保存済みの通知を削除し、表示はUIスレッドに任せる"""
+        self.schedule_store.delete_notification(notification_id)
+        self.pipeline.post(self.show_notification, event)
 
     def show_notification(self, event):
         messagebox.showinfo("予定の通知", f"イベント '{event[2]}' が間もなく始まります。")
 
     def on_closing(self):
         """ウィンドウが閉じられる際の処理"""
-        self.save_data()
+        self.notification_scheduler.close()
+        self.pipeline.shutdown()
+        self.render_executor.shutdown(wait=False, cancel_futures=True)
+        google_credentials.close()
+        tracer.close()
+        self.render_cache.close()
+        self.schedule_store.close()
+        self.event_store.close()
         self.master.destroy()
-
-def parse_schedule(schedule_text):
-    schedule = []
-    print("解析するスケジュールテキスト:")
-    print(schedule_text)
-    for line in schedule_text.split('\n'):
-        print(f"処理中の行: {line}")
-        # 修正された正規表現パターン
-        match = re.match(r'\*\*(\d{2}:\d{2})-(\d{2}:\d{2})\s*(.+)\*\*', line.strip())
-        if not match:
-            match = re.match(r'(\d{2}:\d{2})-(\d{2}:\d{2})\s*(.+)', line.strip())
-        if match:
-            start_time, end_time, activity = match.groups()
-            schedule.append((start_time, end_time, activity))
-            print(f"マッチした行: {start_time} - {end_time}: {activity}")
-        else:
-            print(f"マッチしなかった行: {line}")
-    print(f"解析されたスケジュール: {schedule}")
-    return schedule
\ No newline at end of file
@@ -0,0 +1,140 @@
+import json
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+from googleapiclient.errors import HttpError
+from google_calendar_api import parse_event_time
+from google_client import NUM_RETRIES
+from instrumentation import span, count
+
+DEFAULT_EVENT_DB = "calendar_events.db"
+
+
+class EventStore:
+    """Googleカレンダーの予定をローカルに保持するSQLiteストア"""
+
+    def __init__(self, path=DEFAULT_EVENT_DB):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS events ("
+                " calendar_id TEXT NOT NULL,"
+                " event_id TEXT NOT NULL,"
+                " start_ts REAL NOT NULL,"
+                " end_ts REAL NOT NULL,"
+                " payload TEXT NOT NULL,"
+                " PRIMARY KEY (calendar_id, event_id))"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS events_start ON events (calendar_id, start_ts)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS sync_state ("
+                " calendar_id TEXT PRIMARY KEY,"
+                " sync_token TEXT,"
+                " synced_at REAL)"
+            )
+
+    def get_sync_token(self, calendar_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT sync_token FROM sync_state WHERE calendar_id = ?", (calendar_id,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def apply_changes(self, calendar_id, events, sync_token, full=False):
+        """変更された予定を反映し、同期トークンを保存する（1トランザクション）
+
+        full=True のときはそのカレンダーの既存の予定をすべて置き換える。
+        status が cancelled の予定は削除として扱う。
+        """
+        upserts = []
+        deletes = []
+        for event in events:
+            if event.get('status') == 'cancelled' or 'start' not in event:
+                deletes.append((calendar_id, event['id']))
+                continue
+            start = parse_event_time(event['start'])
+            end = parse_event_time(event['end'])
+            upserts.append((calendar_id, event['id'], start.timestamp(), end.timestamp(),
+                            json.dumps(event, ensure_ascii=False)))
+
+        with self._lock, self._conn:
+            if full:
+                self._conn.execute("DELETE FROM events WHERE calendar_id = ?", (calendar_id,))
+            self._conn.executemany(
+                "DELETE FROM events WHERE calendar_id = ? AND event_id = ?", deletes
+            )
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO events (calendar_id, event_id, start_ts, end_ts, payload)"
+                " VALUES (?, ?, ?, ?, ?)", upserts
+            )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sync_state (calendar_id, sync_token, synced_at)"
+                " VALUES (?, ?, ?)", (calendar_id, sync_token, datetime.now().timestamp())
+            )
+
+    def events_between(self, start, end, calendar_ids=('primary',)):
+        """[start, end) と重なる予定を開始時刻順に返す"""
+        placeholders = ", ".join("?" for _ in calendar_ids)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT payload FROM events WHERE calendar_id IN ({placeholders})"
+                " AND start_ts < ? AND end_ts > ? ORDER BY start_ts",
+                (*calendar_ids, end.timestamp(), start.timestamp()),
+            ).fetchall()
+        return [json.loads(payload) for (payload,) in rows]
+
+    def events_for_date(self, date, calendar_ids=('primary',)):
+        """ローカル時刻でその日に重なる予定を返す"""
+        start = datetime.combine(date, datetime.min.time()).astimezone()
+        end = datetime.combine(date + timedelta(days=1), datetime.min.time()).astimezone()
+        return self.events_between(start, end, calendar_ids)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def _list_changes(service, **params):
+    """events().list を最後のページまで辿り、(予定のリスト, nextSyncToken) を返す"""
+    events = []
+    request = service.events().list(singleEvents=True, maxResults=2500, **params)
+    while request is not None:
+        with span("calendar.events_list", sync_token='syncToken' in params):
+            response = request.execute(num_retries=NUM_RETRIES)
+        count("calendar.api_calls")
+        count("calendar.events", len(response.get('items', [])))
+        events.extend(response.get('items', []))
+        sync_token = response.get('nextSyncToken')
+        request = service.events().list_next(request, response)
+    return events, sync_token
+
+
+def sync_calendar(service, store, calendar_id='primary'):
+    """syncToken を使って差分だけを取得し、ストアに反映する
+
+    同期トークンが無い場合や期限切れ（410 Gone）の場合は全件を取得し直す。
+    反映した予定の件数を返す。
+    """
+    with span("calendar.sync", calendar_id=calendar_id):
+        return _sync_calendar(service, store, calendar_id)
+
+
+def _sync_calendar(service, store, calendar_id):
+    sync_token = store.get_sync_token(calendar_id)
+    if sync_token:
+        try:
+            events, next_token = _list_changes(service, calendarId=calendar_id,
+                                               syncToken=sync_token)
+            store.apply_changes(calendar_id, events, next_token)
+            return len(events)
+        except HttpError as error:
+            if error.resp.status != 410:
+                raise
+            print(f"同期トークンが無効になりました。全件を取得し直します: {calendar_id}")
+
+    events, next_token = _list_changes(service, calendarId=calendar_id)
+    store.apply_changes(calendar_id, events, next_token, full=True)
+    return len(events)
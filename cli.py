@@ -0,0 +1,206 @@
+"""Tk を使わずにスケジュールを作成・書き出すコマンドラインツール
+
+日付の範囲を複数のプロセスで並行して処理し、PNG/SVG/ICS/JSON を書き出す。サーバーや cron での
+実行を想定しているため tkinter はインポートしない（Google の認証は token.json が必要）。
+
+    python cli.py --start 2024-07-01 --days 31 --format png --format ics --output-dir out
+"""
+import argparse
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date, datetime, timedelta, timezone
+
+import matplotlib
+matplotlib.use("Agg")
+
+FORMATS = ("png", "svg", "ics", "json")
+DEFAULT_WORKERS = min(4, os.cpu_count() or 1)
+
+# ワーカープロセスごとに1度だけ作成する Calendar API のクライアント
+_service = None
+
+
+def _init_worker():
+    global _service
+    from google_client import build_calendar_service
+
+    _service = build_calendar_service()
+
+
+def _generate(target_date, events_list, local, refresh):
+    """1日分のスケジュールのテキストを作る（Gemini の 429/5xx は再試行する）"""
+    from schedule_parser import format_schedule, parse_json_schedule
+
+    if local:
+        from schedule_solver import solve_schedule
+        return format_schedule(solve_schedule(events_list))
+
+    from api_retry import call_with_retry
+    from gemini_integration import generate_schedule
+
+    response = call_with_retry(lambda: generate_schedule(target_date, events_list, refresh=refresh,
+                                                         output_format="json"))
+    schedule = parse_json_schedule(response)
+    if schedule:
+        return format_schedule(schedule)
+    return call_with_retry(lambda: generate_schedule(target_date, events_list, refresh=refresh,
+                                                     output_format="text"))
+
+
+def _render(schedule, target_date, conflicts, paths):
+    """図を作って書き出し、すぐに破棄する（1日ごとにメモリを解放する）"""
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from schedule_visualizer import visualize_schedule
+
+    fig = visualize_schedule(schedule, target_date, conflicts)
+    if fig is None:
+        return
+    canvas = FigureCanvasAgg(fig)
+    for path in paths:
+        canvas.print_figure(path)
+    fig.clear()
+
+
+def _ics_time(target_date, minutes):
+    day = target_date + timedelta(days=minutes // (24 * 60))
+    minutes %= 24 * 60
+    return f"{day.strftime('%Y%m%d')}T{minutes // 60:02d}{minutes % 60:02d}00"
+
+
+def _ics_text(value):
+    return (value.replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,")
+            .replace("\n", "\\n"))
+
+
+def ics_events(target_date, schedule):
+    """スケジュールを VEVENT の行のリストにする（日付をまたぐ予定は翌日に終わる）"""
+    from schedule_validator import block_minutes
+
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    lines = []
+    for index, item in enumerate(schedule):
+        start, end, _ = block_minutes(item)
+        if end < start:
+            end += 24 * 60
+        lines += [
+            "BEGIN:VEVENT",
+            f"UID:{target_date.isoformat()}-{index}@schedule",
+            f"DTSTAMP:{stamp}",
+            f"DTSTART:{_ics_time(target_date, start)}",
+            f"DTEND:{_ics_time(target_date, end)}",
+            f"SUMMARY:{_ics_text(item[2])}",
+            "END:VEVENT",
+        ]
+    return lines
+
+
+def ics_calendar(vevents):
+    return "\r\n".join(["BEGIN:VCALENDAR", "VERSION:2.0", "PRODID:-//schedule//cli//JA",
+                        *vevents, "END:VCALENDAR"]) + "\r\n"
+
+
+def process_day(target_date, output_dir, formats, local=False, refresh=False):
+    """1日分を 取得→生成→解析→検証→書き出し する（ワーカープロセス）
+
+    (日付, 予定, テキスト, スケジュール) を返す。予定が無い日は何も書き出さない。
+    """
+    from google_calendar_api import format_event, get_events_for_date
+    from schedule_parser import parse_schedule
+    from schedule_validator import validate
+
+    events_list = [format_event(event) for event in get_events_for_date(_service, target_date)]
+    if not events_list:
+        return target_date, events_list, None, []
+
+    schedule_text = _generate(target_date, events_list, local, refresh)
+    schedule = parse_schedule(schedule_text)
+    validation = validate(schedule, events_list)
+
+    base = os.path.join(output_dir, target_date.isoformat())
+    images = [f"{base}.{fmt}" for fmt in ("png", "svg") if fmt in formats]
+    if images and schedule:
+        _render(schedule, target_date, validation.conflict_indices, images)
+    if "json" in formats:
+        with open(f"{base}.json", "w", encoding="utf-8") as f:
+            json.dump({
+                "date": target_date.isoformat(),
+                "events": events_list,
+                "schedule_text": schedule_text,
+                "schedule": [{"start": start, "end": end, "activity": activity}
+                             for start, end, activity in schedule],
+                "problems": validation.messages(schedule),
+            }, f, ensure_ascii=False, indent=2)
+    if "ics" in formats:
+        with open(f"{base}.ics", "w", encoding="utf-8", newline="") as f:
+            f.write(ics_calendar(ics_events(target_date, schedule)))
+    return target_date, events_list, schedule_text, schedule
+
+
+def parse_date(value):
+    return datetime.strptime(value, "%Y-%m-%d").date()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="スケジュールを作成してファイルに書き出す（GUIなし）")
+    parser.add_argument("--start", type=parse_date, default=date.today(),
+                        help="開始日（YYYY-MM-DD、既定は今日）")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--end", type=parse_date, help="終了日（YYYY-MM-DD、この日を含む）")
+    group.add_argument("--days", type=int, default=1, help="開始日からの日数（既定は1）")
+    parser.add_argument("--format", action="append", choices=FORMATS, dest="formats",
+                        help="書き出す形式（複数指定可、既定は png と json）")
+    parser.add_argument("--output-dir", default="schedules", help="書き出し先のディレクトリ")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="プロセス数")
+    parser.add_argument("--local", action="store_true", help="Geminiを使わずローカルの規則で作成する")
+    parser.add_argument("--refresh", action="store_true", help="Geminiの応答キャッシュを使わない")
+    parser.add_argument("--save", action="store_true",
+                        help="作成したスケジュールを calendar_data.db にも保存する（GUIで表示できる）")
+    args = parser.parse_args(argv)
+
+    end = args.end or args.start + timedelta(days=args.days - 1)
+    if end < args.start:
+        parser.error("終了日が開始日より前です。")
+    formats = set(args.formats or ("png", "json"))
+    dates = [args.start + timedelta(days=i) for i in range((end - args.start).days + 1)]
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    results = {}
+    failed = 0
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker) as executor:
+        futures = {executor.submit(process_day, day, args.output_dir, formats, args.local, args.refresh): day
+                   for day in dates}
+        for future in as_completed(futures):
+            day = futures[future]
+            try:
+                _, events_list, schedule_text, schedule = future.result()
+            except Exception as error:
+                failed += 1
+                print(f"{day}: 失敗しました: {error}", file=sys.stderr)
+                continue
+            if schedule_text is None:
+                print(f"{day}: 予定がありません。")
+                continue
+            results[day] = (schedule_text, schedule)
+            print(f"{day}: {len(schedule)}件の予定を書き出しました。")
+
+    if "ics" in formats and len(results) > 1:
+        path = os.path.join(args.output_dir, f"{dates[0].isoformat()}_{dates[-1].isoformat()}.ics")
+        vevents = [line for day in sorted(results) for line in ics_events(day, results[day][1])]
+        with open(path, "w", encoding="utf-8", newline="") as f:
+            f.write(ics_calendar(vevents))
+
+    if args.save and results:
+        from schedule_store import ScheduleStore
+
+        store = ScheduleStore()
+        store.save_many([(day.isoformat(), text, schedule) for day, (text, schedule) in results.items()])
+        store.close()
+
+    print(f"{len(results)}日分を {args.output_dir} に書き出しました" + (f"（{failed}日失敗）" if failed else ""))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,28 +1,79 @@
+import logging
 import os
+import time
+from datetime import timedelta
 from dotenv import load_dotenv
 import google.generativeai as genai
+from google.generativeai import caching
 from google.generativeai.types import HarmCategory, HarmBlockThreshold
+from schedule_cache import ResponseCache, make_cache_key
+from lazy_init import LazyValue
+from prompt_builder import PromptBuilder, SYSTEM_INSTRUCTION, compact_events, estimate_tokens
+from schedule_parser import parse_json_entries
+from instrumentation import span, count
 
-# .envファイルから環境変数を読み込む
-load_dotenv()
+logger = logging.getLogger(__name__)
 
-# 環境変数からAPIキーを取得
-api_key = os.getenv('GOOGLE_API_KEY')
+model_id = "gemini-1.5-flash-001"  # input 0.35/MTokens - output 1.05/MTokens
 
-# APIキーが取得できたか確認
-if not api_key:
-    raise ValueError("GOOGLE_API_KEYが設定されていません。.envファイルを確認してください。")
+# コンテキストキャッシュを作成できる最小のトークン数と、キャッシュの有効期間（秒）
+CONTEXT_CACHE_MIN_TOKENS = 32768
+CONTEXT_CACHE_TTL = 60 * 60
+_context_cache_expires = None
 
-genai.configure(api_key=api_key)
+def _create_model():
+    global _context_cache_expires
 
-model_id = "gemini-1.5-flash-001"  # input 0.35/MTokens - output 1.05/MTokens
+    # .envファイルから環境変数を読み込む
+    load_dotenv()
+
+    # 環境変数からAPIキーを取得
+    api_key = os.getenv('GOOGLE_API_KEY')
+
+    # APIキーが取得できたか確認
+    if not api_key:
+        raise ValueError("GOOGLE_API_KEYが設定されていません。.envファイルを確認してください。")
+
+    genai.configure(api_key=api_key)
+
+    # 固定の指示はコンテキストキャッシュに置く。小さすぎてキャッシュできない場合や
+    # 作成に失敗した場合は system_instruction として送る
+    _context_cache_expires = None
+    if estimate_tokens(SYSTEM_INSTRUCTION) >= CONTEXT_CACHE_MIN_TOKENS:
+        try:
+            cached = caching.CachedContent.create(
+                model=model_id, display_name="schedule-instruction",
+                system_instruction=SYSTEM_INSTRUCTION, ttl=timedelta(seconds=CONTEXT_CACHE_TTL))
+            _context_cache_expires = time.time() + CONTEXT_CACHE_TTL
+            return genai.GenerativeModel.from_cached_content(cached)
+        except Exception as error:
+            logger.warning("コンテキストキャッシュを作成できませんでした: %s", error)
+
+    # モデル情報の初期化
+    return genai.GenerativeModel(model_id, system_instruction=SYSTEM_INSTRUCTION)
+
+# モデルは初回の生成時（またはアプリのバックグラウンド初期化）に作成する
+def _create_model_traced():
+    with span("gemini.create_model"):
+        return _create_model()
+
+_model = LazyValue(_create_model_traced, name="gemini model")
 
-# モデル情報の初期化
-model = genai.GenerativeModel(model_id)
+def get_model():
+    # コンテキストキャッシュの期限が近ければモデルを作り直す
+    if _context_cache_expires is not None and time.time() > _context_cache_expires - 60:
+        _model.reset()
+    return _model.get()
+
+def _count_tokens(text):
+    return get_model().count_tokens(text).total_tokens
+
+# 予定を圧縮し、入力トークンの予算内に収める
+prompt_builder = PromptBuilder(count_tokens=_count_tokens)
 
 # 生成AIのパラメータ設定
 generation_config = {
-    "max_output_tokens": 8192,
+    "max_output_tokens": 8192,  # 呼び出しごとに予想される行数から小さくする
     "temperature": 0.7,
 }
 safety_settings = {
@@ -32,25 +83,218 @@ safety_settings = {
     HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_LOW_AND_ABOVE,
 }
 
-def generate_schedule(date, events):
-    prompt = f"""
-    {date.strftime('%Y年%m月%d日')}の予定は以下の通りです：
+# 構造化出力（JSON）のスキーマ。"json" では正規表現を使わずに予定を読み込める
+RESPONSE_SCHEMA = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {
+            "start": {"type": "string"},
+            "end": {"type": "string"},
+            "activity": {"type": "string"},
+        },
+        "required": ["start", "end", "activity"],
+    },
+}
+# 出力形式の既定値（"json" または従来の "text"）
+OUTPUT_FORMAT = "json"
+
+# プロンプトの文面を変更したら上げる（キャッシュキーに含まれる）
+PROMPT_VERSION = 4
+
+# 出力トークンの上限で打ち切られた応答は、上限を倍にして（この値まで）生成し直す
+OUTPUT_TOKEN_CEILING = generation_config["max_output_tokens"]
+# FinishReason の値と名前（SDK によっては enum ではなく数値で返る）
+FINISH_REASONS = {1: "STOP", 2: "MAX_TOKENS", 3: "SAFETY", 4: "RECITATION", 5: "OTHER"}
+
+class TruncatedResponse(Exception):
+    """ストリーミングの応答が出力トークンの上限で打ち切られた
+
+    届いたチャンクは途中までなので、受信側は表示・解析をやり直し、
+    max_output_tokens を指定して generate_schedule_stream を呼び直す。
+    """
+
+    def __init__(self, max_output_tokens):
+        super().__init__(f"応答が出力トークンの上限で打ち切られました（次の上限: {max_output_tokens}）")
+        self.max_output_tokens = max_output_tokens
+
+# 応答キャッシュ（初回使用時に作成）
+_response_cache = LazyValue(ResponseCache, name="response cache")
+
+def get_response_cache():
+    return _response_cache.get()
+
+def build_prompt(date, events, output_format=OUTPUT_FORMAT):
+    """予定を圧縮したプロンプトを作る（prompt_builder.Prompt を返す）"""
+    with span("gemini.prompt", events=len(events)):
+        return prompt_builder.build(date, events, output_format)
+
+def _cached_response(cache, key):
+    """キャッシュを引き、ヒット・ミスを数える"""
+    cached = cache.get(key)
+    if cached is None:
+        count("gemini.cache_misses")
+    else:
+        count("gemini.cache_hits")
+        count("gemini.cache_bytes", len(cached.encode("utf-8")))
+    return cached
+
+def _cache_key(date, events, output_format):
+    """キャッシュキーを作る。予定はローカルの規則だけで圧縮する（トークン数を数えるAPIを呼ばない）"""
+    config = dict(generation_config, output_format=output_format)
+    if output_format == "json":
+        config["response_schema"] = RESPONSE_SCHEMA
+    return make_cache_key(PROMPT_VERSION, model_id, config, date, compact_events(events))
+
+def _request_config(prompt, output_format):
+    """generate_content に渡す generation_config を返す"""
+    config = dict(generation_config, max_output_tokens=prompt.max_output_tokens)
+    if output_format == "json":
+        config["response_mime_type"] = "application/json"
+        config["response_schema"] = RESPONSE_SCHEMA
+    return config
+
+def _finish_reason(response):
+    """応答（ストリーミングでは最後のチャンク）の finish_reason の名前。候補が無ければ None"""
+    candidates = getattr(response, "candidates", None) or ()
+    if not candidates:
+        return None
+    reason = getattr(candidates[0], "finish_reason", None)
+    return getattr(reason, "name", None) or FINISH_REASONS.get(reason)
+
+def _response_text(response):
+    """応答のテキスト。ブロックされた・空の応答（text が ValueError を送出する）は "" """
+    try:
+        return response.text
+    except ValueError:
+        return ""
+
+def _cacheable(finish_reason, text, output_format):
+    """最後まで生成され（STOP）、空でなく、JSON なら予定を読み取れる応答だけをキャッシュする"""
+    if finish_reason != "STOP" or not text.strip():
+        return False
+    return output_format != "json" or bool(parse_json_entries(text))
+
+def _store(cache, key, finish_reason, text, output_format):
+    if _cacheable(finish_reason, text, output_format):
+        cache.put(key, text)
+    else:
+        count("gemini.uncached")
+        logger.warning("応答をキャッシュしません（finish_reason=%s, %d文字）", finish_reason, len(text))
+
+def _next_output_tokens(max_output_tokens):
+    """打ち切られたときに次に使う上限。すでに OUTPUT_TOKEN_CEILING なら None"""
+    if max_output_tokens >= OUTPUT_TOKEN_CEILING:
+        return None
+    return min(OUTPUT_TOKEN_CEILING, max_output_tokens * 2)
+
+def _log_metrics(prompt, n_events, usage, elapsed, response_text, max_output_tokens, first_chunk=None):
+    """1回の呼び出しのトークン数と所要時間を記録する"""
+    count("gemini.api_calls")
+    count("gemini.input_tokens", getattr(usage, "prompt_token_count", 0) or 0)
+    count("gemini.output_tokens", getattr(usage, "candidates_token_count", 0) or 0)
+    count("gemini.response_bytes", len(response_text.encode("utf-8")))
+    logger.info(
+        "gemini: events=%d->%d input_tokens=%s (estimate %d) cached_tokens=%s output_tokens=%s/%d "
+        "latency=%.0fms%s",
+        n_events, len(prompt.events),
+        getattr(usage, "prompt_token_count", None), prompt.input_tokens,
+        getattr(usage, "cached_content_token_count", None),
+        getattr(usage, "candidates_token_count", None), max_output_tokens,
+        elapsed * 1000,
+        f" first_chunk={first_chunk * 1000:.0f}ms" if first_chunk is not None else "",
+    )
+
+def generate_schedule(date, events, refresh=False, output_format=OUTPUT_FORMAT, rate_limiter=None):
+    """スケジュールを生成する。同じ日付・予定ならキャッシュを返す（refresh=Trueで再生成）
+
+    output_format が "json" のときは予定の配列の JSON、"text" のときは従来の形式のテキストを返す。
+    出力トークンの上限で打ち切られた応答はキャッシュせず、上限を倍にして生成し直す。
+    空の応答・ブロックされた応答・読み取れない JSON もキャッシュしない。
+    rate_limiter（batch_planner.RateLimiter など）を渡すと、APIを呼ぶたびに（キャッシュのヒットでは呼ばない）
+    入力と出力の上限のトークン数を取得する。
+    """
+    # キャッシュを先に引く（プロンプトを作るとトークン数を数えるAPIを呼ぶことがある）
+    cache = get_response_cache()
+    key = _cache_key(date, events, output_format)
+    if not refresh:
+        cached = _cached_response(cache, key)
+        if cached is not None:
+            return cached
+    prompt = build_prompt(date, events, output_format)
+    config = _request_config(prompt, output_format)
 
-    {chr(10).join(events)}
+    while True:
+        if rate_limiter is not None:
+            rate_limiter.acquire(prompt.input_tokens + config["max_output_tokens"])
+        started = time.perf_counter()
+        with span("gemini.generate", format=output_format):
+            response = get_model().generate_content(prompt.text, generation_config=config)
+        text = _response_text(response)
+        finish_reason = _finish_reason(response)
+        _log_metrics(prompt, len(events), response.usage_metadata, time.perf_counter() - started,
+                     text, config["max_output_tokens"])
+        if finish_reason != "MAX_TOKENS":
+            _store(cache, key, finish_reason, text, output_format)
+            return text
+        count("gemini.truncated")
+        next_tokens = _next_output_tokens(config["max_output_tokens"])
+        if next_tokens is None:
+            logger.warning("応答が出力トークンの上限（%d）で打ち切られました（キャッシュしません）",
+                           config["max_output_tokens"])
+            return text
+        logger.warning("応答が出力トークンの上限（%d）で打ち切られたため、上限 %d で生成し直します",
+                       config["max_output_tokens"], next_tokens)
+        config["max_output_tokens"] = next_tokens
 
-    これらの予定を考慮して、以下の点に注意しながら1日のスケジュールを立ててください：
-    1. 予定の間に適切な休憩時間を入れてください。
-    2. 朝食、昼食、夕食の時間を確保してください。
-    3. バイト先に行くのに1時間、帰るのに1時間かかるので、その時間を確保してください。
-    4. 予定で指定された時間以外はバイトをいれることができません。
-    5. 睡眠時間を8時間確保してください。
-    6. スケジュールは必ず「**HH:MM-HH:MM 活動内容**」の形式で記述してください。例: **07:00-08:00 朝食**
-    7. 備考を出力しないでください。
-    8. バイトの予定がないとき、移動時間を入れないでください。
-    9. 移動時間は、バイトの時間に含まれません。
+def generate_schedule_stream(date, events, refresh=False, output_format=OUTPUT_FORMAT,
+                             max_output_tokens=None):
+    """スケジュールをストリーミングで生成し、届いたテキストのチャンクを順に返すジェネレータ
 
-    スケジュール：
+    キャッシュにあればその全文を1つのチャンクとして返す。最後まで受信できた応答はキャッシュに保存する
+    （空の応答・ブロックされた応答・読み取れない JSON は保存しない）。
+    出力トークンの上限で打ち切られた応答はキャッシュせず、最後のチャンクの後で TruncatedResponse を送出する
+    （上限がすでに最大のときは警告だけ出して終わる）。max_output_tokens で上限を指定できる。
     """
+    cache = get_response_cache()
+    key = _cache_key(date, events, output_format)
+    if not refresh and max_output_tokens is None:
+        cached = _cached_response(cache, key)
+        if cached is not None:
+            yield cached
+            return
+    prompt = build_prompt(date, events, output_format)
+    config = _request_config(prompt, output_format)
+    if max_output_tokens is not None:
+        config["max_output_tokens"] = max_output_tokens
 
-    response = model.generate_content(prompt)
-    return response.text
\ No newline at end of file
+    chunks = []
+    usage = None
+    last = None
+    first_chunk = None
+    started = time.perf_counter()
+    # ストリーミング中の受信側（解析・UIへの送信）の時間もこのスパンに含まれる
+    with span("gemini.generate", format=output_format, stream=True):
+        for chunk in get_model().generate_content(prompt.text, generation_config=config, stream=True):
+            if first_chunk is None:
+                first_chunk = time.perf_counter() - started
+            usage = chunk.usage_metadata
+            last = chunk
+            chunk_text = _response_text(chunk)
+            if chunk_text:
+                chunks.append(chunk_text)
+                yield chunk_text
+    text = "".join(chunks)
+    finish_reason = _finish_reason(last)
+    _log_metrics(prompt, len(events), usage, time.perf_counter() - started, text,
+                 config["max_output_tokens"], first_chunk)
+    if finish_reason != "MAX_TOKENS":
+        _store(cache, key, finish_reason, text, output_format)
+        return
+    count("gemini.truncated")
+    next_tokens = _next_output_tokens(config["max_output_tokens"])
+    if next_tokens is None:
+        logger.warning("応答が出力トークンの上限（%d）で打ち切られました（キャッシュしません）",
+                       config["max_output_tokens"])
+        return
+    raise TruncatedResponse(next_tokens)
@@ -1,39 +1,121 @@
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
-import os.path
 from datetime import datetime, timedelta
-
-SCOPES = ["https://www.googleapis.com/auth/calendar.readonly"]
+from instrumentation import span, count
+from api_retry import call_with_retry
+from google_client import NUM_RETRIES, SCOPES, credentials
 
 def get_credentials():
-    creds = None
-    if os.path.exists('token.json'):
-        creds = Credentials.from_authorized_user_file('token.json', SCOPES)
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            flow = InstalledAppFlow.from_client_secrets_file(
-                'credentials.json', SCOPES)
-            creds = flow.run_local_server(port=0)
-        with open('token.json', 'w') as token:
-            token.write(creds.to_json())
-    return creds
+    """有効な認証情報を返す（google_client.credentials がメモリに保持し、期限前に更新する）"""
+    return credentials.get()
+
+def format_event(event):
+    """予定を「HH:MM～HH:MM: 件名」（終日の予定は「終日: 件名」）の文字列にする"""
+    start = event["start"].get("dateTime", event["start"].get("date"))
+    end = event["end"].get("dateTime", event["end"].get("date"))
+    if 'T' in start:
+        start_dt = datetime.fromisoformat(start.replace('Z', '+00:00'))
+        end_dt = datetime.fromisoformat(end.replace('Z', '+00:00'))
+        start_str = start_dt.strftime("%H:%M")
+        end_str = end_dt.strftime("%H:%M")
+        return f"{start_str}～{end_str}: {event['summary']}"
+    return f"終日: {event['summary']}"
 
 def get_events_for_date(service, date):
     start_time = datetime.combine(date, datetime.min.time()).isoformat() + 'Z'
     end_time = datetime.combine(date + timedelta(days=1), datetime.min.time()).isoformat() + 'Z'
     
-    try:
+    # 429/5xx は再試行し、それでも失敗したら例外にする（予定が無い日と区別できるように空のリストは返さない）
+    with span("calendar.events_list"):
         events_result = service.events().list(calendarId='primary', timeMin=start_time,
                                               timeMax=end_time, singleEvents=True,
-                                              orderBy='startTime').execute()
-        events = events_result.get('items', [])
-        
-        return events  # 元の形式のイベントリストを返す
-    except HttpError as error:
-        print(f'エラーが発生しました: {error}')
-        return []
\ No newline at end of file
+                                              orderBy='startTime').execute(num_retries=NUM_RETRIES)
+    events = events_result.get('items', [])
+    count("calendar.api_calls")
+    count("calendar.events", len(events))
+
+    return events  # 元の形式のイベントリストを返す
+
+# Calendar API のバッチリクエストに含められる最大件数
+MAX_BATCH_SIZE = 50
+
+def parse_event_time(value):
+    """イベントの start/end をローカル時刻の datetime に変換する"""
+    if 'dateTime' in value:
+        return datetime.fromisoformat(value['dateTime'].replace('Z', '+00:00')).astimezone()
+    day = datetime.strptime(value['date'], '%Y-%m-%d')
+    return day.astimezone()
+
+def _list_all_pages(service, requests):
+    """{キー: events().list リクエスト} をバッチで実行し、nextPageToken がなくなるまで辿る"""
+    items = {key: [] for key in requests}
+    pending = dict(requests)
+    while pending:
+        responses = {}
+
+        def callback(request_id, response, exception):
+            if exception is not None:
+                raise exception
+            responses[request_id] = response
+
+        def execute_batch(chunk):
+            batch = service.new_batch_http_request(callback=callback)
+            for key in chunk:
+                batch.add(pending[key], request_id=key)
+            with span("calendar.batch", requests=len(chunk)):
+                batch.execute()
+            count("calendar.api_calls")
+
+        # バッチの execute() には再試行が無いので、429/5xx はバッチごと再試行する
+        keys = list(pending)
+        for i in range(0, len(keys), MAX_BATCH_SIZE):
+            chunk = keys[i:i + MAX_BATCH_SIZE]
+            call_with_retry(lambda: execute_batch(chunk))
+
+        next_pending = {}
+        for key, request in pending.items():
+            response = responses[key]
+            items[key].extend(response.get('items', []))
+            count("calendar.events", len(response.get('items', [])))
+            next_request = service.events().list_next(request, response)
+            if next_request is not None:
+                next_pending[key] = next_request
+        pending = next_pending
+    return items
+
+def get_events_for_range(service, start, end, calendar_ids=('primary',)):
+    """start〜end（両端を含む）の予定を複数カレンダーからまとめて取得し、ローカルの日付ごとに振り分ける
+
+    戻り値は {date: [event, ...]}。範囲内のすべての日付をキーに持ち、各リストは開始時刻順。
+    複数日にまたがる予定は重なっているすべての日に含まれる。
+    """
+    time_min = datetime.combine(start, datetime.min.time()).astimezone()
+    time_max = datetime.combine(end + timedelta(days=1), datetime.min.time()).astimezone()
+
+    requests = {
+        calendar_id: service.events().list(calendarId=calendar_id,
+                                           timeMin=time_min.isoformat(),
+                                           timeMax=time_max.isoformat(),
+                                           singleEvents=True, orderBy='startTime',
+                                           maxResults=2500)
+        for calendar_id in calendar_ids
+    }
+    items = _list_all_pages(service, requests)
+
+    days = {}
+    day = start
+    while day <= end:
+        days[day] = []
+        day += timedelta(days=1)
+
+    for calendar_events in items.values():
+        for event in calendar_events:
+            event_start = parse_event_time(event['start'])
+            event_end = parse_event_time(event['end'])
+            day = event_start.date()
+            last_day = (event_end - timedelta(microseconds=1)).date() if event_end > event_start else day
+            while day <= last_day:
+                if day in days:
+                    days[day].append((event_start, event))
+                day += timedelta(days=1)
+
+    return {day: [event for _, event in sorted(bucket, key=lambda item: item[0])]
+            for day, bucket in days.items()}
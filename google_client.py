@@ -0,0 +1,186 @@
+import logging
+import os
+import tempfile
+import threading
+from datetime import datetime, timezone
+
+from instrumentation import span, count
+
+logger = logging.getLogger(__name__)
+
+SCOPES = ["https://www.googleapis.com/auth/calendar.readonly"]
+TOKEN_FILE = "token.json"
+CLIENT_SECRETS_FILE = "credentials.json"
+# アクセストークンの期限のこの秒数前に、バックグラウンドで更新する
+REFRESH_MARGIN = 5 * 60
+# 更新に失敗したときに再び試すまでの秒数
+REFRESH_RETRY_DELAY = 60
+# execute() の再試行回数（429/5xx・接続エラーはライブラリが指数バックオフで再試行する）
+NUM_RETRIES = 5
+HTTP_TIMEOUT = 30
+
+
+def _utcnow():
+    # google-auth の expiry はタイムゾーンなしのUTC
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class CredentialManager:
+    """OAuth の認証情報をメモリに保持し、期限が切れる前に更新する
+
+    token.json は最初の1回だけ読み込む。更新した認証情報の書き込みはバックグラウンドで行い、
+    一時ファイルに書いてから置き換えるので途中で終了しても壊れない。
+    更新は同じ Credentials オブジェクトに対して行うため、作成済みのクライアントもそのまま使える。
+    """
+
+    def __init__(self, token_path=TOKEN_FILE, client_secrets=CLIENT_SECRETS_FILE, scopes=SCOPES,
+                 refresh_margin=REFRESH_MARGIN):
+        self.token_path = token_path
+        self.client_secrets = client_secrets
+        self.scopes = scopes
+        self.refresh_margin = refresh_margin
+        self._lock = threading.RLock()
+        self._write_lock = threading.Lock()
+        self._creds = None
+        self._request = None
+        self._timer = None
+        self._writer = None
+        self._closed = False
+
+    def get(self):
+        """有効な認証情報を返す（必要なら読み込み・更新・ブラウザでの認証を行う）"""
+        with span("calendar.credentials"), self._lock:
+            if self._creds is None:
+                self._creds = self._load()
+            if self._creds is None or (not self._creds.valid and not self._creds.refresh_token):
+                self._creds = self._authorize()
+                self._save_async()
+            elif self._needs_refresh():
+                self._refresh()
+            return self._creds
+
+    def start_auto_refresh(self):
+        """期限の refresh_margin 秒前に更新するタイマーを動かす（以後は更新のたびに次を予約する）"""
+        with self._lock:
+            self._schedule()
+
+    def close(self):
+        """タイマーを止め、書き込み中の token.json があれば終わるのを待つ"""
+        with self._lock:
+            self._closed = True
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            writer = self._writer
+        if writer is not None:
+            writer.join()
+
+    def _load(self):
+        from google.oauth2.credentials import Credentials
+
+        if not os.path.exists(self.token_path):
+            return None
+        return Credentials.from_authorized_user_file(self.token_path, self.scopes)
+
+    def _authorize(self):
+        from google_auth_oauthlib.flow import InstalledAppFlow
+
+        with span("calendar.oauth_flow"):
+            flow = InstalledAppFlow.from_client_secrets_file(self.client_secrets, self.scopes)
+            return flow.run_local_server(port=0)
+
+    def _needs_refresh(self):
+        creds = self._creds
+        if not creds.valid:
+            return True
+        return (creds.expiry is not None
+                and (creds.expiry - _utcnow()).total_seconds() < self.refresh_margin)
+
+    def _refresh(self):
+        # 認証まわりのライブラリは読み込みが重いため、使うときにインポートする
+        from google.auth.transport.requests import Request
+
+        if self._request is None:
+            self._request = Request()  # セッション（接続）を使い回す
+        with span("calendar.oauth_refresh"):
+            self._creds.refresh(self._request)
+        count("calendar.oauth_refreshes")
+        self._save_async()
+        self._schedule()
+
+    def _schedule(self, delay=None):
+        if self._closed or self._creds is None:
+            return
+        if delay is None:
+            if self._creds.expiry is None:
+                return
+            delay = max(0, (self._creds.expiry - _utcnow()).total_seconds() - self.refresh_margin)
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = threading.Timer(delay, self._on_timer)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _on_timer(self):
+        with self._lock:
+            self._timer = None
+            if self._closed:
+                return
+            try:
+                self._refresh()
+            except Exception as error:
+                logger.warning("認証情報を更新できませんでした（%d秒後に再試行します）: %s",
+                               REFRESH_RETRY_DELAY, error)
+                self._schedule(REFRESH_RETRY_DELAY)
+
+    def _save_async(self):
+        data = self._creds.to_json()
+        self._writer = threading.Thread(target=self._write, args=(data,), name="token-writer")
+        self._writer.start()
+
+    def _write(self, data):
+        # 一時ファイルは書き込みごとに別の名前にする（cli のワーカープロセスが同時に更新して書き込んでも壊れない）
+        with self._write_lock:
+            fd, tmp = tempfile.mkstemp(prefix=".token-", suffix=".tmp",
+                                       dir=os.path.dirname(self.token_path) or ".")
+            try:
+                with os.fdopen(fd, "w") as token:
+                    token.write(data)
+                os.replace(tmp, self.token_path)
+            except BaseException:
+                os.unlink(tmp)
+                raise
+
+
+# アプリ全体で共有する認証情報
+credentials = CredentialManager()
+
+
+def build_calendar_service(manager=None):
+    """Calendar API のクライアントを作る
+
+    ディスカバリ文書はライブラリに同梱されたものを使う（static_discovery、ネットワークに出ない）。
+    httplib2.Http はスレッドセーフでないため、HTTP の接続はスレッドごとの AuthorizedHttp で使い回す。
+    """
+    import google_auth_httplib2
+    import httplib2
+    from googleapiclient.discovery import build
+    from googleapiclient.http import HttpRequest
+
+    creds = (manager or credentials).get()
+    local = threading.local()
+
+    def thread_http():
+        http = getattr(local, "http", None)
+        if http is None:
+            http = local.http = google_auth_httplib2.AuthorizedHttp(
+                creds, http=httplib2.Http(timeout=HTTP_TIMEOUT))
+            count("calendar.http_connections")
+        return http
+
+    def build_request(http, *args, **kwargs):
+        return HttpRequest(thread_http(), *args, **kwargs)
+
+    with span("calendar.build_service"):
+        return build("calendar", "v3", http=thread_http(), requestBuilder=build_request,
+                     static_discovery=True, cache_discovery=False)
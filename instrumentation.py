@@ -0,0 +1,149 @@
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import NamedTuple
+
+# この環境変数でファイル名を指定すると、スパンとカウンタを1行1イベントで書き出す
+TRACE_FILE_ENV = "SCHEDULE_TRACE_FILE"
+# メモリに保持する直近のスパンの数
+MAX_RECENT_SPANS = 5000
+
+
+class Span(NamedTuple):
+    """計測した1区間。start・duration はナノ秒（perf_counter_ns）"""
+    name: str
+    start: int
+    duration: int
+    thread_id: int
+    args: dict
+
+
+class Tracer:
+    """処理の区間（スパン）とカウンタを記録する
+
+    直近のスパンはメモリに保持する。path を指定すると、Chrome のトレースイベント形式のオブジェクト
+    （スパンは "ph": "X"、カウンタは "ph": "C"）を1行に1つずつ書き出す（JSONL）。
+    """
+
+    def __init__(self, path=None, max_spans=MAX_RECENT_SPANS):
+        self.path = path
+        self._lock = threading.Lock()
+        self._spans = deque(maxlen=max_spans)
+        self._counters = {}
+        self._file = None
+        self._pid = os.getpid()
+        # 追記したファイルで実行ごとの時刻が重ならないよう、開始時のUNIX時刻を基準にする
+        self._origin = time.perf_counter_ns()
+        self._epoch_us = time.time() * 1e6
+
+    @staticmethod
+    def now():
+        return time.perf_counter_ns()
+
+    @contextmanager
+    def span(self, name, **args):
+        """with の中の処理時間を記録する。as で受け取った dict に値を入れると args として残る"""
+        start = time.perf_counter_ns()
+        try:
+            yield args
+        finally:
+            self.record(name, start, time.perf_counter_ns(), **args)
+
+    def record(self, name, start_ns, end_ns, **args):
+        """開始・終了時刻（perf_counter_ns）が分かっている区間を記録する"""
+        span = Span(name, start_ns, end_ns - start_ns, threading.get_ident(), args)
+        with self._lock:
+            self._spans.append(span)
+            if self.path:
+                self._write(self._span_event(span))
+
+    def count(self, name, value=1):
+        """カウンタ name に value を足す（API呼び出し回数・トークン数・キャッシュヒット・バイト数など）"""
+        with self._lock:
+            total = self._counters.get(name, 0) + value
+            self._counters[name] = total
+            if self.path:
+                self._write({"name": name, "ph": "C", "ts": self._ts(time.perf_counter_ns()),
+                             "pid": self._pid, "args": {"value": total}})
+
+    def counters(self):
+        with self._lock:
+            return dict(self._counters)
+
+    def spans(self, since=None):
+        """保持しているスパンを返す。since（perf_counter_ns）以降に始まったものだけに絞れる"""
+        with self._lock:
+            spans = list(self._spans)
+        if since is not None:
+            spans = [span for span in spans if span.start >= since]
+        return spans
+
+    def summary(self, since=None):
+        """スパン名ごとの合計時間（ミリ秒）を、最初に始まった順の dict で返す"""
+        totals = {}
+        for span in sorted(self.spans(since), key=lambda span: span.start):
+            totals[span.name] = totals.get(span.name, 0) + span.duration / 1e6
+        return totals
+
+    def export_chrome_trace(self, path):
+        """保持しているスパンとカウンタを chrome://tracing や Perfetto で開ける JSON に書き出す"""
+        events = [self._span_event(span) for span in self.spans()]
+        now = self._ts(time.perf_counter_ns())
+        events += [{"name": name, "ph": "C", "ts": now, "pid": self._pid, "args": {"value": value}}
+                   for name, value in self.counters().items()]
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f, ensure_ascii=False,
+                      default=str)
+
+    def flush(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def _ts(self, ns):
+        return self._epoch_us + (ns - self._origin) / 1000  # マイクロ秒
+
+    def _span_event(self, span):
+        return {"name": span.name, "cat": span.name.split(".", 1)[0], "ph": "X",
+                "ts": self._ts(span.start), "dur": span.duration / 1000,
+                "pid": self._pid, "tid": span.thread_id, "args": span.args}
+
+    def _write(self, event):
+        if self._file is None:
+            self._file = open(self.path, "a", encoding="utf-8")
+        self._file.write(json.dumps(event, ensure_ascii=False, default=str) + "\n")
+
+
+def jsonl_to_chrome_trace(src, dst):
+    """Tracer が書き出した JSONL を chrome://tracing で開ける JSON に変換する"""
+    with open(src, encoding="utf-8") as f:
+        events = [json.loads(line) for line in f if line.strip()]
+    with open(dst, "w", encoding="utf-8") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f, ensure_ascii=False)
+
+
+# アプリ全体で共有するトレーサー
+tracer = Tracer(os.getenv(TRACE_FILE_ENV))
+span = tracer.span
+count = tracer.count
+
+
+def traced(name):
+    """関数の呼び出しを name のスパンとして記録するデコレータ"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
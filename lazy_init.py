@@ -0,0 +1,59 @@
+import importlib
+import threading
+
+
+class LazyValue:
+    """初回の get() で factory を呼び、結果を保持する（スレッドセーフ）
+
+    warm() でバックグラウンドのスレッドから先に作成しておける。factory が例外を送出した場合は
+    結果を保持せず、get() のたびに作成をやり直す。
+    """
+
+    def __init__(self, factory, name=None):
+        self._factory = factory
+        self.name = name or getattr(factory, "__name__", "lazy")
+        self._lock = threading.Lock()
+        self._ready = False
+        self._value = None
+
+    def get(self):
+        if self._ready:
+            return self._value
+        with self._lock:
+            if not self._ready:
+                self._value = self._factory()
+                self._ready = True
+        return self._value
+
+    def ready(self):
+        return self._ready
+
+    def reset(self):
+        """保持している結果を捨て、次の get() で作り直す"""
+        with self._lock:
+            self._ready = False
+            self._value = None
+
+    def warm(self, on_ready=None, on_error=None):
+        """バックグラウンドのスレッドで作成を始める。完了時に on_ready(value) を呼ぶ
+
+        作成か on_ready が例外を送出した場合は、メッセージを表示して on_error(error) を呼ぶ。
+        """
+        def run():
+            try:
+                value = self.get()
+                if on_ready is not None:
+                    on_ready(value)
+            except Exception as error:
+                print(f"{self.name} の初期化に失敗しました: {error}")
+                if on_error is not None:
+                    on_error(error)
+
+        thread = threading.Thread(target=run, name=f"warm-{self.name}", daemon=True)
+        thread.start()
+        return thread
+
+
+def lazy_module(name):
+    """モジュールを初回の get() でインポートする LazyValue を返す"""
+    return LazyValue(lambda: importlib.import_module(name), name=name)
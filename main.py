@@ -1,7 +1,10 @@
+import logging
 import tkinter as tk
 from calendar_app import CalendarApp
 
 def main():
+    # Gemini の呼び出しごとのトークン数・所要時間などを表示する
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s: %(message)s")
     root = tk.Tk()
     app = CalendarApp(root)
     root.mainloop()
@@ -0,0 +1,101 @@
+import heapq
+import itertools
+import threading
+import time
+import uuid
+
+# 時計の変更やスリープ復帰に備え、次の期限が遠くてもこの秒数ごとに起きて確認する
+MAX_WAIT = 300
+
+
+class NotificationScheduler:
+    """通知を発火時刻の最小ヒープで管理し、次の期限まで1つのスレッドで待機するスケジューラ
+
+    追加・キャンセルは O(log n)。キャンセルされた通知はヒープから遅延削除する。
+    deliver(notification_id, payload) はスケジューラのスレッドから呼ばれるので、
+    UIを操作する場合は呼び出し側でUIスレッドに渡すこと。
+    """
+
+    def __init__(self, deliver):
+        self._deliver = deliver
+        self._heap = []  # (発火時刻, 連番, 通知ID)
+        self._entries = {}  # 通知ID -> (発火時刻, 連番, payload)
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="notification-scheduler",
+                                        daemon=True)
+        self._thread.start()
+
+    def add(self, fire_at, payload, notification_id=None):
+        """fire_at（datetime）に payload を通知する。通知IDを返す"""
+        notification_id = notification_id or uuid.uuid4().hex
+        timestamp = fire_at.timestamp()
+        with self._cond:
+            seq = next(self._counter)
+            self._entries[notification_id] = (timestamp, seq, payload)
+            heapq.heappush(self._heap, (timestamp, seq, notification_id))
+            # 先頭が変わったときだけ待機中のスレッドを起こす
+            if self._heap[0][1] == seq:
+                self._cond.notify()
+        return notification_id
+
+    def cancel(self, notification_id):
+        """通知をキャンセルする。存在しなければ False"""
+        with self._cond:
+            if self._entries.pop(notification_id, None) is None:
+                return False
+            # キャンセル済みの要素が多くなったらヒープを作り直す
+            if len(self._heap) > 2 * len(self._entries) + 64:
+                self._heap = [(timestamp, seq, nid)
+                              for nid, (timestamp, seq, _) in self._entries.items()]
+                heapq.heapify(self._heap)
+            return True
+
+    def pending(self):
+        """未発火の (通知ID, 発火時刻のタイムスタンプ, payload) を時刻順に返す"""
+        with self._cond:
+            return sorted(((nid, timestamp, payload)
+                           for nid, (timestamp, _, payload) in self._entries.items()),
+                          key=lambda item: item[1])
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+
+    def _pop_due(self, now):
+        """期限を過ぎた通知をヒープから取り出す（ロックを保持した状態で呼ぶ）"""
+        due = []
+        while self._heap:
+            timestamp, seq, notification_id = self._heap[0]
+            entry = self._entries.get(notification_id)
+            if entry is None or entry[1] != seq:
+                heapq.heappop(self._heap)  # キャンセル済み・再登録済み
+                continue
+            if timestamp > now:
+                break
+            heapq.heappop(self._heap)
+            del self._entries[notification_id]
+            due.append((notification_id, entry[2]))
+        return due
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._closed:
+                        return
+                    due = self._pop_due(time.time())
+                    if due:
+                        break
+                    timeout = MAX_WAIT
+                    if self._heap:
+                        timeout = min(max(self._heap[0][0] - time.time(), 0), MAX_WAIT)
+                    self._cond.wait(timeout)
+            # 通知はロックの外で配送する
+            for notification_id, payload in due:
+                try:
+                    self._deliver(notification_id, payload)
+                except Exception as error:
+                    print(f"通知の配送に失敗しました: {error}")
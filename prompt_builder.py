@@ -0,0 +1,138 @@
+import logging
+from typing import NamedTuple
+
+from schedule_parser import parse_line, format_minutes
+
+logger = logging.getLogger(__name__)
+
+# 毎回同じ指示。system_instruction（またはコンテキストキャッシュ）として1度だけ送る
+SYSTEM_INSTRUCTION = """あなたは1日のスケジュールを立てるアシスタントです。
+与えられた日付と予定を考慮して、以下の点に注意しながら1日のスケジュールを立ててください：
+1. 予定の間に適切な休憩時間を入れてください。
+2. 朝食、昼食、夕食の時間を確保してください。
+3. バイト先に行くのに1時間、帰るのに1時間かかるので、その時間を確保してください。
+4. 予定で指定された時間以外はバイトをいれることができません。
+5. 睡眠時間を8時間確保してください。
+6. 備考を出力しないでください。
+7. バイトの予定がないとき、移動時間を入れないでください。
+8. 移動時間は、バイトの時間に含まれません。"""
+
+# 出力形式ごとの指示（ユーザープロンプトの末尾に付ける）
+OUTPUT_FORMATS = {
+    "text": "スケジュールは必ず「**HH:MM-HH:MM 活動内容**」の形式で1行に1件ずつ記述してください。"
+            "例: **07:00-08:00 朝食**",
+    "json": "スケジュールは start・end（HH:MM形式）と activity（活動内容）を持つオブジェクトの配列として、"
+            "開始時刻順に出力してください。",
+}
+
+# 予定の件名はこの文字数で切り詰める。入力の上限を超える場合は順に短くする
+SUMMARY_LIMITS = (40, 20, 10)
+DEFAULT_INPUT_TOKEN_BUDGET = 1000
+# 予定が無くても出力される行（睡眠・食事・休憩・自由時間など）の数と、1行あたりのトークン数の見積もり
+BASE_OUTPUT_LINES = 12
+LINES_PER_EVENT = 3  # 予定の行と前後の休憩・移動
+TOKENS_PER_LINE = 32
+# JSON の1件はキー名や引用符の分だけ長い
+JSON_TOKENS_PER_LINE = 48
+MIN_OUTPUT_TOKENS = 256
+MAX_OUTPUT_TOKENS = 2048
+
+
+class Prompt(NamedTuple):
+    """Gemini に送るユーザープロンプトと、その作成に使った情報"""
+    text: str
+    events: list
+    input_tokens: int
+    max_output_tokens: int
+
+
+def estimate_tokens(text):
+    """トークン数を概算する（日本語はおおむね1文字1トークン、英数字は4文字1トークン）"""
+    ascii_chars = sum(1 for ch in text if ch.isascii())
+    return len(text) - ascii_chars + (ascii_chars + 3) // 4
+
+
+def _truncate(summary, limit):
+    summary = " ".join(summary.split())
+    return summary if len(summary) <= limit else summary[:limit - 1] + "…"
+
+
+def compact_events(events, summary_limit=SUMMARY_LIMITS[0]):
+    """予定の文字列を短くまとめる
+
+    重複を除き、同じ件名で重なる・隣り合う予定を1つにまとめ、件名を summary_limit 文字で切り詰める。
+    終日の予定を先頭に、時刻のある予定を開始時刻順に並べた「HH:MM-HH:MM 件名」のリストを返す。
+    """
+    all_day = []
+    timed = []
+    for event in events:
+        entry = parse_line(event)
+        if entry is None:
+            label, _, summary = event.partition(":")
+            summary = _truncate(summary or label, summary_limit)
+            if summary and summary not in all_day:
+                all_day.append(summary)
+        else:
+            timed.append((entry.start, entry.end, _truncate(entry.activity, summary_limit)))
+
+    # 開始時刻順に見るので、重なりうるのは同じ件名の直前の予定だけ
+    merged = []
+    last = {}
+    for start, end, summary in sorted(timed):
+        i = last.get(summary)
+        if i is not None and start <= merged[i][1]:
+            merged[i] = (merged[i][0], max(end, merged[i][1]), summary)
+        else:
+            last[summary] = len(merged)
+            merged.append((start, end, summary))
+
+    return ([f"終日 {summary}" for summary in all_day]
+            + [f"{format_minutes(start)}-{format_minutes(end)} {summary}"
+               for start, end, summary in merged])
+
+
+def build_user_prompt(date, compacted_events, output_format="text"):
+    """日付・予定と出力形式の指示だけのプロンプト（共通の指示は SYSTEM_INSTRUCTION で送る）"""
+    return (f"{date.strftime('%Y年%m月%d日')}の予定：\n"
+            + "\n".join(compacted_events)
+            + f"\n{OUTPUT_FORMATS[output_format]}\nスケジュール：")
+
+
+def max_output_tokens_for(compacted_events, output_format="text"):
+    """予想される行数と出力形式から出力トークン数の上限を決める"""
+    lines = BASE_OUTPUT_LINES + LINES_PER_EVENT * len(compacted_events)
+    per_line = JSON_TOKENS_PER_LINE if output_format == "json" else TOKENS_PER_LINE
+    return max(MIN_OUTPUT_TOKENS, min(MAX_OUTPUT_TOKENS, lines * per_line))
+
+
+class PromptBuilder:
+    """入力トークンの予算内に収まるようにプロンプトを作る
+
+    count_tokens(text) は正確なトークン数を返す関数（Gemini の model.count_tokens など）。
+    API の往復を避けるため、概算が予算の半分を超えたときだけ呼び出す。
+    """
+
+    def __init__(self, count_tokens=None, budget=DEFAULT_INPUT_TOKEN_BUDGET):
+        self.count_tokens = count_tokens
+        self.budget = budget
+
+    def measure(self, text):
+        estimate = estimate_tokens(text)
+        if self.count_tokens is None or estimate <= self.budget // 2:
+            return estimate
+        try:
+            return self.count_tokens(text)
+        except Exception as error:
+            logger.warning("トークン数を取得できませんでした（概算を使います）: %s", error)
+            return estimate
+
+    def build(self, date, events, output_format="text"):
+        for limit in SUMMARY_LIMITS:
+            compacted = compact_events(events, limit)
+            text = build_user_prompt(date, compacted, output_format)
+            tokens = self.measure(text)
+            if tokens <= self.budget:
+                break
+        else:
+            logger.warning("プロンプトが予算を超えています: %d > %d トークン", tokens, self.budget)
+        return Prompt(text, compacted, tokens, max_output_tokens_for(compacted, output_format))
@@ -0,0 +1,113 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_RENDER_DB = "render_cache.db"
+DEFAULT_MEMORY_ENTRIES = 32
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+# 図の描き方を変更したら上げる（キャッシュキーに含まれる）
+RENDER_VERSION = 1
+
+
+def make_render_key(schedule, date, conflicts, size, dpi):
+    """スケジュール・日付・強調する予定・画像の大きさ（ピクセル）・DPI からキー（SHA-256）を作る"""
+    payload = {
+        "version": RENDER_VERSION,
+        "schedule": [list(item) for item in schedule],
+        "date": date.isoformat(),
+        "conflicts": sorted(conflicts),
+        "size": list(size),
+        "dpi": dpi,
+    }
+    encoded = json.dumps(payload, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class RenderCache:
+    """描画したスケジュールのPNGを保存するキャッシュ
+
+    直近のものはメモリに LRU で保持し、すべてを SQLite にも保存する（合計サイズの上限を超えたら
+    最終アクセスが古い順に削除する）。値は (PNGのバイト列, 図の位置情報) のタプル。
+    """
+
+    def __init__(self, path=DEFAULT_RENDER_DB, memory_entries=DEFAULT_MEMORY_ENTRIES,
+                 max_bytes=DEFAULT_MAX_BYTES):
+        self.memory_entries = memory_entries
+        self.max_bytes = max_bytes
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS renders ("
+                " key TEXT PRIMARY KEY,"
+                " png BLOB NOT NULL,"
+                " geometry TEXT NOT NULL,"
+                " size INTEGER NOT NULL,"
+                " last_access REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS renders_last_access ON renders (last_access)"
+            )
+
+    def get(self, key):
+        """(PNGのバイト列, 位置情報) を返す。無ければ None"""
+        with self._lock:
+            value = self._memory.get(key)
+            if value is not None:
+                self._memory.move_to_end(key)
+                return value
+            row = self._conn.execute(
+                "SELECT png, geometry FROM renders WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            with self._conn:
+                self._conn.execute(
+                    "UPDATE renders SET last_access = ? WHERE key = ?", (time.time(), key)
+                )
+            value = (bytes(row[0]), tuple(json.loads(row[1])))
+            self._remember(key, value)
+            return value
+
+    def put(self, key, png, geometry):
+        with self._lock:
+            self._remember(key, (png, tuple(geometry)))
+            with self._conn:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO renders (key, png, geometry, size, last_access)"
+                    " VALUES (?, ?, ?, ?, ?)",
+                    (key, png, json.dumps(list(geometry)), len(png), time.time()),
+                )
+                self._evict()
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._memory.clear()
+            self._conn.execute("DELETE FROM renders")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _remember(self, key, value):
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _evict(self):
+        """合計サイズが上限を超えた分を、最終アクセスが古い順に削除する"""
+        (total,) = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM renders").fetchone()
+        if total <= self.max_bytes:
+            return
+        stale = []
+        for key, size in self._conn.execute("SELECT key, size FROM renders ORDER BY last_access ASC"):
+            if total <= self.max_bytes:
+                break
+            stale.append((key,))
+            total -= size
+        self._conn.executemany("DELETE FROM renders WHERE key = ?", stale)
@@ -0,0 +1,186 @@
+import threading
+from datetime import date
+
+import numpy as np
+
+from schedule_columns import ScheduleColumns
+
+# 活動の分類。活動名に語のいずれかを含むものをその分類として数える（上から順に判定する）
+CATEGORIES = (
+    ("睡眠", ("睡眠", "就寝")),
+    ("食事", ("朝食", "昼食", "夕食", "食事")),
+    ("バイト", ("バイト",)),
+    ("移動", ("移動", "通勤")),
+)
+OTHER_CATEGORY = "その他"
+CATEGORY_NAMES = tuple(name for name, _ in CATEGORIES) + (OTHER_CATEGORY,)
+SLEEP = CATEGORY_NAMES.index("睡眠")
+
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+def categorize(activity):
+    """活動名の分類の位置（CATEGORY_NAMES のインデックス）を返す"""
+    for code, (_, words) in enumerate(CATEGORIES):
+        if any(word in activity for word in words):
+            return code
+    return len(CATEGORIES)
+
+
+def week_of(ordinals):
+    """日付の序数を週の番号にする（序数1の日は月曜日なので、週は月曜日に始まる）"""
+    return (ordinals - 1) // 7
+
+
+def month_of(ordinals):
+    """日付の序数を1970年1月からの月の番号にする"""
+    days = (np.asarray(ordinals, dtype=np.int64) - _EPOCH_ORDINAL).astype("datetime64[D]")
+    return days.astype("datetime64[M]").astype(np.int64)
+
+
+def week_label(week):
+    return date.fromordinal(week * 7 + 1).strftime("%m/%d")
+
+
+def month_label(month):
+    return str(np.datetime64(month, "M"))
+
+
+def day_rows(columns):
+    """ScheduleColumns を日ごとに集計する
+
+    (日付の序数, 時間帯ごとの予定のある分 [日数×24], 分類ごとの分 [日数×分類数]) を返す。
+    時間帯は1分単位の占有（重なっている予定は1回だけ数える）、分類は予定の長さの合計。
+    """
+    dates, busy = columns.occupancy()
+    ordinals = np.array([day.toordinal() for day in dates], dtype=np.int64)
+    hours = busy.reshape(len(dates), 24, 60).sum(axis=2)
+    label_category = np.array([categorize(label) for label in columns.labels], dtype=np.intp)
+    _, day_index = np.unique(columns.day, return_inverse=True)
+    categories = np.zeros((len(dates), len(CATEGORY_NAMES)))
+    if len(columns):
+        np.add.at(categories, (day_index, label_category[columns.label]), columns.durations())
+    return ordinals, hours, categories
+
+
+class PeriodSums:
+    """期間（週・月）ごとの、時間帯ごとの予定のある分の合計と日数"""
+
+    def __init__(self, period_of):
+        self.period_of = period_of
+        self.sums = {}
+        self.days = {}
+
+    def add(self, ordinals, hours, sign=1):
+        """日ごとの集計を足す（sign=-1 で引く）"""
+        if not len(ordinals):
+            return
+        periods, inverse = np.unique(self.period_of(ordinals), return_inverse=True)
+        sums = np.zeros((len(periods), 24))
+        np.add.at(sums, inverse, hours)
+        counts = np.bincount(inverse)
+        for period, row, n_days in zip(periods.tolist(), sums, counts.tolist()):
+            n_days = self.days.get(period, 0) + sign * n_days
+            if n_days:
+                self.sums[period] = self.sums.get(period, 0) + sign * row
+                self.days[period] = n_days
+            else:
+                self.sums.pop(period, None)
+                self.days.pop(period, None)
+
+    def heatmap(self):
+        """(期間の番号のリスト, 期間×24 の予定のある割合（0〜1）) を返す"""
+        periods = sorted(self.sums)
+        if not periods:
+            return [], np.zeros((0, 24))
+        sums = np.array([self.sums[period] for period in periods])
+        days = np.array([self.days[period] for period in periods])
+        return periods, sums / (days[:, None] * 60)
+
+
+class ScheduleAnalytics:
+    """保存したスケジュールの集計（週・月ごとの時間帯のヒートマップ、分類ごとの時間、睡眠時間の推移）
+
+    日ごとの集計を配列で保持し、週・月・分類ごとの合計は足し引きで更新する。
+    1日分が保存し直されたときは、その日だけを集計し直す（update_day）。スレッドセーフ。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ordinals = np.zeros(0, dtype=np.int64)
+        self._hours = np.zeros((0, 24))
+        self._categories = np.zeros((0, len(CATEGORY_NAMES)))
+        self._weeks = PeriodSums(week_of)
+        self._months = PeriodSums(month_of)
+        self._category_totals = np.zeros(len(CATEGORY_NAMES))
+
+    @classmethod
+    def from_store(cls, store, start=None, end=None):
+        analytics = cls()
+        analytics.load(ScheduleColumns.from_store(store, start, end))
+        return analytics
+
+    def __len__(self):
+        return len(self._ordinals)
+
+    def load(self, columns):
+        """ScheduleColumns の全日をまとめて集計し直す"""
+        ordinals, hours, categories = day_rows(columns)
+        with self._lock:
+            self._ordinals, self._hours, self._categories = ordinals, hours, categories
+            self._weeks = PeriodSums(week_of)
+            self._months = PeriodSums(month_of)
+            self._add(ordinals, hours, categories)
+
+    def update_day(self, day, schedule):
+        """1日分（day は date または "YYYY-MM-DD"）を集計し直す。schedule が空ならその日を除く"""
+        columns = ScheduleColumns.from_schedules({day: schedule})
+        ordinals, hours, categories = day_rows(columns)
+        ordinal = (date.fromisoformat(day) if isinstance(day, str) else day).toordinal()
+        with self._lock:
+            position = int(np.searchsorted(self._ordinals, ordinal))
+            exists = position < len(self._ordinals) and self._ordinals[position] == ordinal
+            if exists:
+                self._add(self._ordinals[position:position + 1], self._hours[position:position + 1],
+                          self._categories[position:position + 1], sign=-1)
+                self._ordinals = np.delete(self._ordinals, position)
+                self._hours = np.delete(self._hours, position, axis=0)
+                self._categories = np.delete(self._categories, position, axis=0)
+            if len(ordinals):
+                self._ordinals = np.insert(self._ordinals, position, ordinals[0])
+                self._hours = np.insert(self._hours, position, hours[0], axis=0)
+                self._categories = np.insert(self._categories, position, categories[0], axis=0)
+                self._add(ordinals, hours, categories)
+
+    def _add(self, ordinals, hours, categories, sign=1):
+        self._weeks.add(ordinals, hours, sign)
+        self._months.add(ordinals, hours, sign)
+        self._category_totals += sign * categories.sum(axis=0)
+
+    def weekly_heatmap(self):
+        """(週の見出し（月曜日の MM/DD）のリスト, 週×24 の予定のある割合)"""
+        with self._lock:
+            weeks, heatmap = self._weeks.heatmap()
+        return [week_label(week) for week in weeks], heatmap
+
+    def monthly_heatmap(self):
+        """(月の見出し（YYYY-MM）のリスト, 月×24 の予定のある割合)"""
+        with self._lock:
+            months, heatmap = self._months.heatmap()
+        return [month_label(month) for month in months], heatmap
+
+    def category_hours(self):
+        """分類ごとの1日あたりの平均時間（時間）"""
+        with self._lock:
+            n_days = len(self._ordinals)
+            totals = self._category_totals.copy()
+        if not n_days:
+            return {}
+        return dict(zip(CATEGORY_NAMES, (totals / n_days / 60).tolist()))
+
+    def sleep_trend(self):
+        """(日付のリスト, 日ごとの睡眠時間（時間）の配列)"""
+        with self._lock:
+            ordinals = self._ordinals.copy()
+            sleep = self._categories[:, SLEEP] / 60
+        return [date.fromordinal(int(ordinal)) for ordinal in ordinals], sleep
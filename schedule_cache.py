@@ -0,0 +1,112 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+DEFAULT_CACHE_FILE = "gemini_cache.db"
+DEFAULT_TTL = 7 * 24 * 60 * 60  # 1週間（秒）
+DEFAULT_MAX_ENTRIES = 1000
+DEFAULT_MAX_BYTES = 16 * 1024 * 1024
+
+
+def normalize_events(events):
+    """予定の文字列リストを正規化する（空白の統一・重複除去・並べ替え）"""
+    normalized = {" ".join(event.split()) for event in events}
+    normalized.discard("")
+    return sorted(normalized)
+
+
+def make_cache_key(prompt_version, model_id, generation_config, date, events):
+    """プロンプトの内容からキャッシュキー（SHA-256）を作る"""
+    payload = {
+        "prompt_version": prompt_version,
+        "model_id": model_id,
+        "generation_config": generation_config,
+        "date": date.isoformat(),
+        "events": normalize_events(events),
+    }
+    encoded = json.dumps(payload, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """Geminiの応答をキーごとに保存するSQLiteキャッシュ（TTL・LRU・サイズ上限つき）"""
+
+    def __init__(self, path=DEFAULT_CACHE_FILE, ttl=DEFAULT_TTL,
+                 max_entries=DEFAULT_MAX_ENTRIES, max_bytes=DEFAULT_MAX_BYTES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY,"
+                " value TEXT NOT NULL,"
+                " size INTEGER NOT NULL,"
+                " created_at REAL NOT NULL,"
+                " last_access REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)"
+            )
+
+    def get(self, key):
+        """キャッシュされた応答を返す。無いか期限切れなら None"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, created_at = row
+            with self._conn:
+                if now - created_at > self.ttl:
+                    self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    return None
+                self._conn.execute(
+                    "UPDATE responses SET last_access = ? WHERE key = ?", (now, key)
+                )
+            return value
+
+    def put(self, key, value):
+        now = time.time()
+        size = len(value.encode("utf-8"))
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, created_at, last_access)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (key, value, size, now, now),
+            )
+            self._evict(now)
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM responses")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _evict(self, now):
+        """期限切れを削除し、上限を超えた分を最終アクセスが古い順に削除する"""
+        self._conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl,))
+        count, total = self._conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()
+        if count <= self.max_entries and total <= self.max_bytes:
+            return
+        rows = self._conn.execute(
+            "SELECT key, size FROM responses ORDER BY last_access ASC"
+        )
+        stale = []
+        for key, size in rows:
+            if count <= self.max_entries and total <= self.max_bytes:
+                break
+            stale.append((key,))
+            count -= 1
+            total -= size
+        self._conn.executemany("DELETE FROM responses WHERE key = ?", stale)
@@ -0,0 +1,191 @@
+import json
+import os
+from datetime import date
+from functools import lru_cache
+from typing import NamedTuple
+
+import numpy as np
+
+from schedule_parser import to_minutes
+from schedule_validator import MAX_OVERNIGHT_MINUTES, MINUTES_PER_DAY
+
+# save/load で使うファイル名（列ごとに1つの .npy と、活動名の表）
+COLUMNS = ("day", "start", "end", "label")
+LABELS_FILE = "labels.json"
+
+
+class FreeSlot(NamedTuple):
+    """day の start〜end（0時からの分）はどの予定にも含まれない"""
+    day: date
+    start: int
+    end: int
+
+
+@lru_cache(maxsize=None)
+def _minutes(value):
+    """"HH:MM" または分を分にする（同じ時刻の文字列は何度も現れるので結果を覚えておく）"""
+    return value if isinstance(value, int) else to_minutes(value)
+
+
+def _ordinal(value):
+    """date または "YYYY-MM-DD" を日付の序数（date.toordinal）にする"""
+    if isinstance(value, str):
+        value = date.fromisoformat(value)
+    return value.toordinal()
+
+
+class ScheduleColumns:
+    """多数の日のスケジュールを列ごとの NumPy 配列で保持する
+
+    1行は0時〜24時に収まる1区間で、日付をまたぐ予定は split_segments と同じく0時で分ける。
+    day は日付の序数（int32）、start/end は0時からの分（int16）、label は活動名の表 labels の位置（int32）。
+    行は (day, start) の順に並んでいるので、日付の範囲は二分探索でコピーせずに切り出せる。
+    """
+
+    def __init__(self, day, start, end, label, labels):
+        self.day = day
+        self.start = start
+        self.end = end
+        self.label = label
+        self.labels = labels
+
+    @classmethod
+    def from_schedules(cls, schedules):
+        """{日付（date または "YYYY-MM-DD"）: schedule} から作る
+
+        開始と終了の入れ替え・0時での分割は block_minutes/split_segments と同じ規則を配列で行う。
+        """
+        days, starts, ends, codes = [], [], [], []
+        labels = []
+        codes_by_label = {}
+        for key in schedules:
+            ordinal = _ordinal(key)
+            for item in schedules[key]:
+                activity = item[2]
+                code = codes_by_label.get(activity)
+                if code is None:
+                    code = codes_by_label[activity] = len(labels)
+                    labels.append(activity)
+                days.append(ordinal)
+                starts.append(_minutes(item[0]))
+                ends.append(_minutes(item[1]))
+                codes.append(code)
+
+        day = np.array(days, dtype=np.int32)
+        start = np.array(starts, dtype=np.int32) % MINUTES_PER_DAY
+        end = np.array(ends, dtype=np.int32)
+        label = np.array(codes, dtype=np.int32)
+        swap = (end < start) & ((end - start) % MINUTES_PER_DAY > MAX_OVERNIGHT_MINUTES)
+        start[swap], end[swap] = end[swap], start[swap]
+
+        # 日付をまたぐ予定は [開始, 24時) と [0時, 終了) に分ける。長さ0の予定は除く
+        first = (end > start) | (end < start)
+        overnight = end < start
+        morning = overnight & (end > 0)
+        day = np.concatenate([day[first], day[morning]])
+        label = np.concatenate([label[first], label[morning]])
+        start, end = (np.concatenate([start[first], np.zeros(morning.sum(), dtype=np.int32)]),
+                      np.concatenate([np.where(overnight, MINUTES_PER_DAY, end)[first], end[morning]]))
+
+        order = np.lexsort((end, start, day))
+        return cls(day[order], start[order].astype(np.int16), end[order].astype(np.int16),
+                   label[order], labels)
+
+    @classmethod
+    def from_store(cls, store, start=None, end=None):
+        """ScheduleStore に保存されたスケジュールから作る（start/end は "YYYY-MM-DD"、両端を含む）"""
+        return cls.from_schedules({date_str: saved["schedule"]
+                                   for date_str, saved in store.items(start, end)})
+
+    def __len__(self):
+        return len(self.day)
+
+    def dates(self):
+        """スケジュールのある日付のリスト"""
+        return [date.fromordinal(int(ordinal)) for ordinal in np.unique(self.day)]
+
+    def between(self, start=None, end=None):
+        """start〜end（両端を含む）の日付の行だけを持つ ScheduleColumns（配列はコピーしない）"""
+        lo = 0 if start is None else int(np.searchsorted(self.day, _ordinal(start), side="left"))
+        hi = len(self.day) if end is None else int(np.searchsorted(self.day, _ordinal(end), side="right"))
+        return ScheduleColumns(self.day[lo:hi], self.start[lo:hi], self.end[lo:hi],
+                               self.label[lo:hi], self.labels)
+
+    def segments(self, day):
+        """1日分の (開始の分, 終了の分, 活動) のリスト"""
+        rows = self.between(day, day)
+        return [(int(s), int(e), self.labels[code])
+                for s, e, code in zip(rows.start, rows.end, rows.label)]
+
+    def durations(self):
+        return self.end.astype(np.int32) - self.start
+
+    def time_per_activity(self, start=None, end=None):
+        """活動ごとの合計時間（分）を、長い順の dict で返す"""
+        rows = self.between(start, end)
+        totals = np.bincount(rows.label, weights=rows.durations(), minlength=len(self.labels))
+        order = np.argsort(-totals, kind="stable")
+        return {self.labels[code]: int(totals[code]) for code in order if totals[code]}
+
+    def _label_mask(self, activities):
+        codes = [self.labels.index(activity) for activity in activities if activity in self.labels]
+        return np.isin(self.label, codes)
+
+    def minute_counts(self, start=None, end=None, exclude=()):
+        """0時からの各分（1440個）に入っている予定の数を、日付の範囲で合計した配列
+
+        exclude に指定した活動（睡眠など）は数えない。
+        """
+        rows = self.between(start, end)
+        keep = ~rows._label_mask(exclude) if exclude else slice(None)
+        delta = np.zeros(MINUTES_PER_DAY + 1, dtype=np.int64)
+        np.add.at(delta, rows.start[keep], 1)
+        np.add.at(delta, rows.end[keep], -1)
+        return np.cumsum(delta[:-1])
+
+    def busiest_hours(self, start=None, end=None, exclude=()):
+        """各時間帯（0〜23時）に予定が入っている分の合計（長さ24の配列）"""
+        return self.minute_counts(start, end, exclude).reshape(24, 60).sum(axis=1)
+
+    def occupancy(self, start=None, end=None):
+        """(日付のリスト, 日数×1440 の bool 配列) を返す。True はその分に予定があることを表す"""
+        rows = self.between(start, end)
+        ordinals, day_index = np.unique(rows.day, return_inverse=True)
+        delta = np.zeros((len(ordinals), MINUTES_PER_DAY + 1), dtype=np.int16)
+        np.add.at(delta, (day_index, rows.start), 1)
+        np.add.at(delta, (day_index, rows.end), -1)
+        busy = np.cumsum(delta[:, :-1], axis=1) > 0
+        return [date.fromordinal(int(ordinal)) for ordinal in ordinals], busy
+
+    def free_slots(self, start=None, end=None, min_length=1):
+        """スケジュールのある日の、どの予定にも含まれない min_length 分以上の時間を FreeSlot のリストで返す"""
+        dates, busy = self.occupancy(start, end)
+        if not dates:
+            return []
+        # 空き時間の始まりと終わりを、行ごとに前後を予定ありで挟んだ配列の差分から求める
+        padded = np.ones((len(dates), MINUTES_PER_DAY + 2), dtype=np.int8)
+        padded[:, 1:-1] = busy
+        edges = np.diff(padded, axis=1)
+        starts = np.argwhere(edges == -1)
+        ends = np.argwhere(edges == 1)
+        lengths = ends[:, 1] - starts[:, 1]
+        return [FreeSlot(dates[row], int(slot_start), int(slot_end))
+                for (row, slot_start), slot_end, length in zip(starts, ends[:, 1], lengths)
+                if length >= min_length]
+
+    def save(self, path):
+        """ディレクトリ path に列ごとの .npy と活動名の表を書き出す"""
+        os.makedirs(path, exist_ok=True)
+        for name in COLUMNS:
+            np.save(os.path.join(path, f"{name}.npy"), getattr(self, name))
+        with open(os.path.join(path, LABELS_FILE), "w", encoding="utf-8") as f:
+            json.dump(self.labels, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """save で書き出したものを読み込む。mmap=True ならファイルをメモリマップし、読み込みでコピーしない"""
+        mmap_mode = "r" if mmap else None
+        columns = [np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode) for name in COLUMNS]
+        with open(os.path.join(path, LABELS_FILE), encoding="utf-8") as f:
+            labels = json.load(f)
+        return cls(*columns, labels)
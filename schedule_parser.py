@@ -1,10 +1,281 @@
+import json
+import logging
 import re
+from typing import NamedTuple
+
+from instrumentation import span
+
+logger = logging.getLogger(__name__)
+
+# 「**07:00-08:00 朝食**」「7:00～8:00 朝食」「・07：00〜08：00: 朝食」などの1行にマッチする。
+# 全角のコロン・数字、～ 〜 – — － ~ の区切りを受け付ける。\s は改行にもマッチするため使わない。
+_TIME = r'(\d{1,2})[:：](\d{2})'
+LINE_PATTERN = re.compile(
+    r'^[ \t]*(?:[-*・•][ \t]*)?(?:\*\*)?[ \t]*'
+    + _TIME + r'[ \t]*[-~～〜–—－][ \t]*' + _TIME +
+    r'(.+)$',
+    re.MULTILINE,
+)
+
+
+class ScheduleEntry(NamedTuple):
+    """解析された1件の予定。start/end は0時からの分"""
+    start: int
+    end: int
+    activity: str
+
+    @property
+    def start_str(self):
+        return format_minutes(self.start)
+
+    @property
+    def end_str(self):
+        return format_minutes(self.end)
+
+    def as_tuple(self):
+        """画面表示・保存で使う ("HH:MM", "HH:MM", 活動) の形式に変換する"""
+        return (format_minutes(self.start), format_minutes(self.end), self.activity)
+
+
+def to_minutes(value):
+    """"HH:MM"（H:MM も可）を0時からの分に変換する"""
+    hour, _, minute = value.replace('：', ':').partition(':')
+    return int(hour) * 60 + int(minute)
+
+
+def format_minutes(minutes):
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+def _to_entry(groups, _new=tuple.__new__):
+    start_hour, start_minute, end_hour, end_minute, activity = groups
+    # 太字の閉じ「**」や「: 」などの区切りを取り除く
+    activity = activity.strip(' \t*:：')
+    start_minute = int(start_minute)
+    end_minute = int(end_minute)
+    start = int(start_hour) * 60 + start_minute
+    end = int(end_hour) * 60 + end_minute
+    if not activity or start > 1440 or end > 1440 or start_minute >= 60 or end_minute >= 60:
+        return None
+    return _new(ScheduleEntry, (start, end, activity))
+
+
+def parse_line(line):
+    """1行を解析して ScheduleEntry を返す。予定の行でなければ None"""
+    match = LINE_PATTERN.match(line)
+    if match:
+        return _to_entry(match.groups())
+    return None
+
+
+def parse_entries(schedule_text):
+    """テキスト全体を解析して ScheduleEntry のリストを返す"""
+    entries = []
+    with span("parse.text"):
+        for match in LINE_PATTERN.finditer(schedule_text):
+            entry = _to_entry(match.groups())
+            if entry is not None:
+                entries.append(entry)
+    if logger.isEnabledFor(logging.DEBUG):
+        for line in schedule_text.split('\n'):
+            if line.strip() and parse_line(line) is None:
+                logger.debug("マッチしなかった行: %s", line)
+        logger.debug("%d件の予定を解析しました", len(entries))
+    return entries
+
 
 def parse_schedule(schedule_text):
-    schedule = []
-    for line in schedule_text.split('\n'):
-        match = re.match(r'\*\*(\d{2}:\d{2})-(\d{2}:\d{2})\s*(.+)\*\*', line.strip())
-        if match:
-            start_time, end_time, activity = match.groups()
-            schedule.append((start_time, end_time, activity))
-    return schedule
\ No newline at end of file
+    """テキストを解析して [("HH:MM", "HH:MM", 活動)] を返す"""
+    return [entry.as_tuple() for entry in parse_entries(schedule_text)]
+
+
+def format_schedule(schedule):
+    """[(開始, 終了, 活動)] を「**HH:MM-HH:MM 活動内容**」形式のテキストにする"""
+    return "\n".join(f"**{start}-{end} {activity}**" for start, end, activity in schedule)
+
+
+class ParseStats(NamedTuple):
+    """解析対象の行（JSONでは項目）の数と、そのうち予定として解析できた数"""
+    total: int
+    parsed: int
+
+    @property
+    def unparsed_rate(self):
+        return (self.total - self.parsed) / self.total if self.total else 0.0
+
+
+def text_parse_stats(schedule_text):
+    """空行を除いた行のうち、予定として解析できなかった割合を調べる"""
+    total = sum(1 for line in schedule_text.split('\n') if line.strip())
+    return ParseStats(total, len(parse_entries(schedule_text)))
+
+
+def _json_time(value):
+    """"HH:MM" を (時, 分) の文字列に分ける。形式が違えば ValueError"""
+    hour, sep, minute = value.strip().replace('：', ':').partition(':')
+    if not sep or not hour.isdigit() or not minute.isdigit() or len(minute) != 2:
+        raise ValueError(value)
+    return hour, minute
+
+
+def json_entry(item):
+    """JSON の1項目 {"start": "HH:MM", "end": "HH:MM", "activity": ...} を ScheduleEntry にする
+
+    形式が正しくなければ None を返す。
+    """
+    if not isinstance(item, dict):
+        return None
+    start, end, activity = item.get("start"), item.get("end"), item.get("activity")
+    if not (isinstance(start, str) and isinstance(end, str) and isinstance(activity, str)):
+        return None
+    try:
+        groups = _json_time(start) + _json_time(end)
+    except ValueError:
+        return None
+    return _to_entry(groups + (" ".join(activity.split()),))
+
+
+def _json_items(json_text):
+    try:
+        items = json.loads(json_text)
+    except ValueError:
+        return None
+    return items if isinstance(items, list) else None
+
+
+def parse_json_entries(json_text):
+    """JSON 配列の応答を ScheduleEntry のリストにする（正規表現による解析は行わない）"""
+    entries = []
+    with span("parse.json"):
+        for item in _json_items(json_text) or []:
+            entry = json_entry(item)
+            if entry is not None:
+                entries.append(entry)
+            else:
+                logger.debug("解析できなかった項目: %r", item)
+    return entries
+
+
+def parse_json_schedule(json_text):
+    """JSON 配列の応答を解析して [("HH:MM", "HH:MM", 活動)] を返す"""
+    return [entry.as_tuple() for entry in parse_json_entries(json_text)]
+
+
+def json_parse_stats(json_text):
+    """項目のうち予定として解析できなかった割合を調べる（JSON として読めない場合は全体を1件と数える）"""
+    items = _json_items(json_text)
+    if items is None:
+        return ParseStats(1, 0)
+    return ParseStats(len(items), sum(1 for item in items if json_entry(item) is not None))
+
+
+def parse_schedules(texts):
+    """複数日のテキストをまとめて解析する。{日付: テキスト} から {日付: [ScheduleEntry]} を返す"""
+    return {key: parse_entries(text) for key, text in texts.items()}
+
+
+class IncrementalScheduleParser:
+    """ストリーミングで届くテキストを受け取り、行が完成するたびに解析する"""
+
+    def __init__(self):
+        self._buffer = ""
+        self.lines = []
+        self.schedule = []
+
+    def feed(self, chunk):
+        """チャンクを追加し、新たに完成した [(行, 予定 or None)] を返す"""
+        self._buffer += chunk
+        *complete, self._buffer = self._buffer.split('\n')
+        return [self._accept(line) for line in complete]
+
+    def close(self):
+        """最後の改行の無い行を解析して返す"""
+        if not self._buffer:
+            return []
+        line, self._buffer = self._buffer, ""
+        return [self._accept(line)]
+
+    def _accept(self, line):
+        entry = parse_line(line)
+        self.lines.append(line)
+        if entry is None:
+            return line, None
+        self.schedule.append(entry.as_tuple())
+        return line, entry.as_tuple()
+
+    def stats(self):
+        return ParseStats(sum(1 for line in self.lines if line.strip()), len(self.schedule))
+
+
+class IncrementalJsonScheduleParser:
+    """JSON 配列としてストリーミングで届く予定を、オブジェクトが閉じるたびに解析する
+
+    lines には解析できた予定を「**HH:MM-HH:MM 活動内容**」形式にしたものが入る。
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self._current = []
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self.lines = []
+        self.schedule = []
+        self.rejected = []
+
+    @property
+    def text(self):
+        """受信したテキスト全体"""
+        return "".join(self._chunks)
+
+    def feed(self, chunk):
+        """チャンクを追加し、新たに閉じたオブジェクトの [(行, 予定 or None)] を返す"""
+        self._chunks.append(chunk)
+        results = []
+        for ch in chunk:
+            if self._depth:
+                self._current.append(ch)
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == '\\':
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch == '{':
+                if not self._depth:
+                    self._current = [ch]
+                self._depth += 1
+            elif ch == '}' and self._depth:
+                self._depth -= 1
+                if not self._depth:
+                    results.append(self._accept("".join(self._current)))
+        return results
+
+    def close(self):
+        """途中で終わったオブジェクトは解析できなかったものとして数える"""
+        if self._depth:
+            self.rejected.append("".join(self._current))
+            self._depth = 0
+        return []
+
+    def _accept(self, object_text):
+        try:
+            entry = json_entry(json.loads(object_text))
+        except ValueError:
+            entry = None
+        if entry is None:
+            self.rejected.append(object_text)
+            return object_text, None
+        line = f"**{entry.start_str}-{entry.end_str} {entry.activity}**"
+        self.lines.append(line)
+        self.schedule.append(entry.as_tuple())
+        return line, entry.as_tuple()
+
+    def stats(self):
+        total = len(self.schedule) + len(self.rejected)
+        if not total and self.text.strip():
+            return ParseStats(1, 0)  # JSON の配列ではない応答
+        return ParseStats(total, len(self.schedule))
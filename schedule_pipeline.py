@@ -0,0 +1,146 @@
+import logging
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from instrumentation import span
+
+logger = logging.getLogger(__name__)
+
+# UIスレッドでキューを確認する間隔（ミリ秒）。約60fps
+POLL_INTERVAL_MS = 16
+# submit の kind の既定値（スケジュールの生成）
+DEFAULT_KIND = "schedule"
+
+
+class JobCancelled(Exception):
+    """ジョブがキャンセルされたことを示す例外"""
+
+
+class Job:
+    """パイプラインで実行中の1回分の処理（kind はジョブの種類）"""
+
+    def __init__(self, pipeline, job_id, kind=DEFAULT_KIND):
+        self.pipeline = pipeline
+        self.job_id = job_id
+        self.kind = kind
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def is_cancelled(self):
+        return self._cancelled.is_set()
+
+    def check(self):
+        """キャンセルされていれば JobCancelled を送出する"""
+        if self.is_cancelled():
+            raise JobCancelled()
+
+    def post(self, callback, *args):
+        """UIスレッドで callback を実行する（キャンセル済みなら破棄）"""
+        self.pipeline.post(callback, *args, job=self)
+
+
+class SchedulePipeline:
+    """予定取得→生成→解析をワーカースレッドで順に実行し、結果をUIスレッドへ返す"""
+
+    # 種類の違うジョブが並行して動き、キャンセルしたジョブが終わるのを待たずに次を始められる数
+    def __init__(self, master, max_workers=4):
+        self.master = master
+        self._executor = ThreadPoolExecutor(max_workers=max_workers,
+                                            thread_name_prefix="schedule-pipeline")
+        self._queue = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._current = {}  # kind -> 実行中のジョブ
+        self._next_id = 0
+        self._closed = False
+        self._poll_id = self.master.after(POLL_INTERVAL_MS, self._poll)
+
+    def submit(self, stages, on_stage=None, on_done=None, on_error=None, kind=DEFAULT_KIND):
+        """ステージ [(名前, func(job, value))] を順に実行するジョブを開始する
+
+        同じ kind のジョブが実行中ならキャンセルする（別の kind のジョブはそのまま続ける）。
+        各ステージの戻り値は次のステージに渡され、最後の戻り値は on_done に渡される。
+        コールバックはすべてUIスレッドで呼ばれる。
+        """
+        with self._lock:
+            current = self._current.get(kind)
+            if current is not None:
+                current.cancel()
+            self._next_id += 1
+            job = Job(self, self._next_id, kind)
+            self._current[kind] = job
+        self._executor.submit(self._run, job, stages, on_stage, on_done, on_error)
+        return job
+
+    def cancel(self, kind=None):
+        """実行中の kind のジョブ（None ならすべてのジョブ）をキャンセルする"""
+        with self._lock:
+            kinds = list(self._current) if kind is None else [kind]
+            for name in kinds:
+                job = self._current.pop(name, None)
+                if job is not None:
+                    job.cancel()
+
+    def is_current(self, job):
+        with self._lock:
+            return job is self._current.get(job.kind)
+
+    def is_running(self, kind=DEFAULT_KIND):
+        """kind のジョブが実行中か"""
+        with self._lock:
+            return kind in self._current
+
+    def post(self, callback, *args, job=None):
+        """任意のスレッドから呼び出し、UIスレッドで callback を実行する"""
+        if callback is not None:
+            self._queue.put((job, callback, args))
+
+    def shutdown(self):
+        self.cancel()
+        self._closed = True
+        if self._poll_id is not None:
+            self.master.after_cancel(self._poll_id)
+            self._poll_id = None
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _run(self, job, stages, on_stage, on_done, on_error):
+        value = None
+        try:
+            for name, func in stages:
+                job.check()
+                job.post(on_stage, name)
+                with span(f"stage.{name}", job=job.job_id):
+                    value = func(job, value)
+            job.check()
+            job.post(on_done, value)
+        except JobCancelled:
+            pass
+        except Exception as error:
+            job.post(on_error, error)
+        finally:
+            with self._lock:
+                if self._current.get(job.kind) is job:
+                    del self._current[job.kind]
+
+    def _poll(self):
+        """キューに溜まったコールバックをUIスレッドで実行する
+
+        コールバックが例外を送出しても記録して次へ進み、次の確認は必ず予約する。
+        """
+        try:
+            while True:
+                try:
+                    job, callback, args = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if job is not None and job.is_cancelled():
+                    continue
+                try:
+                    callback(*args)
+                except Exception:
+                    logger.exception("UIのコールバック %r で例外が発生しました", callback)
+        finally:
+            if not self._closed:
+                self._poll_id = self.master.after(POLL_INTERVAL_MS, self._poll)
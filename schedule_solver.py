@@ -0,0 +1,175 @@
+import numpy as np
+
+from schedule_parser import format_minutes, to_minutes
+from schedule_validator import parse_events
+
+MINUTES_PER_DAY = 24 * 60
+
+WORK_KEYWORD = "バイト"
+COMMUTE = "移動"
+COMMUTE_MINUTES = 60
+SLEEP = "睡眠"
+SLEEP_MINUTES = 8 * 60
+BREAK = "休憩"
+BREAK_MINUTES = 15
+FREE_TIME = "自由時間"
+FREE_TIME_MIN_MINUTES = 30
+
+# (活動, 長さ, 探す範囲の開始, 終了, 希望の開始時刻)
+MEALS = [
+    ("朝食", 30, to_minutes("06:00"), to_minutes("10:00"), to_minutes("07:30")),
+    ("昼食", 60, to_minutes("11:00"), to_minutes("14:30"), to_minutes("12:00")),
+    ("夕食", 60, to_minutes("17:00"), to_minutes("21:30"), to_minutes("18:30")),
+]
+# 食事の時間帯が予定で埋まっている場合に、後ろ（それでも無ければ前後）へ広げる幅
+MEAL_WINDOW_MARGIN = 180
+# 前の食事の終わりから次の食事まで空ける時間
+MEAL_GAP_MINUTES = 120
+PREFERRED_SLEEP_START = to_minutes("23:00")
+
+
+class Timeline:
+    """1日を1分単位の占有配列で表す。日付をまたぐ区間は0時に折り返す"""
+
+    def __init__(self):
+        self.occupied = np.zeros(MINUTES_PER_DAY, dtype=bool)
+        self.blocks = []
+
+    def _indices(self, start, length):
+        return np.arange(start, start + length) % MINUTES_PER_DAY
+
+    def is_free(self, start, length):
+        return not self.occupied[self._indices(start, length)].any()
+
+    def place(self, start, length, activity, force=False):
+        """空いていれば（force=True なら常に）区間を確保する。確保できたら True"""
+        if length <= 0 or (not force and not self.is_free(start, length)):
+            return False
+        self.occupied[self._indices(start, length)] = True
+        self.blocks.append((start % MINUTES_PER_DAY, length, activity))
+        return True
+
+    def free_starts(self, length, step=1):
+        """長さ length の空き区間を確保できる開始時刻の配列を返す（日付をまたぐものも含む）"""
+        doubled = np.concatenate([self.occupied, self.occupied]).astype(np.int32)
+        cumulative = np.concatenate([[0], np.cumsum(doubled)])
+        starts = np.arange(0, MINUTES_PER_DAY, step)
+        return starts[cumulative[starts + length] - cumulative[starts] == 0]
+
+    def place_nearest(self, length, activity, preferred, earliest=0, latest=MINUTES_PER_DAY):
+        """earliest〜latest に収まる空き区間のうち、preferred に最も近い所に確保する"""
+        starts = self.free_starts(length)
+        starts = starts[(starts >= earliest) & (starts + length <= latest)]
+        if starts.size == 0:
+            return False
+        distance = np.abs(starts - preferred) % MINUTES_PER_DAY
+        distance = np.minimum(distance, MINUTES_PER_DAY - distance)  # 0時をまたいだ距離も考える
+        start = int(starts[np.argmin(distance)])
+        return self.place(start, length, activity)
+
+    def fill_gaps(self, activity, min_length):
+        """min_length 分以上の空きを activity で埋める（0時をまたぐ空きは分けて扱う）"""
+        free = ~self.occupied
+        edges = np.diff(np.concatenate([[0], free.astype(np.int8), [0]]))
+        for start, end in zip(np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)):
+            if end - start >= min_length:
+                self.place(int(start), int(end - start), activity)
+
+    def schedule(self):
+        """(開始, 終了, 活動) のタプルを開始時刻順に返す"""
+        return [(format_minutes(start), format_minutes((start + length) % MINUTES_PER_DAY), activity)
+                for start, length, activity in sorted(self.blocks)]
+
+
+def _duration(start, end):
+    return (end - start) % MINUTES_PER_DAY
+
+
+def _meal_windows(earliest, latest, after, before):
+    """食事を探す範囲を順に返す：時間帯、後ろへ広げた範囲、前後へ広げた範囲
+
+    どの範囲も after（前の食事の終わり＋間隔）〜 before（次の食事の時間帯の終わり）に収める。
+    """
+    for lo, hi in ((earliest, latest), (earliest, latest + MEAL_WINDOW_MARGIN),
+                   (earliest - MEAL_WINDOW_MARGIN, latest + MEAL_WINDOW_MARGIN)):
+        yield max(lo, after), min(hi, before)
+
+
+def solve_schedule(events_list):
+    """予定の周りに睡眠・食事・移動・休憩を配置し、parse_schedule と同じ形式のタプルで返す
+
+    バイトの前後には移動を1時間ずつ入れ、バイトが無い日は移動を入れない。
+    睡眠は8時間を23:00開始に近い位置に、食事はそれぞれの時間帯の希望時刻に近い位置に置く。
+    食事は朝食・昼食・夕食の順に間隔を空けて置き、置ける場所が無い食事は入れない（validate_schedule が報告する）。
+    """
+    timeline = Timeline()
+    events = parse_events(events_list)
+
+    for event in events:
+        timeline.place(event.start, _duration(event.start, event.end), event.activity, force=True)
+
+    for event in events:
+        if WORK_KEYWORD in event.activity:
+            timeline.place(event.start - COMMUTE_MINUTES, COMMUTE_MINUTES, COMMUTE)
+            timeline.place(event.end, COMMUTE_MINUTES, COMMUTE)
+
+    # 予定（バイトの場合は帰りの移動）の直後に休憩を入れる。食事より先に置き、食事に場所を取られないようにする
+    for event in events:
+        end = event.end + (COMMUTE_MINUTES if WORK_KEYWORD in event.activity else 0)
+        timeline.place(end, BREAK_MINUTES, BREAK)
+
+    timeline.place_nearest(SLEEP_MINUTES, SLEEP, PREFERRED_SLEEP_START,
+                           earliest=0, latest=2 * MINUTES_PER_DAY)
+
+    after = 0
+    for i, (activity, length, earliest, latest, preferred) in enumerate(MEALS):
+        before = MEALS[i + 1][3] if i + 1 < len(MEALS) else MINUTES_PER_DAY
+        for window in _meal_windows(earliest, latest, after, before):
+            if timeline.place_nearest(length, activity, preferred, *window):
+                start, placed_length, _ = timeline.blocks[-1]
+                after = start + placed_length + MEAL_GAP_MINUTES
+                break
+
+    timeline.fill_gaps(FREE_TIME, FREE_TIME_MIN_MINUTES)
+    return timeline.schedule()
+
+
+def validate_schedule(schedule, events_list):
+    """スケジュールがプロンプトの規則を満たしているか確認し、違反の説明のリストを返す
+
+    重なりやカレンダーの予定との衝突は schedule_validator.validate で調べる。
+    """
+    problems = []
+    blocks = [(to_minutes(start), to_minutes(end), activity) for start, end, activity in schedule]
+    events = parse_events(events_list)
+
+    sleep_minutes = sum(_duration(start, end) for start, end, activity in blocks
+                        if SLEEP in activity or "就寝" in activity)
+    if sleep_minutes < SLEEP_MINUTES:
+        problems.append(f"睡眠時間が{sleep_minutes / 60:.1f}時間しかありません（8時間必要）。")
+
+    meal_starts = []
+    for meal, *_ in MEALS:
+        starts = [start for start, _, activity in blocks if meal in activity]
+        if starts:
+            meal_starts.append((meal, min(starts)))
+        else:
+            problems.append(f"{meal}がありません。")
+    for (first, first_start), (second, second_start) in zip(meal_starts, meal_starts[1:]):
+        if second_start < first_start:
+            problems.append(f"{second}が{first}より前にあります。")
+
+    has_work = any(WORK_KEYWORD in event.activity for event in events)
+    commutes = {(start, end) for start, end, activity in blocks if COMMUTE in activity}
+    if not has_work and commutes:
+        problems.append("バイトが無い日に移動が入っています。")
+    for event in events:
+        if WORK_KEYWORD not in event.activity:
+            continue
+        before = ((event.start - COMMUTE_MINUTES) % MINUTES_PER_DAY, event.start)
+        after = (event.end, (event.end + COMMUTE_MINUTES) % MINUTES_PER_DAY)
+        if before not in commutes:
+            problems.append(f"{format_minutes(event.start)}からのバイトの前に1時間の移動がありません。")
+        if after not in commutes:
+            problems.append(f"{format_minutes(event.end)}までのバイトの後に1時間の移動がありません。")
+    return problems
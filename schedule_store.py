@@ -0,0 +1,156 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+DEFAULT_SCHEDULE_DB = "calendar_data.db"
+LEGACY_JSON_FILE = "calendar_data.json"
+
+
+class ScheduleStore:
+    """日付ごとのスケジュールを保存するSQLiteストア
+
+    日付（YYYY-MM-DD）を主キーにしているため、最新の日付の検索はインデックスで行われる。
+    保存は変更された日付の1行だけを書き込む。
+    """
+
+    def __init__(self, path=DEFAULT_SCHEDULE_DB, legacy_json=LEGACY_JSON_FILE):
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS schedules ("
+                " date TEXT PRIMARY KEY,"
+                " schedule_text TEXT NOT NULL,"
+                " schedule TEXT NOT NULL,"
+                " updated_at REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS notifications ("
+                " id TEXT PRIMARY KEY,"
+                " fire_at REAL NOT NULL,"
+                " date TEXT NOT NULL,"
+                " event TEXT NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS notifications_fire_at ON notifications (fire_at)"
+            )
+        if legacy_json and self.latest_date() is None:
+            self.import_json(legacy_json)
+
+    def import_json(self, path):
+        """以前の calendar_data.json の内容を取り込む"""
+        if not os.path.exists(path):
+            return 0
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except json.JSONDecodeError:
+            print("JSONファイルの解析に失敗しました。取り込みをスキップします。")
+            return 0
+        records = [(date_str, saved["schedule_text"], saved["schedule"])
+                   for date_str, saved in data.items()
+                   if date_str.startswith('20') and len(date_str) == 10]
+        self.save_many(records)
+        print(f"{len(records)}日分のデータを {path} から取り込みました。")
+        return len(records)
+
+    def save(self, date_str, schedule_text, schedule):
+        """1日分のスケジュールを保存する（既存の日付は上書き）"""
+        self.save_many([(date_str, schedule_text, schedule)])
+
+    def save_many(self, records):
+        """[(date_str, schedule_text, schedule)] をまとめて1トランザクションで保存する"""
+        now = time.time()
+        rows = [(date_str, schedule_text, json.dumps(schedule, ensure_ascii=False), now)
+                for date_str, schedule_text, schedule in records]
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO schedules (date, schedule_text, schedule, updated_at)"
+                " VALUES (?, ?, ?, ?)", rows
+            )
+
+    def get(self, date_str):
+        """指定した日付のデータを返す。無ければ None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT schedule_text, schedule FROM schedules WHERE date = ?", (date_str,)
+            ).fetchone()
+        if row is None:
+            return None
+        return self._to_record(*row)
+
+    def latest_date(self):
+        """保存されている最新の日付を返す。無ければ None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT date FROM schedules ORDER BY date DESC LIMIT 1"
+            ).fetchone()
+        return row[0] if row else None
+
+    def latest(self):
+        """(最新の日付, データ) を返す。無ければ (None, None)"""
+        date_str = self.latest_date()
+        if date_str is None:
+            return None, None
+        return date_str, self.get(date_str)
+
+    def items(self, start=None, end=None):
+        """(日付, データ) を日付順に返す。start/end（YYYY-MM-DD、両端を含む）で範囲を指定できる"""
+        query = "SELECT date, schedule_text, schedule FROM schedules"
+        conditions = []
+        params = []
+        if start is not None:
+            conditions.append("date >= ?")
+            params.append(start)
+        if end is not None:
+            conditions.append("date <= ?")
+            params.append(end)
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY date"
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return [(date_str, self._to_record(text, schedule)) for date_str, text, schedule in rows]
+
+    def delete(self, date_str):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM schedules WHERE date = ?", (date_str,))
+
+    def add_notification(self, notification_id, fire_at, date_str, event):
+        """通知を保存する（fire_at は datetime）"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO notifications (id, fire_at, date, event)"
+                " VALUES (?, ?, ?, ?)",
+                (notification_id, fire_at.timestamp(), date_str,
+                 json.dumps(list(event), ensure_ascii=False)),
+            )
+
+    def delete_notification(self, notification_id):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM notifications WHERE id = ?", (notification_id,))
+
+    def pending_notifications(self):
+        """保存されている通知を (通知ID, 発火時刻, 日付, イベント) の発火時刻順で返す"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, fire_at, date, event FROM notifications ORDER BY fire_at"
+            ).fetchall()
+        return [(notification_id, datetime.fromtimestamp(fire_at), date_str, tuple(json.loads(event)))
+                for notification_id, fire_at, date_str, event in rows]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    @staticmethod
+    def _to_record(schedule_text, schedule):
+        return {
+            "schedule_text": schedule_text,
+            "schedule": [tuple(item) for item in json.loads(schedule)],
+        }
@@ -0,0 +1,252 @@
+import heapq
+from typing import NamedTuple
+
+from schedule_parser import parse_line, format_minutes, to_minutes
+
+MINUTES_PER_DAY = 24 * 60
+# 日付をまたいでこれより長くなる区間は、開始と終了が逆に書かれたものと見なす
+MAX_OVERNIGHT_MINUTES = 16 * 60
+
+
+class Segment(NamedTuple):
+    """0時〜24時に収まる半開区間 [start, end)。index は元のスケジュールでの位置"""
+    start: int
+    end: int
+    index: int
+
+
+class Overlap(NamedTuple):
+    """スケジュールの first 番目と second 番目の予定が start〜end で重なっている"""
+    first: int
+    second: int
+    start: int
+    end: int
+
+
+class Gap(NamedTuple):
+    start: int
+    end: int
+
+
+class EventConflict(NamedTuple):
+    """スケジュールの index 番目の予定がカレンダーの予定 event と start〜end で重なっている"""
+    index: int
+    event: tuple
+    start: int
+    end: int
+
+
+class ValidationResult(NamedTuple):
+    invalid: list
+    overlaps: list
+    gaps: list
+    conflicts: list
+    missing_events: list
+
+    @property
+    def ok(self):
+        return not (self.invalid or self.overlaps or self.conflicts or self.missing_events)
+
+    @property
+    def conflict_indices(self):
+        """問題のある予定のスケジュール上の位置（グラフや編集画面での強調表示用）"""
+        indices = {index for index, _ in self.invalid}
+        for overlap in self.overlaps:
+            indices.add(overlap.first)
+            indices.add(overlap.second)
+        indices.update(conflict.index for conflict in self.conflicts)
+        return indices
+
+    def messages(self, schedule):
+        """問題の説明のリストを返す（空き時間は問題として扱わない）"""
+        def label(index):
+            start, end, activity = schedule[index][:3]
+            return f"{_as_str(start)}-{_as_str(end)} {activity}"
+
+        messages = [f"「{label(index)}」は{reason}。" for index, reason in self.invalid]
+        messages += [f"「{label(o.first)}」と「{label(o.second)}」が"
+                     f"{format_minutes(o.start)}-{format_minutes(o.end)}で重なっています。"
+                     for o in self.overlaps]
+        messages += [f"「{label(c.index)}」がカレンダーの予定「{c.event.activity}」と"
+                     f"{format_minutes(c.start)}-{format_minutes(c.end)}で重なっています。"
+                     for c in self.conflicts]
+        messages += [f"カレンダーの予定「{event.activity}」（{event.start_str}-{event.end_str}）"
+                     f"がスケジュールにありません。" for event in self.missing_events]
+        return messages
+
+
+def _minutes(value):
+    """"HH:MM" または0時からの分を分に変換する"""
+    return value if isinstance(value, int) else to_minutes(value)
+
+
+def _as_str(value):
+    return format_minutes(value) if isinstance(value, int) else value
+
+
+def block_minutes(item):
+    """(開始, 終了, 活動) を (開始の分, 終了の分, 問題の説明 or None) にする
+
+    開始と終了が逆に書かれていると思われるものは入れ替える。終了が開始より前のものは日付をまたぐ。
+    """
+    start = _minutes(item[0]) % MINUTES_PER_DAY
+    end = _minutes(item[1])
+    if end == start:
+        return start, end, "開始と終了が同じです"
+    if end < start and (end - start) % MINUTES_PER_DAY > MAX_OVERNIGHT_MINUTES:
+        return end, start, "開始と終了が逆になっている可能性があります"
+    return start, end, None
+
+
+def split_segments(schedule):
+    """スケジュールを開始時刻順の Segment のリストにする。日付をまたぐ予定は0時で2つに分ける"""
+    segments = []
+    for index, item in enumerate(schedule):
+        start, end, _ = block_minutes(item)
+        if end > start:
+            segments.append(Segment(start, end, index))
+        elif end < start:
+            segments.append(Segment(start, MINUTES_PER_DAY, index))
+            if end > 0:
+                segments.append(Segment(0, end, index))
+    segments.sort()
+    return segments
+
+
+def _sweep(segments):
+    """開始時刻順の区間を走査し、(区間, 重なっている区間のリスト) を返す（O(n log n + 重なりの数)）"""
+    active = []  # (終了時刻, 通し番号, 区間) のヒープ
+    for order, segment in enumerate(segments):
+        while active and active[0][0] <= segment.start:
+            heapq.heappop(active)
+        yield segment, [other for _, _, other in active]
+        heapq.heappush(active, (segment.end, order, segment))
+
+
+def find_overlaps(segments):
+    """互いに重なっている予定の組を Overlap のリストで返す"""
+    overlaps = []
+    for segment, others in _sweep(segments):
+        for other in others:
+            if other.index != segment.index:
+                first, second = sorted((other.index, segment.index))
+                overlaps.append(Overlap(first, second, segment.start, min(segment.end, other.end)))
+    return overlaps
+
+
+def find_gaps(segments, min_length=1):
+    """どの予定にも含まれない min_length 分以上の時間を Gap のリストで返す"""
+    gaps = []
+    covered = 0
+    for segment in segments:
+        if segment.start - covered >= min_length:
+            gaps.append(Gap(covered, segment.start))
+        covered = max(covered, segment.end)
+    if MINUTES_PER_DAY - covered >= min_length:
+        gaps.append(Gap(covered, MINUTES_PER_DAY))
+    return gaps
+
+
+def assign_lanes(segments):
+    """重なっている区間が横に並ぶように、各区間に (列, 列の数) を割り当てる
+
+    segments と同じ順のリストを返す。重なりの無い区間は列の数が1になる。
+    """
+    lanes = [None] * len(segments)
+    active = []  # (終了時刻, 列)
+    free = []
+    cluster = []
+    n_lanes = 0
+    for position, segment in enumerate(segments):
+        while active and active[0][0] <= segment.start:
+            heapq.heappush(free, heapq.heappop(active)[1])
+        if not active:
+            # 重なりのまとまりが終わったので、列の数を確定する
+            for member in cluster:
+                lanes[member] = (lanes[member], n_lanes)
+            cluster, free, n_lanes = [], [], 0
+        if free:
+            lane = heapq.heappop(free)
+        else:
+            lane = n_lanes
+            n_lanes += 1
+        heapq.heappush(active, (segment.end, lane))
+        lanes[position] = lane
+        cluster.append(position)
+    for member in cluster:
+        lanes[member] = (lanes[member], n_lanes)
+    return lanes
+
+
+def parse_events(events_list):
+    """「HH:MM～HH:MM: 件名」形式の予定を ScheduleEntry にする（終日の予定は除く）"""
+    entries = []
+    for event_str in events_list:
+        entry = parse_line(event_str)
+        if entry is not None:
+            entries.append(entry)
+    return entries
+
+
+def _same_activity(a, b):
+    return a in b or b in a
+
+
+def find_event_conflicts(schedule, segments, events):
+    """カレンダーの予定と重なる別の活動と、スケジュールに入っていない予定を返す
+
+    (EventConflict のリスト, 見つからなかった予定のリスト) を返す。
+    """
+    event_segments = split_segments(events)
+    tagged = sorted([(s.start, 1, s) for s in segments] + [(s.start, 0, s) for s in event_segments])
+    active = ([], [])  # (予定の区間, スケジュールの区間) それぞれの (終了時刻, 通し番号, 区間) ヒープ
+    conflicts = []
+    found = set()
+    for order, (start, is_block, segment) in enumerate(tagged):
+        others = active[1 - is_block]
+        while others and others[0][0] <= start:
+            heapq.heappop(others)
+        for _, _, other in others:
+            block, event_segment = (segment, other) if is_block else (other, segment)
+            event = events[event_segment.index]
+            overlap_end = min(segment.end, other.end)
+            if _same_activity(schedule[block.index][2], event.activity):
+                found.add(event_segment.index)
+            else:
+                conflicts.append(EventConflict(block.index, event, start, overlap_end))
+        heapq.heappush(active[is_block], (segment.end, order, segment))
+    missing = [event for index, event in enumerate(events) if index not in found]
+    return conflicts, missing
+
+
+def validate(schedule, events_list=None, min_gap=1):
+    """スケジュールの重なり・空き時間・カレンダーの予定との衝突を調べて ValidationResult を返す
+
+    schedule は (開始, 終了, 活動) のリスト（開始・終了は "HH:MM" または分）。
+    events_list はカレンダーの予定の文字列のリスト（省略すると予定との照合はしない）。
+    """
+    invalid = [(index, reason) for index, item in enumerate(schedule)
+               for reason in [block_minutes(item)[2]] if reason]
+    segments = split_segments(schedule)
+    if events_list:
+        conflicts, missing = find_event_conflicts(schedule, segments, parse_events(events_list))
+    else:
+        conflicts, missing = [], []
+    return ValidationResult(invalid, find_overlaps(segments), find_gaps(segments, min_gap),
+                            conflicts, missing)
+
+
+def validate_many(schedules, events_by_date=None):
+    """{日付: schedule} をまとめて検証し、{日付: ValidationResult} を返す"""
+    events_by_date = events_by_date or {}
+    return {key: validate(schedule, events_by_date.get(key)) for key, schedule in schedules.items()}
+
+
+def validate_store(store, start=None, end=None):
+    """ScheduleStore に保存されたスケジュールを検証し、問題のある日だけ {日付: (schedule, ValidationResult)} で返す"""
+    results = {}
+    for date_str, saved in store.items(start, end):
+        result = validate(saved["schedule"])
+        if not result.ok:
+            results[date_str] = (saved["schedule"], result)
+    return results
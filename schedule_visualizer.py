@@ -1,62 +1,363 @@
-import matplotlib.pyplot as plt
+import base64
+import io
+from collections import OrderedDict
 import japanize_matplotlib
+import matplotlib
+from matplotlib.figure import Figure
 from matplotlib.patches import Rectangle
 from datetime import datetime
 import numpy as np
+from schedule_validator import MINUTES_PER_DAY, assign_lanes, block_minutes, split_segments
+from instrumentation import count, span, traced
+from render_cache import make_render_key
 
-def visualize_schedule(schedule, date):
-    print("視覚化するスケジュール:")
-    print(schedule)
-    if not schedule:
-        print("スケジュールが空です。視覚化をスキップします。")
-        return None
+FIGSIZE = (8, 12)
+DPI = 100
+CONFLICT_COLOR = 'red'
+
+def _schedule_colors(schedule):
+    return matplotlib.colormaps["Set3"](np.linspace(0, 1, len(schedule)))  # カラーパレットの設定
+
+def _layout_blocks(schedule):
+    """各予定の (四角形のリスト[(x, 幅, y, 高さ)], テキストの (x, y), 開始時刻, 活動) を返す
+
+    x と幅は列の幅に対する割合。日付をまたぐ予定は0時で分け、重なっている予定は横に並べる。
+    """
+    segments = split_segments(schedule)
+    rects = [[] for _ in schedule]
+    for segment, (lane, n_lanes) in zip(segments, assign_lanes(segments)):
+        rects[segment.index].append((lane / n_lanes, 1 / n_lanes, segment.start / 60,
+                                     (segment.end - segment.start) / 60))
+
+    blocks = []
+    for item, block_rects in zip(schedule, rects):
+        start, end, _ = block_minutes(item)
+        # テキストは真ん中に配置（日付をまたぐ場合は0時で折り返す）
+        text_y = (start + (end - start) % MINUTES_PER_DAY / 2) % MINUTES_PER_DAY / 60
+        text_x = 0.5
+        for rect_x, rect_width, y, height in block_rects:
+            if y <= text_y <= y + height:
+                text_x = rect_x + rect_width / 2
+                break
+        blocks.append((block_rects, (text_x, text_y), start / 60, item[2]))
+    return blocks
 
-    fig, ax = plt.subplots(figsize=(8, 12))  # グラフのサイズを調整
+def _edge_style(highlight):
+    """問題のある予定は赤い枠で強調する"""
+    if highlight:
+        return {"edgecolor": CONFLICT_COLOR, "linewidth": 2}
+    return {"edgecolor": "none", "linewidth": 0}
+
+def _current_hour():
+    now = datetime.now()
+    return now.hour + now.minute / 60
+
+def _setup_axes(ax):
     ax.set_ylim(0, 24)
     ax.set_yticks(range(0, 25))
     ax.set_yticklabels([f'{h:02d}:00' for h in range(0, 25)])
     ax.set_xlim(0, 1)
     ax.set_xticks([])
     ax.invert_yaxis()  # 時間軸を上から下に
-
-    ax.set_title(f'{date.strftime("%Y年%m月%d日")}のスケジュール', fontsize=16)
     ax.set_xlabel('活動', fontsize=12)
 
-    colors = plt.cm.Set3(np.linspace(0, 1, len(schedule)))  # カラーパレットの設定
-
-    for (start, end, activity), color in zip(schedule, colors):
-        start_time = datetime.strptime(start, "%H:%M")
-        end_time = datetime.strptime(end, "%H:%M")
-        
-        start_hour = start_time.hour + start_time.minute / 60
-        end_hour = end_time.hour + end_time.minute / 60
-        
-        if end_hour < start_hour:  # 日をまたぐ場合
-            # 日をまたぐ部分を2つに分けて描画
-            rect1 = Rectangle((0, start_hour), 1, 24 - start_hour, facecolor=color, alpha=0.7)
-            rect2 = Rectangle((0, 0), 1, end_hour, facecolor=color, alpha=0.7)
-            ax.add_patch(rect1)
-            ax.add_patch(rect2)
-            
-            # テキストは真ん中に配置
-            text_y = (start_hour + 24 + end_hour) / 2
-            if text_y > 24:
-                text_y -= 24
-            ax.text(0.5, text_y, activity, ha='center', va='center', fontsize=10, fontweight='bold', wrap=True)
+def _title(date):
+    return f'{date.strftime("%Y年%m月%d日")}のスケジュール'
+
+def _draw_blocks(ax, schedule, x=0, width=1, fontsize=10, conflicts=()):
+    """x から幅 width の列にスケジュールの四角形と活動名を描く。conflicts の位置の予定は強調する"""
+    colors = _schedule_colors(schedule)
+    blocks = _layout_blocks(schedule)
+    for index, ((rects, (text_x, text_y), start_hour, activity), color) in enumerate(zip(blocks, colors)):
+        highlight = index in conflicts
+        for rect_x, rect_width, y, height in rects:
+            ax.add_patch(Rectangle((x + rect_x * width, y), rect_width * width, height,
+                                   facecolor=color, alpha=0.7, **_edge_style(highlight)))
+        ax.text(x + text_x * width, text_y, activity, ha='center', va='center', fontsize=fontsize,
+                fontweight='bold', wrap=True, color=CONFLICT_COLOR if highlight else 'black')
+        ax.plot([x, x + width], [start_hour, start_hour], color='gray', linestyle='--', linewidth=0.5)
+
+def _build_figure(schedule, date, conflicts=(), figsize=FIGSIZE, dpi=None, now_line=True):
+    fig = Figure(figsize=figsize, dpi=dpi)  # グラフのサイズを調整
+    ax = fig.add_subplot()
+    _setup_axes(ax)
+    ax.set_title(_title(date), fontsize=16)
+
+    _draw_blocks(ax, schedule, conflicts=conflicts)
+
+    if now_line:
+        # 現在時刻を示す赤い線を追加
+        current_hour = _current_hour()
+        ax.axhline(y=current_hour, color='red', linestyle='-', linewidth=2)
+        ax.text(1.01, current_hour, '現在', color='red', va='center', fontsize=10)
+
+    fig.tight_layout()
+    return fig, ax
+
+@traced("visualize.figure")
+def visualize_schedule(schedule, date, conflicts=()):
+    """スケジュールの Figure を作る（pyplot を使わないため、呼び出し側で保持しなければ解放される）
+
+    conflicts は強調表示する予定の位置（schedule_validator.ValidationResult.conflict_indices）。
+    """
+    print("視覚化するスケジュール:")
+    print(schedule)
+    if not schedule:
+        print("スケジュールが空です。視覚化をスキップします。")
+        return None
+
+    fig, _ = _build_figure(schedule, date, conflicts)
+    return fig
+
+@traced("visualize.render_png")
+def render_png(schedule, date, conflicts=(), size=None, dpi=DPI):
+    """スケジュールを「現在」の線なしで PNG にし、(PNGのバイト列, 位置) を返す
+
+    size は画像の (幅, 高さ) のピクセル数（省略すると FIGSIZE）。位置は画像の左上を原点とした
+    (グラフの左端のx, 右端のx, 0時のy, 24時のy) で、「現在」の線を重ねるのに使う。
+    """
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from PIL import Image
+
+    figsize = FIGSIZE if size is None else (size[0] / dpi, size[1] / dpi)
+    fig, ax = _build_figure(schedule, date, conflicts, figsize, dpi, now_line=False)
+    canvas = FigureCanvasAgg(fig)
+    canvas.draw()
+    width, height = canvas.get_width_height()
+    (x0, y0), (x1, y24) = ax.transData.transform([(0, 0), (1, 24)])
+
+    # print_png は図を描き直すので、描画済みのバッファをそのまま圧縮する（速さ優先の圧縮率）
+    buffer = io.BytesIO()
+    Image.frombuffer("RGBA", (width, height), canvas.buffer_rgba(), "raw", "RGBA", 0, 1).save(
+        buffer, format="PNG", compress_level=1)
+    fig.clear()
+    return buffer.getvalue(), (float(x0), float(x1), float(height - y0), float(height - y24))
+
+@traced("visualize.week")
+def visualize_week(schedules, conflicts=None):
+    """{date: schedule} を日付ごとの列に並べた Figure を作る（週・月のまとめ表示用）
+
+    conflicts は {date: 強調表示する予定の位置}。
+    """
+    conflicts = conflicts or {}
+    if not schedules:
+        return None
+
+    dates = sorted(schedules)
+    fig = Figure(figsize=(max(8, 1.6 * len(dates)), 12))
+    ax = fig.add_subplot()
+    _setup_axes(ax)
+    ax.set_xlim(0, len(dates))
+    ax.set_xticks([i + 0.5 for i in range(len(dates))])
+    ax.set_xticklabels([d.strftime("%m/%d") for d in dates])
+    ax.set_xlabel('日付', fontsize=12)
+    ax.set_title(f'{dates[0].strftime("%Y年%m月%d日")}〜{dates[-1].strftime("%m月%d日")}のスケジュール',
+                 fontsize=16)
+
+    for i, day in enumerate(dates):
+        _draw_blocks(ax, schedules[day], x=i, width=1, fontsize=8, conflicts=conflicts.get(day, ()))
+        if i:
+            ax.axvline(x=i, color='black', linewidth=0.5)
+
+    fig.tight_layout()
+    return fig
+
+
+# 睡眠時間の推移に重ねる移動平均の日数
+SLEEP_TREND_WINDOW = 7
+
+def _heatmap(fig, ax, labels, heatmap, title):
+    image = ax.imshow(heatmap, aspect='auto', cmap='YlOrRd', vmin=0, vmax=1, interpolation='nearest')
+    ax.set_title(title, fontsize=12)
+    ax.set_xticks(range(0, 24, 3))
+    ax.set_xticklabels([f'{h:02d}' for h in range(0, 24, 3)])
+    ax.set_xlabel('時刻', fontsize=10)
+    step = max(1, len(labels) // 12)  # 見出しは12個程度に間引く
+    ax.set_yticks(range(0, len(labels), step))
+    ax.set_yticklabels(labels[::step], fontsize=8)
+    fig.colorbar(image, ax=ax, label='予定のある割合')
+
+@traced("visualize.analytics")
+def visualize_analytics(analytics):
+    """schedule_analytics.ScheduleAnalytics の集計を1つの Figure にまとめる
+
+    週・月ごとの時間帯のヒートマップ、分類ごとの1日あたりの時間、睡眠時間の推移を描く。
+    """
+    if not len(analytics):
+        return None
+
+    fig = Figure(figsize=(12, 9))
+    (week_ax, month_ax), (category_ax, sleep_ax) = fig.subplots(2, 2)
+
+    _heatmap(fig, week_ax, *analytics.weekly_heatmap(), '週ごとの時間帯')
+    _heatmap(fig, month_ax, *analytics.monthly_heatmap(), '月ごとの時間帯')
+
+    category_hours = analytics.category_hours()
+    names = list(category_hours)
+    category_ax.barh(names, [category_hours[name] for name in names],
+                     color=matplotlib.colormaps["Set3"](np.linspace(0, 1, len(names))))
+    category_ax.invert_yaxis()
+    category_ax.set_title('分類ごとの1日あたりの時間', fontsize=12)
+    category_ax.set_xlabel('時間', fontsize=10)
+
+    dates, sleep = analytics.sleep_trend()
+    sleep_ax.plot(dates, sleep, color='lightsteelblue', linewidth=1, label='日ごと')
+    if len(sleep) >= SLEEP_TREND_WINDOW:
+        window = np.ones(SLEEP_TREND_WINDOW) / SLEEP_TREND_WINDOW
+        sleep_ax.plot(dates[SLEEP_TREND_WINDOW - 1:], np.convolve(sleep, window, mode='valid'),
+                      color='navy', linewidth=2, label=f'{SLEEP_TREND_WINDOW}日平均')
+    sleep_ax.axhline(y=8, color='gray', linestyle='--', linewidth=0.5)
+    sleep_ax.set_title('睡眠時間の推移', fontsize=12)
+    sleep_ax.set_ylabel('時間', fontsize=10)
+    sleep_ax.legend(fontsize=8)
+    sleep_ax.tick_params(axis='x', labelrotation=30)
+
+    fig.tight_layout()
+    return fig
+
+
+class CachedScheduleView:
+    """描画済みの PNG を Tk の PhotoImage で表示するビュー
+
+    図は「現在」の線なしで描画し、スケジュール・日付・強調する予定・大きさをキーに cache
+    （render_cache.RenderCache）へ保存する。同じ内容ならPNGを表示するだけで、matplotlib で描き直さない。
+    「現在」の線は Tk のキャンバスの線として重ねるので、時刻が進んでも描き直さない。
+
+    executor と post を渡すと、キャッシュに無い図は executor のスレッドで描画してキャッシュに入れ、
+    post(callback, *args) でUIスレッドに戻して表示する（matplotlib の描画は1つのスレッドにまとめる）。
+    省略した場合はその場で描画する。
+    """
+
+    # PNG から作った PhotoImage を保持する数（日付を行き来したときにデコードし直さない）
+    PHOTO_CACHE_SIZE = 4
+    # ウィンドウの大きさが変わってから描き直すまでの時間と、画像の大きさの刻み（ピクセル）
+    RESIZE_DELAY_MS = 200
+    SIZE_STEP = 20
+
+    def __init__(self, master, cache, dpi=DPI, executor=None, post=None):
+        import tkinter as tk
+
+        self._tk = tk
+        self.cache = cache
+        self.dpi = dpi
+        self.executor = executor
+        self.post = post
+        self._request = 0  # 表示を要求するたびに増やし、後から届いた古い図を捨てる
+        self.canvas = tk.Canvas(master, background="white", highlightthickness=0)
+        self._image = self.canvas.create_image(0, 0, anchor="nw")
+        self.now_line = self.canvas.create_line(0, 0, 0, 0, fill="red", width=2, state="hidden")
+        self.now_text = self.canvas.create_text(0, 0, text="現在", fill="red", anchor="se",
+                                                state="hidden")
+        self._photos = OrderedDict()
+        self._preview = None  # show_png で表示中の PhotoImage（参照を持たないと消える）
+        self._shown = None  # (schedule, date, conflicts)
+        self._geometry = None
+        self._resize_id = None
+        self.canvas.bind("<Configure>", self._on_configure)
+
+    def get_tk_widget(self):
+        return self.canvas
+
+    @traced("visualize.cached_update")
+    def update(self, schedule, date, conflicts=()):
+        """スケジュールを表示する。キャッシュに無いときだけ描画する。conflicts の位置の予定は強調する"""
+        self._shown = ([tuple(item) for item in schedule], date, frozenset(conflicts))
+        self._show()
+
+    def show_png(self, png, geometry):
+        """ほかのスレッドで render_png した画像をそのまま表示する（キャッシュには入れない）
+
+        ストリーミング中の途中のスケジュールのように、一度しか表示しない図に使う。
+        """
+        self._shown = None  # 大きさが変わっても途中の図は描き直さない
+        self._request += 1
+        with span("visualize.decode_png", bytes=len(png)):
+            self._preview = self._tk.PhotoImage(data=base64.b64encode(png))
+        self._geometry = geometry
+        self.canvas.itemconfigure(self._image, image=self._preview)
+        self.update_now()
+
+    def update_now(self):
+        """「現在」の線だけを動かす（画像は描き直さない）"""
+        if self._geometry is None:
+            return
+        x0, x1, y0, y24 = self._geometry
+        y = y0 + (y24 - y0) * _current_hour() / 24
+        self.canvas.coords(self.now_line, x0, y, x1, y)
+        self.canvas.coords(self.now_text, x1 - 4, y - 2)  # 画像の外は切れるのでグラフの内側に置く
+        self.canvas.itemconfigure(self.now_line, state="normal")
+        self.canvas.itemconfigure(self.now_text, state="normal")
+
+    def render_size(self):
+        """表示に使う画像の (幅, 高さ) のピクセル数（UIスレッドで呼ぶ）"""
+        width, height = self.canvas.winfo_width(), self.canvas.winfo_height()
+        if width <= 1 or height <= 1:  # まだ表示されていない
+            return int(FIGSIZE[0] * self.dpi), int(FIGSIZE[1] * self.dpi)
+        return width - width % self.SIZE_STEP, height - height % self.SIZE_STEP
+
+    def _show(self):
+        schedule, date, conflicts = self._shown
+        size = self.render_size()
+        key = make_render_key(schedule, date, conflicts, size, self.dpi)
+        self._request += 1
+        photo = self._photos.get(key)
+        if photo is not None:
+            self._photos.move_to_end(key)
+            count("render_cache.hits")
+            self._display(photo)
+            return
+        cached = self.cache.get(key)
+        if cached is not None:
+            count("render_cache.hits")
+            self._display(self._decode(key, *cached))
+            return
+        count("render_cache.misses")
+        if self.executor is None:
+            self._display(self._decode(key, *self._render(key, schedule, date, conflicts, size)))
         else:
-            duration = end_hour - start_hour
-            rect = Rectangle((0, start_hour), 1, duration, facecolor=color, alpha=0.7)
-            ax.add_patch(rect)
-            ax.text(0.5, start_hour + duration/2, activity, 
-                    ha='center', va='center', fontsize=10, fontweight='bold', wrap=True)
-        
-        ax.axhline(y=start_hour, color='gray', linestyle='--', linewidth=0.5)
-
-    # 現在時刻を示す赤い線を追加
-    now = datetime.now()
-    current_hour = now.hour + now.minute / 60
-    ax.axhline(y=current_hour, color='red', linestyle='-', linewidth=2)
-    ax.text(1.01, current_hour, '現在', color='red', va='center', fontsize=10)
+            self.executor.submit(self._render_async, self._request, key, schedule, date, conflicts, size)
+
+    def _render(self, key, schedule, date, conflicts, size):
+        png, geometry = render_png(schedule, date, conflicts, size, self.dpi)
+        self.cache.put(key, png, geometry)
+        return png, geometry
+
+    def _render_async(self, request, key, schedule, date, conflicts, size):
+        """executor のスレッドで描画し、UIスレッドで表示する"""
+        try:
+            png, geometry = self._render(key, schedule, date, conflicts, size)
+        except Exception as error:
+            print(f"スケジュールの図を描画できませんでした: {error}")
+            return
+        self.post(self._on_rendered, request, key, png, geometry)
+
+    def _on_rendered(self, request, key, png, geometry):
+        if request != self._request:
+            return  # 描画中に別の図の表示が要求された
+        self._display(self._decode(key, png, geometry))
+
+    def _decode(self, key, png, geometry):
+        with span("visualize.decode_png", bytes=len(png)):
+            photo = (self._tk.PhotoImage(data=base64.b64encode(png)), geometry)
+        self._photos[key] = photo
+        while len(self._photos) > self.PHOTO_CACHE_SIZE:
+            self._photos.popitem(last=False)
+        return photo
+
+    def _display(self, photo):
+        image, self._geometry = photo
+        self._preview = None
+        self.canvas.itemconfigure(self._image, image=image)
+        self.update_now()
+
+    def _on_configure(self, event):
+        """大きさが落ち着いてから、その大きさで表示し直す"""
+        if self._shown is None:
+            return
+        if self._resize_id is not None:
+            self.canvas.after_cancel(self._resize_id)
+        self._resize_id = self.canvas.after(self.RESIZE_DELAY_MS, self._on_resized)
 
-    plt.tight_layout()
-    return fig
\ No newline at end of file
+    def _on_resized(self):
+        self._resize_id = None
+        self._show()
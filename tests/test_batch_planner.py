@@ -0,0 +1,166 @@
+import threading
+from datetime import date
+
+import httplib2
+import pytest
+from googleapiclient.errors import HttpError
+
+from batch_planner import BatchPlanner, NullRateLimiter, TokenBucket
+
+DAY1, DAY2, DAY3 = date(2024, 5, 1), date(2024, 5, 2), date(2024, 5, 3)
+SCHEDULE_TEXT = "**07:00-08:00 朝食**\n**09:00-17:00 バイト**"
+
+
+class ApiError(Exception):
+    """Gemini の API エラー（google.api_core.exceptions）と同じく code にステータスを持つ"""
+
+    def __init__(self, code):
+        super().__init__(f"status {code}")
+        self.code = code
+
+
+class FakeModel:
+    """日付ごとに決めた例外を順に送出してから SCHEDULE_TEXT を返す、ローカルのモデルの代わり"""
+
+    def __init__(self, failures=None):
+        self.failures = {day: list(errors) for day, errors in (failures or {}).items()}
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def generate(self, target_date, events_list, rate_limiter):
+        with self._lock:
+            self.calls.append(target_date)
+            errors = self.failures.get(target_date)
+            if errors:
+                raise errors.pop(0)
+        return SCHEDULE_TEXT
+
+
+class FakeClock:
+    """TokenBucket に渡す時計。sleep は待たずに時刻を進める"""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def make_planner(model, **kwargs):
+    sleeps = []
+    planner = BatchPlanner(model.generate, rate_limiter=NullRateLimiter(), sleep=sleeps.append,
+                           **kwargs)
+    return planner, sleeps
+
+
+def test_plan_retries_rate_limited_day():
+    model = FakeModel({DAY1: [ApiError(429)]})
+    planner, sleeps = make_planner(model)
+
+    results = planner.plan({DAY1: ["09:00～17:00: バイト"]})
+
+    assert model.calls == [DAY1, DAY1]
+    assert len(sleeps) == 1 and 0.5 <= sleeps[0] <= 1.0
+    assert results[DAY1] == (SCHEDULE_TEXT, [("07:00", "08:00", "朝食"), ("09:00", "17:00", "バイト")])
+
+
+def test_plan_records_non_retryable_error_for_its_day_only():
+    bad_request = HttpError(httplib2.Response({"status": "400"}), b"bad request")
+    model = FakeModel({DAY2: [bad_request]})
+    planner, sleeps = make_planner(model)
+    done = []
+
+    results = planner.plan({DAY1: ["09:00～17:00: バイト"], DAY2: ["10:00～11:00: 会議"]},
+                           on_day_done=lambda day, result, error: done.append((day, error)))
+
+    assert results[DAY2] is bad_request
+    assert results[DAY1][0] == SCHEDULE_TEXT
+    assert model.calls.count(DAY2) == 1 and sleeps == []
+    assert sorted(done, key=lambda item: item[0]) == [(DAY1, None), (DAY2, bad_request)]
+
+
+def test_plan_gives_up_after_retries():
+    model = FakeModel({DAY1: [ApiError(503)] * 3})
+    planner, sleeps = make_planner(model, retries=2)
+
+    results = planner.plan({DAY1: ["09:00～17:00: バイト"]})
+
+    assert isinstance(results[DAY1], ApiError) and results[DAY1].code == 503
+    assert len(model.calls) == 3 and len(sleeps) == 2
+
+
+def test_plan_skips_model_for_days_without_events():
+    model = FakeModel()
+    planner, _ = make_planner(model)
+
+    results = planner.plan({DAY3: [], DAY1: ["09:00～17:00: バイト"]})
+
+    assert list(results) == [DAY1, DAY3]
+    assert results[DAY3] == (None, [])
+    assert model.calls == [DAY1]
+
+
+def test_plan_skips_days_after_cancel():
+    model = FakeModel()
+    planner, _ = make_planner(model)
+
+    results = planner.plan({DAY1: ["09:00～17:00: バイト"]}, is_cancelled=lambda: True)
+
+    assert results == {} and model.calls == []
+
+
+class CountingLimiter:
+    def __init__(self):
+        self.acquired = []
+
+    def acquire(self, tokens=0):
+        self.acquired.append(tokens)
+
+
+def test_plan_leaves_rate_limiting_to_generate():
+    limiter = CountingLimiter()
+    received = []
+
+    def generate(target_date, events_list, rate_limiter):
+        received.append(rate_limiter)
+        rate_limiter.acquire(100)  # APIを2回呼ぶ（JSONの後にテキスト）
+        rate_limiter.acquire(100)
+        return SCHEDULE_TEXT
+
+    planner = BatchPlanner(generate, rate_limiter=limiter)
+    planner.plan({DAY1: ["09:00～17:00: バイト"], DAY2: []})
+
+    assert received == [limiter]
+    assert limiter.acquired == [100, 100]
+
+
+def test_token_bucket_waits_for_refill():
+    clock = FakeClock()
+    bucket = TokenBucket(capacity=2, rate=0.5, clock=clock, sleep=clock.sleep)
+
+    bucket.acquire()
+    bucket.acquire()
+    assert clock.sleeps == []
+
+    bucket.acquire()
+    assert clock.sleeps == [pytest.approx(2.0)]
+
+    clock.now += 10  # 容量を超えては溜まらない
+    bucket.acquire(2)
+    bucket.acquire()
+    assert clock.sleeps == [pytest.approx(2.0), pytest.approx(2.0)]
+
+
+def test_token_bucket_caps_request_at_capacity():
+    clock = FakeClock()
+    bucket = TokenBucket(capacity=3, rate=1, clock=clock, sleep=clock.sleep)
+
+    bucket.acquire(10)
+    bucket.acquire(1)
+
+    assert clock.sleeps == [pytest.approx(1.0)]
@@ -0,0 +1,115 @@
+import warnings
+from datetime import date
+from types import SimpleNamespace
+
+import pytest
+
+with warnings.catch_warnings():
+    warnings.simplefilter("ignore", FutureWarning)
+    gemini = pytest.importorskip("gemini_integration")
+
+from lazy_init import LazyValue
+from schedule_cache import ResponseCache
+
+DAY = date(2024, 5, 1)
+EVENTS = ["10:00～12:00: 授業"]
+JSON_TEXT = '[{"start": "07:00", "end": "08:00", "activity": "朝食"}]'
+
+
+class BlockedChunk:
+    """text を読むと ValueError になる（ブロックされた・中身の無い）応答"""
+
+    def __init__(self, finish_reason):
+        self.candidates = [SimpleNamespace(finish_reason=finish_reason)]
+        self.usage_metadata = None
+
+    @property
+    def text(self):
+        raise ValueError("no parts")
+
+
+def chunk(text, finish_reason=None):
+    return SimpleNamespace(text=text, usage_metadata=None,
+                           candidates=[SimpleNamespace(finish_reason=finish_reason)])
+
+
+class FakeModel:
+    """呼び出しごとに responses の次の応答（ストリーミングならチャンクのリスト）を返す"""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.calls = 0
+
+    def generate_content(self, text, generation_config, stream=False):
+        self.calls += 1
+        response = self.responses.pop(0)
+        return iter(response) if stream else response
+
+
+@pytest.fixture
+def model(monkeypatch, tmp_path):
+    cache = ResponseCache(path=str(tmp_path / "cache.db"))
+    monkeypatch.setattr(gemini, "_response_cache", LazyValue(lambda: cache))
+    fake = FakeModel()
+    monkeypatch.setattr(gemini, "get_model", lambda: fake)
+    yield fake
+    cache.close()
+
+
+def test_stream_without_chunks_is_not_cached(model):
+    model.responses = [[], [chunk(JSON_TEXT, 1)]]
+
+    assert list(gemini.generate_schedule_stream(DAY, EVENTS)) == []
+    assert list(gemini.generate_schedule_stream(DAY, EVENTS)) == [JSON_TEXT]
+    assert list(gemini.generate_schedule_stream(DAY, EVENTS)) == [JSON_TEXT]
+    assert model.calls == 2
+
+
+def test_blocked_response_is_not_cached(model):
+    model.responses = [BlockedChunk(3), chunk("**07:00-08:00 朝食**", 1)]
+
+    assert gemini.generate_schedule(DAY, EVENTS, output_format="text") == ""
+    assert gemini.generate_schedule(DAY, EVENTS, output_format="text") == "**07:00-08:00 朝食**"
+    assert gemini.generate_schedule(DAY, EVENTS, output_format="text") == "**07:00-08:00 朝食**"
+    assert model.calls == 2
+
+
+def test_unreadable_json_is_not_cached(model):
+    model.responses = [[chunk("申し訳ありません", 1)], [chunk(JSON_TEXT[:20]), chunk(JSON_TEXT[20:], 1)]]
+
+    assert "".join(gemini.generate_schedule_stream(DAY, EVENTS)) == "申し訳ありません"
+    assert "".join(gemini.generate_schedule_stream(DAY, EVENTS)) == JSON_TEXT
+    assert "".join(gemini.generate_schedule_stream(DAY, EVENTS)) == JSON_TEXT
+    assert model.calls == 2
+
+
+def test_truncated_response_is_retried_with_higher_cap(model):
+    model.responses = [chunk('[{"start": "07:00"', 2), chunk(JSON_TEXT, 1)]
+
+    assert gemini.generate_schedule(DAY, EVENTS) == JSON_TEXT
+    assert gemini.generate_schedule(DAY, EVENTS) == JSON_TEXT
+    assert model.calls == 2
+
+
+def test_truncated_stream_raises_after_last_chunk(model):
+    model.responses = [[chunk('[{"start": "07:00"', 2)]]
+    received = []
+
+    with pytest.raises(gemini.TruncatedResponse) as error:
+        for text in gemini.generate_schedule_stream(DAY, EVENTS):
+            received.append(text)
+
+    assert received == ['[{"start": "07:00"']
+    assert error.value.max_output_tokens > gemini.build_prompt(DAY, EVENTS).max_output_tokens
+
+
+def test_rate_limiter_is_acquired_per_api_call_only(model):
+    acquired = []
+    limiter = SimpleNamespace(acquire=acquired.append)
+    model.responses = [chunk('[{"start": "07:00"', 2), chunk(JSON_TEXT, 1)]
+
+    gemini.generate_schedule(DAY, EVENTS, rate_limiter=limiter)
+    gemini.generate_schedule(DAY, EVENTS, rate_limiter=limiter)  # キャッシュから返す
+
+    assert len(acquired) == model.calls == 2
+    assert acquired[1] > acquired[0]  # 出力の上限を上げた分だけ多く取る
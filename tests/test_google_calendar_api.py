@@ -0,0 +1,84 @@
+import json
+from datetime import date, datetime
+from urllib.parse import parse_qs, urlparse
+
+from googleapiclient.discovery import build
+from googleapiclient.http import HttpMockSequence
+
+from google_calendar_api import get_events_for_range
+
+BOUNDARY = "batch_boundary"
+
+
+def local_time(*args):
+    """ローカル時刻の dateTime 文字列（get_events_for_range はローカルの日付で振り分ける）"""
+    return datetime(*args).astimezone().isoformat()
+
+
+def timed_event(summary, start, end):
+    return {"summary": summary, "start": {"dateTime": local_time(*start)},
+            "end": {"dateTime": local_time(*end)}}
+
+
+def batch_response(responses):
+    """{request_id: events().list の応答} を multipart/mixed のバッチ応答にする"""
+    parts = []
+    for request_id, body in responses.items():
+        parts.append(f"--{BOUNDARY}\r\n"
+                     "Content-Type: application/http\r\n"
+                     f"Content-ID: <response-test + {request_id}>\r\n\r\n"
+                     "HTTP/1.1 200 OK\r\n"
+                     "Content-Type: application/json; charset=UTF-8\r\n\r\n"
+                     f"{json.dumps(body)}\r\n")
+    headers = {"status": "200", "content-type": f'multipart/mixed; boundary="{BOUNDARY}"'}
+    return headers, "".join(parts) + f"--{BOUNDARY}--\r\n"
+
+
+def page_tokens(http):
+    """各バッチ要求に含まれる events().list の (カレンダー, pageToken) のリスト"""
+    tokens = []
+    for _, _, body, _ in http.request_sequence:
+        for line in body.splitlines():
+            if line.startswith("GET "):
+                url = urlparse(line.split()[1])
+                query = parse_qs(url.query)
+                tokens.append((url.path.split("/")[-2], query.get("pageToken", [None])[0]))
+    return tokens
+
+
+def test_get_events_for_range_follows_pages_across_batches():
+    late_meeting = timed_event("会議", (2024, 5, 1, 9, 0), (2024, 5, 1, 10, 0))
+    early_class = timed_event("授業", (2024, 5, 1, 8, 0), (2024, 5, 1, 9, 0))
+    overnight = timed_event("夜勤", (2024, 5, 1, 23, 0), (2024, 5, 2, 2, 0))
+    all_day = {"summary": "休日", "start": {"date": "2024-05-02"}, "end": {"date": "2024-05-03"}}
+    last_page = timed_event("バイト", (2024, 5, 3, 18, 0), (2024, 5, 3, 22, 0))
+
+    http = HttpMockSequence([
+        batch_response({
+            "primary": {"items": [late_meeting, overnight], "nextPageToken": "page-2"},
+            "work": {"items": [early_class, all_day]},
+        }),
+        batch_response({"primary": {"items": [last_page]}}),
+    ])
+    service = build("calendar", "v3", http=http, static_discovery=True, cache_discovery=False)
+
+    days = get_events_for_range(service, date(2024, 5, 1), date(2024, 5, 3),
+                                calendar_ids=("primary", "work"))
+
+    # 2回目のバッチには、続きのページがある primary だけが pageToken 付きで含まれる
+    assert page_tokens(http) == [("primary", None), ("work", None), ("primary", "page-2")]
+    assert list(days) == [date(2024, 5, 1), date(2024, 5, 2), date(2024, 5, 3)]
+    # 複数のカレンダーの予定は日付ごとにまとめて開始時刻順に並ぶ
+    assert [event["summary"] for event in days[date(2024, 5, 1)]] == ["授業", "会議", "夜勤"]
+    # 日付をまたぐ予定は翌日にも（前日の開始時刻の順で）含まれる。終日の予定はその日だけ
+    assert [event["summary"] for event in days[date(2024, 5, 2)]] == ["夜勤", "休日"]
+    assert [event["summary"] for event in days[date(2024, 5, 3)]] == ["バイト"]
+
+
+def test_get_events_for_range_returns_every_day_in_range():
+    http = HttpMockSequence([batch_response({"primary": {"items": []}})])
+    service = build("calendar", "v3", http=http, static_discovery=True, cache_discovery=False)
+
+    days = get_events_for_range(service, date(2024, 5, 1), date(2024, 5, 2))
+
+    assert days == {date(2024, 5, 1): [], date(2024, 5, 2): []}
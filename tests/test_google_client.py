@@ -0,0 +1,21 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from google_client import CredentialManager
+
+
+def test_concurrent_token_writes_do_not_clobber_each_other(tmp_path):
+    token_path = str(tmp_path / "token.json")
+    # cli のワーカープロセスのように、別々の CredentialManager が同じ token.json に書き込む
+    managers = [CredentialManager(token_path=token_path) for _ in range(8)]
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        futures = [executor.submit(manager._write, f'{{"token": "{i}"}}' * 1000)
+                   for i, manager in enumerate(managers)]
+        for future in futures:
+            future.result()
+
+    assert os.listdir(tmp_path) == ["token.json"]
+    with open(token_path) as token:
+        content = token.read()
+    assert content in {f'{{"token": "{i}"}}' * 1000 for i in range(8)}
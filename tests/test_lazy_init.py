@@ -0,0 +1,40 @@
+import threading
+
+from lazy_init import LazyValue
+
+
+def test_warm_reports_failing_on_ready(capsys):
+    errors = []
+    excepthook_calls = []
+    original = threading.excepthook
+    threading.excepthook = excepthook_calls.append
+    try:
+        value = LazyValue(lambda: "model", name="gemini")
+
+        def on_ready(_):
+            raise ValueError("GOOGLE_API_KEYが設定されていません。")
+
+        value.warm(on_ready=on_ready, on_error=errors.append).join()
+    finally:
+        threading.excepthook = original
+
+    assert excepthook_calls == []
+    assert [str(error) for error in errors] == ["GOOGLE_API_KEYが設定されていません。"]
+    assert "gemini の初期化に失敗しました" in capsys.readouterr().out
+
+
+def test_warm_factory_failure_is_retried_by_get():
+    calls = []
+
+    def factory():
+        calls.append(1)
+        if len(calls) == 1:
+            raise RuntimeError("first")
+        return "ready"
+
+    value = LazyValue(factory)
+    errors = []
+    value.warm(on_error=errors.append).join()
+
+    assert len(errors) == 1 and not value.ready()
+    assert value.get() == "ready"
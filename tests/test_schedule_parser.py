@@ -0,0 +1,86 @@
+from types import SimpleNamespace
+
+import pytest
+
+from schedule_parser import (IncrementalJsonScheduleParser, IncrementalScheduleParser,
+                             parse_json_schedule, parse_schedule)
+
+TEXT = ("**07:00-08:00 朝食**\n"
+        "**08:00-12:00 授業**\n"
+        "備考の行\n"
+        "**23:00-07:00 睡眠**")
+JSON_TEXT = ('[{"start": "07:00", "end": "08:00", "activity": "朝食"}, '
+             '{"start": "08:00", "end": "12:00", "activity": "授業 {前半}"}, '
+             '{"start": "23:00", "end": "07:00", "activity": "睡眠"}]')
+
+
+def fake_chunks(text, size):
+    """Gemini のストリーミング応答の代わりに、text を size 文字ずつ返すジェネレータ"""
+    for i in range(0, len(text), size):
+        yield text[i:i + size]
+
+
+def feed_all(parser, chunks):
+    results = []
+    for chunk in chunks:
+        results.extend(parser.feed(chunk))
+    results.extend(parser.close())
+    return results
+
+
+@pytest.mark.parametrize("size", [1, 3, 7, len(TEXT)])
+def test_incremental_parser_joins_lines_split_across_chunks(size):
+    parser = IncrementalScheduleParser()
+
+    results = feed_all(parser, fake_chunks(TEXT, size))
+
+    assert [line for line, _ in results] == TEXT.split("\n")
+    assert parser.schedule == parse_schedule(TEXT)
+    assert parser.stats() == (4, 3)
+
+
+def test_incremental_parser_returns_last_line_without_newline_on_close():
+    parser = IncrementalScheduleParser()
+
+    assert parser.feed("**07:00-08:00 朝食**\n**23:00-07") == [
+        ("**07:00-08:00 朝食**", ("07:00", "08:00", "朝食"))]
+    assert parser.feed(":00 睡眠**") == []
+    assert parser.close() == [("**23:00-07:00 睡眠**", ("23:00", "07:00", "睡眠"))]
+    assert parser.close() == []
+
+
+@pytest.mark.parametrize("size", [1, 5, len(JSON_TEXT)])
+def test_incremental_json_parser_matches_full_parse(size):
+    parser = IncrementalJsonScheduleParser()
+
+    results = feed_all(parser, fake_chunks(JSON_TEXT, size))
+
+    assert [entry for _, entry in results] == parse_json_schedule(JSON_TEXT)
+    assert parser.schedule == parse_json_schedule(JSON_TEXT)
+    assert parser.stats() == (3, 3)
+
+
+def test_incremental_json_parser_counts_unfinished_object_as_rejected():
+    parser = IncrementalJsonScheduleParser()
+
+    feed_all(parser, fake_chunks(JSON_TEXT[:-30], 4))
+
+    assert parser.schedule == [("07:00", "08:00", "朝食"), ("08:00", "12:00", "授業 {前半}")]
+    assert parser.stats() == (3, 2)
+
+
+def test_stream_schedule_posts_each_completed_line():
+    calendar_app = pytest.importorskip("calendar_app")
+    posted = []
+    job = SimpleNamespace(check=lambda: None,
+                          post=lambda callback, *args: posted.append((callback, args)))
+    app = SimpleNamespace(begin_stream="begin", on_stream_line="line")
+    state = {"date": "2024-05-01", "events_list": ["08:00～12:00: 授業"]}
+
+    parser = calendar_app.CalendarApp.stream_schedule(app, job, state, fake_chunks(TEXT, 5),
+                                                      IncrementalScheduleParser())
+
+    assert posted[0] == ("begin", (state["events_list"], False))
+    assert [args[1] for callback, args in posted[1:]] == TEXT.split("\n")
+    assert all(callback == "line" for callback, _ in posted[1:])
+    assert parser.schedule == parse_schedule(TEXT)
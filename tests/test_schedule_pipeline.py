@@ -0,0 +1,32 @@
+from schedule_pipeline import SchedulePipeline
+
+
+class FakeMaster:
+    """Tk の after を記録するだけの master"""
+
+    def __init__(self):
+        self.scheduled = []
+
+    def after(self, ms, func):
+        self.scheduled.append(func)
+        return len(self.scheduled)
+
+    def after_cancel(self, after_id):
+        pass
+
+
+def test_poll_survives_failing_callback():
+    master = FakeMaster()
+    pipeline = SchedulePipeline(master)
+    ran = []
+
+    def fail():
+        raise RuntimeError("boom")
+
+    pipeline.post(fail)
+    pipeline.post(ran.append, "next")
+    master.scheduled.pop()()
+
+    assert ran == ["next"]
+    assert master.scheduled == [pipeline._poll]
+    pipeline.shutdown()
@@ -0,0 +1,54 @@
+import pytest
+
+from schedule_parser import to_minutes
+from schedule_solver import solve_schedule, validate_schedule
+
+MEAL_NAMES = ("朝食", "昼食", "夕食")
+
+
+def meal_starts(schedule):
+    return [(activity, to_minutes(start)) for start, _, activity in schedule if activity in MEAL_NAMES]
+
+
+@pytest.mark.parametrize("events", [
+    [],
+    ["10:00～12:00: 授業"],
+    ["09:00～12:00: 授業", "18:00～22:00: バイト"],
+    ["10:00～15:00: バイト"],
+    ["10:00～18:00: バイト"],
+    ["06:00～23:00: バイト"],
+])
+def test_meals_keep_their_order(events):
+    meals = meal_starts(solve_schedule(events))
+
+    assert [activity for activity, _ in meals] == [name for name in MEAL_NAMES
+                                                     if name in dict(meals)]
+    assert [start for _, start in meals] == sorted(start for _, start in meals)
+
+
+def test_dinner_moves_before_evening_work():
+    schedule = solve_schedule(["09:00～12:00: 授業", "18:00～22:00: バイト"])
+
+    assert ("16:00", "17:00", "夕食") in schedule
+    assert validate_schedule(schedule, ["09:00～12:00: 授業", "18:00～22:00: バイト"]) == []
+
+
+def test_break_follows_commute_home():
+    schedule = solve_schedule(["10:00～15:00: バイト"])
+
+    assert ("16:00", "16:15", "休憩") in schedule
+
+
+def test_meal_without_room_is_left_out_and_reported():
+    events = ["10:00～18:00: バイト"]
+    schedule = solve_schedule(events)
+
+    assert [activity for activity, _ in meal_starts(schedule)] == ["朝食", "夕食"]
+    assert validate_schedule(schedule, events) == ["昼食がありません。"]
+
+
+def test_validate_reports_meals_out_of_order():
+    schedule = [("07:30", "08:00", "昼食"), ("08:00", "09:00", "朝食"), ("18:00", "19:00", "夕食"),
+                ("23:00", "07:00", "睡眠")]
+
+    assert validate_schedule(schedule, []) == ["昼食が朝食より前にあります。"]